@@ -2,7 +2,7 @@ import sys
 import time
 import os
 import matplotlib.pyplot as plt
-from PyQt5.QtCore import QModelIndex, Qt, QLocale, qInstallMessageHandler
+from PyQt5.QtCore import QModelIndex, Qt, QLocale, QTimer, qInstallMessageHandler
 import numpy as np
 from PyQt5.QtWidgets import (
     QVBoxLayout,
@@ -40,14 +40,16 @@ from src.controls import DAQ, Instrument, Camera
 from src.blocks import Experiment
 from src.tree import Tree
 from src.plot import PlotWindow
+from src.preview import PREVIEW_INTERVAL, PreviewRenderer
+from src.writers import ChunkWriter
+from src.compression import encoder_throughput
+from src.metrics import health_summary, metrics
 from src.calculations import (
     get_dictionary,
-    shrink_array,
-    frames_acquired_from_camera_signal,
     get_baseline_frame_indices,
-    average_baseline,
 )
 import warnings
+import logging
 
 warnings.filterwarnings("ignore")
 
@@ -60,16 +62,40 @@ class App(QWidget):
         self.cwd = os.path.dirname(os.path.dirname(__file__))
         self.config = get_dictionary(os.path.join(self.cwd, "config.json"))
         self.ports = self.config["Ports"]
+        self.encoder_rate = None
+        if self.config.get("Compress Frames", False):
+            self.encoder_thread = Thread(target=self.measure_encoders, daemon=True)
+            self.encoder_thread.start()
         self.elapsed_time = 0
         self.files_saved = False
         self.save_files_after_stop = False
         self.roi_extent = None
         self.max_exposure = 4096
         self.slider_values = {
-            "Infrared": {"None": 4096, "Normal": 4096, "Logarithmic": 4096},
-            "Red": {"None": 4096, "Normal": 4096, "Logarithmic": 4096},
-            "Green": {"None": 4096, "Normal": 4096, "Logarithmic": 4096},
-            "Blue": {"None": 4096, "Normal": 4096, "Logarithmic": 4096},
+            "Infrared": {
+                "None": 4096,
+                "Normal": 4096,
+                "Logarithmic": 4096,
+                "Z-Score": 4096,
+            },
+            "Red": {
+                "None": 4096,
+                "Normal": 4096,
+                "Logarithmic": 4096,
+                "Z-Score": 4096,
+            },
+            "Green": {
+                "None": 4096,
+                "Normal": 4096,
+                "Logarithmic": 4096,
+                "Z-Score": 4096,
+            },
+            "Blue": {
+                "None": 4096,
+                "Normal": 4096,
+                "Logarithmic": 4096,
+                "Z-Score": 4096,
+            },
         }
         self.daq_generated = False
         self.onlyFloat = QDoubleValidator()
@@ -139,8 +165,11 @@ class App(QWidget):
         self.video_running = False
         try:
             self.camera.stop_signal = True
-            self.camera.video_running = False
+            self.stop_live()
             self.daq.stop_signal = True
+        except Exception as err:
+            pass
+        try:
             self.daq.camera.cam.stop_acquisition()
             print("Program Closed")
         except Exception as err:
@@ -209,6 +238,14 @@ class App(QWidget):
         self.exposure_warning_label.setStyleSheet("color: red")
         self.exposure_warning_label.setHidden(True)
 
+        self.compression_warning_label = QLabel()
+        if self.acquisition_mode:
+            self.experiment_settings_main_window.addWidget(
+                self.compression_warning_label
+            )
+        self.compression_warning_label.setStyleSheet("color: red")
+        self.compression_warning_label.setHidden(True)
+
         self.directory_window = QHBoxLayout()
         self.directory_save_files_checkbox = QCheckBox()
         self.directory_save_files_checkbox.setText("Save")
@@ -286,6 +323,7 @@ class App(QWidget):
         self.activation_map_combo.addItem("None")
         self.activation_map_combo.addItem("Normal")
         self.activation_map_combo.addItem("Logarithmic")
+        self.activation_map_combo.addItem("Z-Score")
         self.activation_map_combo.currentIndexChanged.connect(self.adjust_slider)
         self.activation_map_window.addWidget(self.activation_map_combo)
 
@@ -352,6 +390,16 @@ class App(QWidget):
         self.exposure_slider.setValue(4096)
         self.exposure_slider.valueChanged.connect(self.adjust_exposure)
         self.image_settings_main_window.addWidget(self.exposure_slider)
+
+        self.health_label = QLabel("Acquisition Health")
+        self.health_label.setFont(QFont("IBM Plex Sans", 12))
+        self.image_settings_main_window.addWidget(self.health_label)
+        self.health_panel = QLabel(health_summary(None))
+        self.health_panel.setFont(QFont("IBM Plex Mono", 9))
+        self.image_settings_main_window.addWidget(self.health_panel)
+        self.health_timer = QTimer()
+        self.health_timer.timeout.connect(self.actualize_health)
+        self.health_timer.start(1000)
         self.image_settings_main_window.addStretch()
 
         self.activate_live_preview_button = QPushButton()
@@ -387,6 +435,11 @@ class App(QWidget):
         )
         self.plot_image.axes.get_xaxis().set_visible(False)
         self.plot_image.axes.axes.get_yaxis().set_visible(False)
+        self.preview = PreviewRenderer(
+            self.image_view.canvas,
+            self.plot_image,
+            (int(1024 / self.config["Binning"]), int(1024 / self.config["Binning"])),
+        )
 
         if self.acquisition_mode:
             self.grid_layout.addWidget(self.live_preview_label, 0, 2)
@@ -947,7 +1000,9 @@ class App(QWidget):
         """Set the trigger for the DAQ"""
         if not self.acquisition_mode:
             self.run_button.setText("Run at Trigger")
-            self.daq.set_trigger(self.ports["trigger"])
+            self.daq.set_trigger(
+                self.ports["trigger"], self.ports.get("trigger terminal")
+            )
         else:
             self.run_button.setText("Run")
             self.daq.remove_trigger()
@@ -980,7 +1035,9 @@ class App(QWidget):
             self.deactivate_buttons(buttons=self.enabled_buttons)
             self.master_block = self.tree.create_blocks()
             #self.tree.baseline_values = []
-            self.tree.graph(item=self.tree.invisibleRootItem())
+            self.tree.graph(
+                item=self.tree.invisibleRootItem(), dense=not self.daq.streaming
+            )
             self.root_time, self.root_signal = (
                 self.tree.x_values,
                 [
@@ -989,10 +1046,11 @@ class App(QWidget):
                     self.tree.stim3_values,
                 ],
             )
+            self.root_segments = self.tree.segments
             self.draw(root=True)
             if self.acquisition_mode:
                 self.actualize_daq()
-                self.open_live_saving_thread()
+                self.live_save()
                 self.open_live_preview_thread()
             else:
                 self.daq.stop_signal = False
@@ -1029,44 +1087,17 @@ class App(QWidget):
         self.baseline_check_thread.start()
 
     def check_baseline(self):
-        """Monitor the incoming frames and check if the baseline is reached"""
+        """Find the baseline frames so that the camera averages them as they are acquired"""
         if len(self.daq.lights) > 0:
-            self.camera.baseline_data = []
-            self.camera.adding_frames = False
-            self.camera.completed_baseline = False
-            while self.daq.camera_signal is None:
-                pass
-            frames_acquired = frames_acquired_from_camera_signal(self.daq.camera_signal)
-            baseline_indices = get_baseline_frame_indices(
-                self.tree.baseline_values, frames_acquired
-            )
-            for baseline_pair in baseline_indices:
-                while not self.daq.stop_signal:
-                    try:
-                        if (
-                            not self.camera.adding_frames
-                            and self.camera.frames_read >= baseline_pair[0]
-                        ):
-                            self.camera.adding_frames = True
-                        elif (
-                            self.camera.adding_frames
-                            and self.camera.frames_read >= baseline_pair[1]
-                        ):
-                            self.camera.baseline_read_list = []
-                            self.camera.average_baseline = average_baseline(
-                                self.camera.baseline_data,
-                                len(self.daq.lights),
-                                self.camera.frames_read_list[0] % len(self.daq.lights),
-                            )
-                            self.camera.adding_frames = False
-                            self.camera.baseline_frames = []
-                            self.camera.baseline_completed = True
-                            self.camera.frames_read_list = []
-                            self.camera.baseline_data = []
-                            break
-                    except Exception as err:
-                        pass
-                    time.sleep(0.01)
+            self.daq.signals_ready.wait()
+            if self.daq.stop_signal:
+                return
+            with metrics.timer("baseline.indices"):
+                baseline_indices = get_baseline_frame_indices(
+                    self.tree.baseline_values, self.daq.camera_edges(), compact=True
+                )
+                self.camera.track_baselines(baseline_indices, len(self.daq.lights))
+            metrics.set("baseline.windows", len(baseline_indices))
 
     def open_start_experiment_thread(self):
         """Open the thread for the start of the experiment"""
@@ -1106,10 +1137,24 @@ class App(QWidget):
             config=self.config,
         )
         self.save_files_after_stop = True
-        self.daq.launch(self.experiment.name, self.root_time, self.root_signal)
+        self.camera.track_baselines([])
+        self.daq.launch(
+            self.experiment.name,
+            self.root_time,
+            self.root_signal,
+            self.root_segments,
+        )
+        self.protocol_thread = None
+        if self.directory_save_files_checkbox.isChecked() and self.daq.streaming:
+            self.save_protocol()
+        elif self.directory_save_files_checkbox.isChecked():
+            self.protocol_thread = Thread(target=self.save_protocol, daemon=True)
+            self.protocol_thread.start()
         if self.acquisition_mode:
             self.open_baseline_check_thread()
         self.daq.run()
+        if self.protocol_thread is not None:
+            self.protocol_thread.join()
         # if (
         #    not self.daq.stop_signal
         #    and self.save_files_after_stop
@@ -1123,148 +1168,110 @@ class App(QWidget):
                 self.experiment.save(self.roi_extent)
             except Exception as err:
                 self.experiment.save()
+        try:
+            self.camera.writer.close(save_remaining=False)
+        except Exception:
+            pass
         self.stop()
 
-    def open_live_saving_thread(self):
-        """Open the thread for the live saving"""
-        self.live_save_thread = Thread(target=self.live_save)
-        self.live_save_thread.start()
+    def save_protocol(self):
+        """Save the metadata and signals of the experiment before it ends, so a crash leaves them on disk
+
+        Streamed protocols are regenerated by the save, so they are saved before the
+        acquisition starts instead of alongside it.
+        """
+        try:
+            self.experiment.save_protocol(self.roi_extent)
+        except Exception as err:
+            pass
 
     def live_save(self):
-        """Save NPY chunked files when the number of frames is over 1200"""
-        self.camera.file_index = 0
-        self.camera.is_saving = False
+        """Create the data directory and attach a chunk writer to the camera"""
+        self.camera.writer = None
+        metrics.register("writer.queue", None)
         if self.directory_save_files_checkbox.isChecked():
+            directory = os.path.join(
+                self.directory_cell.text(), self.experiment_name_cell.text(), "data"
+            )
             try:
-                os.mkdir(
-                    os.path.join(
-                        self.directory_cell.text(), self.experiment_name_cell.text()
-                    )
-                )
-                os.mkdir(
-                    os.path.join(
-                        self.directory_cell.text(),
-                        self.experiment_name_cell.text(),
-                        "data",
-                    )
+                os.makedirs(directory, exist_ok=True)
+                compress = self.config.get("Compress Frames", False)
+                warning = None
+                if compress and self.encoder_rate is None:
+                    warning = "Compression disabled, encoders still being measured"
+                elif compress and self.encoder_rate < int(self.framerate_cell.text()):
+                    warning = f"Compression disabled, encoders reach {self.encoder_rate:.0f} fps"
+                if warning is not None:
+                    logging.warning(warning)
+                    compress = False
+                self.compression_warning_label.setText(warning or "")
+                self.compression_warning_label.setHidden(warning is None)
+                self.camera.writer = ChunkWriter(
+                    self.camera.buffer,
+                    directory,
+                    self.roi_extent,
+                    [light.name for light in self.daq.lights],
+                    compress=compress,
+                    light_datasets=self.config.get("Light Datasets", False),
+                    channels=lambda start, stop: self.camera.frame_log.channels(
+                        len(self.daq.lights), start, stop
+                    ),
                 )
             except Exception as err:
                 pass
-            while self.camera.video_running is False and not self.camera.stop_signal:
-                time.sleep(0.01)
-                pass
-            while self.camera.video_running is True:
-                if len(self.camera.frames) > 1200:
-                    self.memory = self.camera.frames[:1200]
-                    self.camera.frames = self.camera.frames[1200:]
-                    if self.directory_save_files_checkbox.isChecked():
-                        try:
-                            self.memory = shrink_array(self.memory, self.roi_extent)
-                        except Exception:
-                            pass
-                        self.camera.is_saving = True
-                        np.save(
-                            os.path.join(
-                                self.directory_cell.text(),
-                                self.experiment_name_cell.text(),
-                                "data",
-                                f"{self.camera.file_index}.npy",
-                            ),
-                            self.memory,
-                        )
-                        self.memory = None
-                        self.camera.file_index += 1
-                        self.camera.is_saving = False
-                time.sleep(0.01)
+
+    def measure_encoders(self):
+        """Measure the frame rate sustained by the compression encoders"""
+        size = int(1024 / self.config["Binning"])
+        self.encoder_rate = encoder_throughput((size, size))
 
     def open_live_preview_thread(self):
         """Open the thread for the live preview"""
+        self.camera.video_started.clear()
         self.live_preview_thread = Thread(target=self.start_live)
         self.live_preview_thread.start()
 
     def start_live(self):
-        """Start the live preview"""
-        plt.ion()
-        self.memory = []
+        """Submit the newest frame of the previewed light to the preview renderer"""
         self.camera.baseline_completed = False
         if len(self.daq.lights) > 0:
             try:
-                while self.camera.video_running is False:
-                    time.sleep(0.01)
-                    pass
+                self.camera.video_started.wait()
                 while self.camera.video_running is True:
                     try:
-                        if (
-                            not self.camera.baseline_completed
-                            or self.activation_map_combo.currentIndex() == 0
-                        ):
-                            self.plot_image.set(
-                                array=self.camera.frames[
-                                    self.live_preview_light_index :: len(
-                                        self.daq.lights
-                                    )
-                                ][-1],
-                                clim=(0, self.max_exposure),
-                                cmap="binary_r",
-                            )
-                        elif self.activation_map_combo.currentIndex() == 1:
-                            start_index = (
-                                self.camera.baseline_read_list[0]
-                                + self.live_preview_light_index
-                            ) % len(self.daq.lights)
-                            activation_map = (
-                                self.camera.baseline_frames[
-                                    start_index :: len(self.daq.lights)
-                                ][-1]
-                                - self.camera.average_baseline[
-                                    self.live_preview_light_index
-                                ]
-                            ) / self.camera.average_baseline[
+                        latest = self.camera.buffer.latest(
+                            "preview",
+                            (
                                 self.live_preview_light_index
-                            ]
-                            self.plot_image.set(
-                                array=activation_map,
-                                clim=(
-                                    -self.max_exposure / 200,
-                                    self.max_exposure / 200,
-                                ),
-                                cmap="seismic",
+                                - self.camera.frame_log.dropped
                             )
-                        else:
-                            start_index = (
-                                self.camera.baseline_read_list[0]
-                                + self.live_preview_light_index
-                            ) % len(self.daq.lights)
-                            activation_map = np.log(
-                                (
-                                    (
-                                        self.camera.baseline_frames[
-                                            start_index :: len(self.daq.lights)
-                                        ][-1]
-                                    )
-                                    / self.camera.average_baseline[
-                                        self.live_preview_light_index
-                                    ]
-                                )
-                            )
-                            self.plot_image.set(
-                                array=activation_map,
-                                clim=(
-                                    -self.max_exposure / 2000,
-                                    self.max_exposure / 2000,
-                                ),
-                                cmap="seismic",
-                            )
-
+                            % len(self.daq.lights),
+                            len(self.daq.lights),
+                        )
+                        maps = None
+                        if self.camera.baseline_completed:
+                            maps = self.camera.activation_maps
+                        if latest is not None:
+                            if self.preview.submit(
+                                latest[1],
+                                maps,
+                                self.live_preview_light_index,
+                                self.activation_map_combo.currentText(),
+                                self.max_exposure,
+                            ):
+                                metrics.increment("preview.frames")
+                            else:
+                                metrics.increment("preview.skipped")
                     except Exception as err:
-                        pass
-                    time.sleep(0.04)
+                        metrics.increment("preview.errors")
+                    time.sleep(PREVIEW_INTERVAL)
             except Exception as err:
                 pass
 
     def stop_live(self):
         """Stop the live preview"""
         self.camera.video_running = False
+        self.camera.video_started.set()
 
     def open_signal_preview_thread(self):
         """Open the thread for the signal preview"""
@@ -1281,10 +1288,16 @@ class App(QWidget):
             try:
                 position = time.time() - self.daq.start_time
                 self.plot_window.actualize(position)
-                time.sleep(1)
             except Exception as err:
-                time.sleep(1)
                 pass
+            self.daq.stopped.wait(1)
+
+    def actualize_health(self):
+        """Show the last sample of the acquisition metrics in the health panel"""
+        try:
+            self.health_panel.setText(health_summary(metrics.latest()))
+        except Exception as err:
+            pass
 
     def change_preview_light_channel(self):
         """Change the light channel for the live preview"""
@@ -1343,7 +1356,7 @@ class App(QWidget):
                 self.daq.lights.append(Instrument(self.ports["blue"], "blue"))
             self.daq.framerate = int(self.framerate_cell.text())
             self.daq.exposure = int(self.exposure_cell.text()) / 1000
-            self.camera.frames = []
+            self.camera.buffer.reset()
             self.daq.stop_signal = False
         except Exception:
             pass
@@ -1839,10 +1852,11 @@ class App(QWidget):
             print(err)
 
         try:
-            if self.live_save_thread.is_alive():
-                print("Live Save thread is alive")
-            else:
-                print("Live Save thread is dead")
+            for thread in self.camera.writer.threads:
+                if thread.is_alive():
+                    print("Chunk writer thread is alive")
+                else:
+                    print("Chunk writer thread is dead")
         except Exception as err:
             print(err)
 
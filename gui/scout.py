@@ -2,7 +2,7 @@ import sys
 import time
 import os
 import matplotlib.pyplot as plt
-from PyQt5.QtCore import Qt, QLocale
+from PyQt5.QtCore import Qt, QLocale, pyqtSignal
 import numpy as np
 from PyQt5.QtWidgets import (
     QVBoxLayout,
@@ -31,16 +31,29 @@ from src.tree import Tree
 from src.plot import PlotWindow
 from src.calculations import (
     get_dictionary,
-    shrink_array,
     frames_acquired_from_camera_signal,
     get_baseline_frame_indices,
     average_baseline,
-    get_timecourse,
     separate_images,
+    light_frame_index,
+)
+from src.recording import FrameStack, open_channels, open_frames
+from src.timecourse import TimeCourseEngine
+from src.integral import build_integral_index, open_integral_index
+from src.journal import recording_open
+from src.pyramid import (
+    PreviewScheduler,
+    build_preview_pyramid,
+    open_preview_pyramid,
+    scrub_level,
 )
 
 
 class App(QWidget):
+    time_course_ready = pyqtSignal(object)
+    indices_built = pyqtSignal()
+    frame_ready = pyqtSignal(object)
+
     def __init__(self):
         """Initialize the application"""
         super().__init__()
@@ -50,12 +63,20 @@ class App(QWidget):
         self.previous_index = 0
         self.files_to_read = True
         self.live_preview_light_index = 0
+        self.time_courses = TimeCourseEngine()
+        self.scrub_frames = None
+        self.preview_scheduler = PreviewScheduler(self.live_preview)
+        self.time_course_ready.connect(self.plot_time_course)
+        self.frame_ready.connect(self.show_frame)
+        self.indices_built.connect(lambda: self.build_indices_button.setEnabled(True))
 
         self.initUI()
 
     def closeEvent(self, *args, **kwargs):
         """Stop all processes when closing the application"""
         self.files_to_read = False
+        self.time_courses.close()
+        self.preview_scheduler.close()
 
     def initUI(self):
         """Initialize the user interface"""
@@ -146,6 +167,13 @@ class App(QWidget):
         self.make_time_course_layout.setAlignment(Qt.AlignLeft)
         self.make_time_course_layout.setAlignment(Qt.AlignTop)
         self.make_time_course_layout.addWidget(self.make_time_course_button)
+        self.build_indices_button = QPushButton("Build Indices")
+        self.build_indices_button.setIcon(
+            QIcon(os.path.join(self.cwd, "gui", "icons", "package.png"))
+        )
+        self.build_indices_button.setEnabled(False)
+        self.build_indices_button.clicked.connect(self.open_build_thread)
+        self.make_time_course_layout.addWidget(self.build_indices_button)
         self.make_time_course_container = QWidget()
         self.make_time_course_container.setLayout(self.make_time_course_layout)
         self.grid_layout.addWidget(self.make_time_course_container, 2, 1)
@@ -259,6 +287,7 @@ class App(QWidget):
         self.dimensions = self.dictionary["Dimensions"]
         self.initialize_plot()
         self.initialize_roi()
+        self.build_indices_button.setEnabled(True)
         self.open_import_thread()
 
     def initialize_plot(self):
@@ -285,28 +314,96 @@ class App(QWidget):
     def import_frames(self):
         try:
             self.frames = []
+            self.time_courses.use_index(None)
+            self.scrub_frames = None
             self.time_slider.setEnabled(False)
-            potential_data = os.listdir(os.path.join(self.directory, "data"))
-            for file in potential_data:
-                if ".npy" in file:
-                    self.concatenate_frames(file)
+            self.frames = open_frames(os.path.join(self.directory, "data"))
             self.frame_number = self.frames.shape[0]
-            self.split_frames = separate_images(self.dictionary["Lights"], self.frames)
+            self.channels = open_channels(
+                os.path.join(self.directory, "data"),
+                len(self.dictionary["Lights"]),
+                self.frame_number,
+            )
+            self.light_frames = [
+                np.flatnonzero(self.channels == index)
+                for index in range(len(self.dictionary["Lights"]))
+            ]
+            if not isinstance(self.frames, FrameStack):
+                self.frames = FrameStack([self.frames])
+            self.split_frames = separate_images(
+                self.dictionary["Lights"], self.frames, self.channels
+            )
             self.end_index.setText(f"{self.frame_number-1}")
             self.time_slider.setRange(0, self.frame_number - 1)
             self.time_slider.setEnabled(True)
             self.actualize_lights()
+            self.open_pyramid_thread()
+            self.open_index_thread()
         except Exception as err:
             pass
 
-    def concatenate_frames(self, file):
-        """Concatenate the frames in the directory"""
-        if len(self.frames) == 0:
-            self.frames = np.load(os.path.join(self.directory, "data", file))
-        else:
-            self.frames = np.concatenate(
-                (self.frames, np.load(os.path.join(self.directory, "data", file)))
+    def open_pyramid_thread(self):
+        """Open the thread that will open the preview pyramid of the recording"""
+        self.pyramid_thread = Thread(target=self.import_pyramid, daemon=True)
+        self.pyramid_thread.start()
+
+    def import_pyramid(self):
+        """Open the preview pyramid of the recording if it was built for all its frames"""
+        try:
+            levels = open_preview_pyramid(os.path.join(self.directory, "data"))
+            if levels and len(levels[0]) == self.frame_number:
+                self.scrub_frames = separate_images(
+                    self.dictionary["Lights"],
+                    FrameStack([scrub_level(levels)]),
+                    self.channels,
+                )
+        except Exception as err:
+            pass
+
+    def open_index_thread(self):
+        """Open the thread that will open the integral index of the recording"""
+        self.index_thread = Thread(target=self.import_index, daemon=True)
+        self.index_thread.start()
+
+    def import_index(self):
+        """Open the integral index of the recording if it was built for all its frames"""
+        try:
+            index = open_integral_index(os.path.join(self.directory, "data"))
+            if index is not None and len(index) == self.frame_number:
+                self.time_courses.use_index(index, self.light_frames)
+        except Exception as err:
+            pass
+
+    def open_build_thread(self):
+        """Open the thread that will build the preview pyramid and integral index of the recording
+
+        Building reads the whole recording and writes next to it, so it is only
+        done on request, and never while the recording is being acquired.
+        """
+        if recording_open(os.path.join(self.directory, "data")):
+            QMessageBox.information(
+                self,
+                "Build Indices",
+                "The recording is still being acquired or was interrupted. "
+                "Wait for the end of the acquisition or recover it first.",
             )
+            return
+        self.build_indices_button.setEnabled(False)
+        self.build_thread = Thread(target=self.build_indices, daemon=True)
+        self.build_thread.start()
+
+    def build_indices(self):
+        """Build the preview pyramid and integral index of the recording and use them"""
+        directory = self.directory
+        try:
+            build_preview_pyramid(os.path.join(directory, "data"))
+            build_integral_index(os.path.join(directory, "data"))
+            if directory == self.directory:
+                self.import_pyramid()
+                self.import_index()
+        except Exception as err:
+            pass
+        self.indices_built.emit()
 
     def set_roi(self):
         """Set the ROI"""
@@ -317,6 +414,9 @@ class App(QWidget):
         def onselect_function(eclick, erelease):
             """Save the ROI dimensions as attributes"""
             self.roi_extent = self.rect_selector.extents
+            if self.time_courses.index is not None:
+                self.roi_extent = self.time_courses.index.snap(self.roi_extent)
+                self.rect_selector.extents = self.roi_extent
             self.save_roi_button.setEnabled(True)
 
         self.rect_selector = RectangleSelector(
@@ -374,46 +474,76 @@ class App(QWidget):
         try:
             self.image_index = self.time_slider.value()
             self.current_index.setText(str(self.image_index))
-            self.open_live_preview_thread()
+            self.preview_scheduler.request(self.image_index)
         except Exception as err:
             pass
 
-    def open_live_preview_thread(self):
-        """Open the thread that will show the live preview"""
-        self.live_preview_thread = Thread(target=self.live_preview)
-        self.live_preview_thread.start()
-
-    def live_preview(self):
-        self.plot_image.set(
-            array=self.split_frames[self.live_preview_light_index][
-                self.image_index // len(self.dictionary["Lights"])
+    def live_preview(self, index, full=True):
+        """Read a frame, from the preview pyramid while scrubbing, and send it to be shown
+
+        The frame is shown by the GUI thread, as matplotlib and Qt cannot be used
+        from the thread of the preview scheduler.
+
+        Args:
+            index (int): The index of the frame in the recording
+            full (bool): If False, the frame is shown from the coarse level if it was built
+
+        Returns:
+            bool: True if the frame was read at full resolution
+        """
+        frames = self.split_frames
+        if not full and self.scrub_frames is not None:
+            frames = self.scrub_frames
+        frame = np.array(
+            frames[self.live_preview_light_index][
+                light_frame_index(
+                    self.light_frames[self.live_preview_light_index], index
+                )
             ]
         )
+        self.frame_ready.emit(frame)
+        return frames is self.split_frames
+
+    def show_frame(self, frame):
+        """Replace the shown frame, on the GUI thread"""
+        self.plot_image.set(array=frame)
+        self.plot_image.figure.canvas.draw_idle()
 
     def make_time_course(self):
+        """Open the thread that will compute the time course"""
+        self.time_course_thread = Thread(target=self.compute_time_course)
+        self.time_course_thread.start()
+
+    def compute_time_course(self):
+        """Compute the time course of the ROI, sending it to be plotted while it is computed
+
+        The time course is plotted by the GUI thread, as matplotlib and Qt cannot
+        be used from this thread.
+        """
         try:
-            if self.roi_extent:
-                y_values = get_timecourse(
-                    shrink_array(
-                        self.split_frames[self.live_preview_light_index],
-                        self.roi_extent,
-                    ),
-                    int(self.start_index.text()) // len(self.dictionary["Lights"]),
-                    int(self.end_index.text()) // len(self.dictionary["Lights"]),
-                )
-            else:
-                y_values = get_timecourse(
-                    self.split_frames[self.live_preview_light_index],
-                    int(self.start_index.text()) // len(self.dictionary["Lights"]),
-                    int(self.end_index.text()) // len(self.dictionary["Lights"]),
-                )
-            plt.figure(self.time_course.figure.number)
-            plt.ion()
-            plt.clf()
-            plt.plot(y_values)
+            light_frames = self.light_frames[self.live_preview_light_index]
+            start = light_frame_index(light_frames, int(self.start_index.text()))
+            end = light_frame_index(light_frames, int(self.end_index.text()))
+            y_values = self.time_courses.compute(
+                self.split_frames[self.live_preview_light_index],
+                self.live_preview_light_index,
+                self.roi_extent,
+                lambda values: self.time_course_ready.emit(
+                    np.array(values[start : end + 1])
+                ),
+            )
+            if y_values is not None:
+                self.time_course_ready.emit(np.array(y_values[start : end + 1]))
         except Exception as err:
             pass
 
+    def plot_time_course(self, y_values):
+        """Replace the plotted time course, on the GUI thread"""
+        plt.figure(self.time_course.figure.number)
+        plt.ion()
+        plt.clf()
+        plt.plot(y_values)
+
     def activate_buttons(self, buttons):
         """Activate the buttons in a list"""
         for button in buttons:
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class RunningBaseline:
+    def __init__(self, shape, light_count=1):
+        """A per-light running mean and variance of frames, updated by batches of frames
+
+        Only the sum and sum of squares of the frames of each light are held in
+        memory, whatever the number of averaged frames. They are accumulated in
+        float64, which is exact for integer frames over millions of frames.
+
+        Args:
+            shape (tuple): The (height, width) dimensions of a frame
+            light_count (int): The number of interleaved lights
+        """
+        self.shape = tuple(shape)
+        self.light_count = max(light_count, 1)
+        self.sums = np.zeros((self.light_count, *self.shape))
+        self.square_sums = np.zeros((self.light_count, *self.shape))
+        self.reset()
+
+    def reset(self):
+        """Forget every averaged frame"""
+        self.counts = np.zeros(self.light_count, dtype=int)
+        self.sums.fill(0)
+        self.square_sums.fill(0)
+
+    def add(self, frames, first_index=0):
+        """Add consecutive frames to the mean and variance of their light
+
+        The frames of each light are reduced in one pass over the batch, without
+        float copies of the frames.
+
+        Args:
+            frames (list of array): The frames to add
+            first_index (int): The absolute index of the first frame, which sets its light
+        """
+        frames = np.asarray(frames)
+        for offset in range(min(self.light_count, len(frames))):
+            light = (first_index + offset) % self.light_count
+            group = frames[offset :: self.light_count]
+            self.counts[light] += len(group)
+            self.sums[light] += np.einsum("ijk->jk", group, dtype=float)
+            self.square_sums[light] += np.einsum(
+                "ijk,ijk->jk", group, group, dtype=float
+            )
+
+    def average(self):
+        """Return the mean frame of each light
+
+        Returns:
+            list of array: The mean frame of each light
+        """
+        return [sums / max(count, 1) for sums, count in zip(self.sums, self.counts)]
+
+    def variance(self):
+        """Return the per-pixel sample variance of each light
+
+        Returns:
+            list of array: The variance frame of each light
+        """
+        return [
+            np.maximum(square_sums - sums * sums / max(count, 1), 0) / max(count - 1, 1)
+            for sums, square_sums, count in zip(
+                self.sums, self.square_sums, self.counts
+            )
+        ]
+
+
+class ActivationMaps:
+    def __init__(self, means, variances):
+        """Scale and offset maps turning a frame into an activation map in one pass
+
+        Each map is computed as frame * scale - offset, with scales and offsets
+        computed once when the baseline is complete.
+
+        Args:
+            means (list of array): The mean baseline frame of each light
+            variances (list of array): The variance of the baseline frames of each light
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.inverse_means = [1 / mean for mean in means]
+            self.inverse_deviations = [
+                np.where(variance > 0, 1 / np.sqrt(variance), 0)
+                for variance in variances
+            ]
+        self.standard_means = [
+            mean * inverse for mean, inverse in zip(means, self.inverse_deviations)
+        ]
+        self.output = None
+
+    def compute(self, frame, light_index, mode, step=1):
+        """Compute an activation map of a frame into a reused output array
+
+        Args:
+            frame (array): The frame
+            light_index (int): The index of the light of the frame
+            mode (str): "Normal" for (F-F0)/F0, "Logarithmic" for log(F/F0) or "Z-Score"
+            step (int): The downsampling step already applied to the frame
+
+        Returns:
+            array: The activation map, overwritten by the next call
+        """
+        if self.output is None or self.output.shape != frame.shape:
+            self.output = np.empty(frame.shape)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if mode == "Z-Score":
+                np.multiply(
+                    frame,
+                    self.inverse_deviations[light_index][::step, ::step],
+                    out=self.output,
+                )
+                self.output -= self.standard_means[light_index][::step, ::step]
+            else:
+                np.multiply(
+                    frame,
+                    self.inverse_means[light_index][::step, ::step],
+                    out=self.output,
+                )
+                if mode == "Logarithmic":
+                    np.log(self.output, out=self.output)
+                else:
+                    self.output -= 1
+        return self.output
@@ -1,5 +1,8 @@
 import json
 import os
+from src.metrics import metrics
+from src.calculations import get_dictionary
+from src.container import save_experiment
 
 
 class Stimulation:
@@ -154,12 +157,48 @@ class Experiment:
             self.directory = directory + f"/{name}"
             self.daq = daq
             self.config = config
+            self.signals_saved = False
         except Exception as err:
             pass
 
+    def save_protocol(self, extents=None):
+        """Save the metadata and signals of the experiment before it runs
+
+        A crash during the acquisition then leaves the files needed to recover
+        the recording.
+
+        Args:
+            extents (list): Positions of the ROI corners used for the experiment
+        """
+        self.save_metadata(extents)
+        self.daq.save(self.directory)
+        self.signals_saved = True
+
     def save(self, extents=None):
         """Save the experiment object to multiple files
 
+        The signals are only saved if they were not saved before the acquisition.
+
+        Args:
+            extents (list): Positions of the ROI corners used for the experiment
+        """
+        self.save_metadata(extents)
+        self.daq.camera.save()
+        metrics.save(f"{self.directory}/metrics.json")
+        if not self.signals_saved:
+            self.daq.save(self.directory)
+        try:
+            if (
+                get_dictionary(f"{self.directory}/data/index.json").get("Layout")
+                == "lights"
+            ):
+                save_experiment(f"{self.directory}/data", self.directory)
+        except Exception as err:
+            pass
+
+    def save_metadata(self, extents=None):
+        """Save the description and the configuration of the experiment
+
         Args:
             extents (list): Positions of the ROI corners used for the experiment
         """
@@ -178,8 +217,6 @@ class Experiment:
                 int(1024 / self.config["Binning"]),
             ]
         self.save_config(dimensions)
-        self.daq.camera.save(self.directory, extents)
-        self.daq.save(self.directory)
 
     def save_config(self, dimensions):
         """Save the configuration of the experiment to a file
@@ -198,6 +235,11 @@ class Experiment:
             "Exposition": self.exposition,
             "Mouse ID": self.mouse_id,
             "Dimensions": dimensions,
+            "Trigger Mode": self.daq.trigger_mode,
+            "Trigger Offset": self.daq.trigger_offset,
+            "Trigger Offset Measured": self.daq.trigger_offset_measured,
+            "Dropped Frames": self.daq.camera.frame_log.dropped,
+            "Missing Frames": self.daq.camera.frames_missing,
         }
         with open(f"{self.directory}/metadata.json", "w") as file:
             json.dump(dictionary, file)
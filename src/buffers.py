@@ -0,0 +1,328 @@
+import os
+import threading
+import numpy as np
+
+CHUNK_SIZE = 1200
+BUFFER_CHUNKS = 2
+BUFFER_MEMORY = 3 * 1024**3
+
+
+def buffer_capacity(shape, dtype=np.uint16, memory=BUFFER_MEMORY):
+    """Return the number of frames a frame buffer holds within a memory budget
+
+    The buffer holds at most BUFFER_CHUNKS chunks, and at least a chunk and a
+    quarter so that frames keep being written while a chunk is saved, even if
+    this exceeds the budget.
+
+    Args:
+        shape (tuple): The (height, width) dimensions of a frame
+        dtype (type): The data type of the frames
+        memory (int): The memory budget of the buffer in bytes
+
+    Returns:
+        int: The number of frames
+    """
+    frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return max(
+        CHUNK_SIZE + CHUNK_SIZE // 4,
+        min(CHUNK_SIZE * BUFFER_CHUNKS, memory // max(frame_bytes, 1)),
+    )
+
+
+class FrameBuffer:
+    def __init__(self, shape, capacity=None, dtype=np.uint16, memory=BUFFER_MEMORY):
+        """A fixed-capacity ring buffer of frames stored in one contiguous array
+
+        Frames are identified by their absolute index since the last reset. Each
+        consumer owns a named cursor holding the absolute index of the next frame
+        it has to read, so consumers never copy or slice a shared list.
+
+        Args:
+            shape (tuple): The (height, width) dimensions of a frame
+            capacity (int): The number of frames held in memory. Defaults to the
+                            frames fitting in the memory budget.
+            dtype (type): The data type of the frames
+            memory (int): The memory budget in bytes, used when no capacity is given
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if capacity is None:
+            capacity = buffer_capacity(self.shape, self.dtype, memory)
+        self.capacity = capacity
+        self.data = np.empty((capacity, *self.shape), dtype=self.dtype)
+        self.lock = threading.Lock()
+        self.space_available = threading.Condition(self.lock)
+        self.reset()
+
+    def reset(self):
+        """Forget every frame and remove all cursors"""
+        with self.lock:
+            self.written = 0
+            self.dropped = 0
+            self.cursors = {}
+            self.lossless = set()
+
+    def add_cursor(self, name, position=None, lossless=True):
+        """Register a consumer cursor
+
+        Args:
+            name (str): The name of the consumer
+            position (int): The absolute index of the first frame to read. Defaults to the head.
+            lossless (bool): If True, frames are never overwritten before being read
+        """
+        with self.lock:
+            if position is None:
+                position = self.written
+            self.cursors[name] = max(position, self.written - self.capacity, 0)
+            if lossless:
+                self.lossless.add(name)
+            else:
+                self.lossless.discard(name)
+
+    def remove_cursor(self, name):
+        """Unregister a consumer cursor
+
+        Args:
+            name (str): The name of the consumer
+        """
+        with self.lock:
+            self.cursors.pop(name, None)
+            self.lossless.discard(name)
+            self.space_available.notify_all()
+
+    def free(self):
+        """Return the number of frames that can be written without losing unread frames
+
+        Returns:
+            int: The number of free slots
+        """
+        if len(self.lossless) == 0:
+            return self.capacity
+        oldest = min(self.cursors[name] for name in self.lossless)
+        return self.capacity - (self.written - oldest)
+
+    def write(self, frames, timeout=None):
+        """Copy new frames in place at the head of the buffer
+
+        Slots not yet read by lossless consumers are never overwritten. The frames
+        that do not fit once the wait is over are dropped and counted.
+
+        Args:
+            frames (list of array): The frames to add
+            timeout (float): The maximum time in seconds to wait for lossless consumers
+                             to free enough slots. Defaults to None (no waiting).
+
+        Returns:
+            int: The number of frames written, the following ones being dropped
+        """
+        with self.lock:
+            if timeout is not None:
+                self.space_available.wait_for(
+                    lambda: self.free() >= len(frames), timeout
+                )
+            count = min(len(frames), self.free())
+        start = self.written
+        for offset, frame in enumerate(frames[:count]):
+            self.data[(start + offset) % self.capacity] = frame
+        with self.lock:
+            self.written = start + count
+            self.dropped += len(frames) - count
+        return count
+
+    def available(self, name):
+        """Return the number of frames a consumer has not read yet
+
+        Args:
+            name (str): The name of the consumer
+
+        Returns:
+            int: The number of unread frames
+        """
+        with self.lock:
+            return self.written - self.cursors[name]
+
+    def view(self, start, stop):
+        """Return the frames between two absolute indices
+
+        The result is a view of the buffer unless the range wraps around its end.
+
+        Args:
+            start (int): The absolute index of the first frame
+            stop (int): The absolute index after the last frame
+
+        Returns:
+            array: The requested frames
+        """
+        if start < self.written - self.capacity or stop > self.written:
+            raise IndexError("Frames are not in the buffer")
+        first, last = start % self.capacity, (stop - 1) % self.capacity + 1
+        if stop - start == 0 or first < last:
+            return self.data[first : first + stop - start]
+        return np.concatenate((self.data[first:], self.data[:last]))
+
+    def read(self, name, count):
+        """Return the next frames of a consumer without moving its cursor
+
+        Args:
+            name (str): The name of the consumer
+            count (int): The number of frames to read
+
+        Returns:
+            array: The requested frames
+        """
+        position = self.cursors[name]
+        return self.view(position, position + count)
+
+    def advance(self, name, count):
+        """Move a consumer cursor forward once its frames are processed
+
+        Args:
+            name (str): The name of the consumer
+            count (int): The number of frames processed
+        """
+        with self.lock:
+            self.cursors[name] += count
+            self.space_available.notify_all()
+
+    def latest(self, name, light_index=0, light_count=1):
+        """Return the newest unread frame of a light channel and move the cursor past it
+
+        Args:
+            name (str): The name of the consumer
+            light_index (int): The index of the light channel
+            light_count (int): The number of interleaved light channels
+
+        Returns:
+            tuple: The absolute index and a view of the frame, or None if no new frame
+        """
+        with self.lock:
+            index = self.written - 1
+            index -= (index - light_index) % light_count
+            if index < max(self.cursors[name], self.written - self.capacity):
+                return None
+            self.cursors[name] = index + 1
+            return (index, self.data[index % self.capacity])
+
+
+class FrameLog:
+    def __init__(self, capacity=CHUNK_SIZE):
+        """The framegrabber buffer index and host timestamp of each stored frame
+
+        Gaps between consecutive buffer indices are frames overwritten in the
+        framegrabber before being read, or read but not stored, and are counted
+        as dropped frames.
+
+        Args:
+            capacity (int): The initial number of frames the log can hold, doubled when full
+        """
+        self.lock = threading.Lock()
+        self.indices = np.empty(capacity, dtype=np.int64)
+        self.timestamps = np.empty(capacity)
+        self.reset()
+
+    def reset(self):
+        """Forget every logged frame"""
+        with self.lock:
+            self.count = 0
+            self.dropped = 0
+            self.gaps = []
+            self.first = None
+            self.last = None
+
+    def append(self, indices, timestamp):
+        """Log frames read together from the framegrabber
+
+        Args:
+            indices (array of int): The increasing framegrabber buffer index of each frame
+            timestamp (float): The host time at which the frames were read
+
+        Returns:
+            int: The number of frames dropped before or between these frames
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return 0
+        with self.lock:
+            if self.count + len(indices) > len(self.indices):
+                capacity = max(2 * len(self.indices), self.count + len(indices))
+                self.indices = np.resize(self.indices, capacity)
+                self.timestamps = np.resize(self.timestamps, capacity)
+            previous = indices[0] - 1 if self.last is None else self.last
+            missing = np.diff(indices, prepend=previous) - 1
+            for position in np.flatnonzero(missing > 0):
+                self.gaps.append((self.count + int(position), int(missing[position])))
+            self.indices[self.count : self.count + len(indices)] = indices
+            self.timestamps[self.count : self.count + len(indices)] = timestamp
+            self.count += len(indices)
+            if self.first is None:
+                self.first = int(indices[0])
+            self.last = int(indices[-1])
+            dropped = int(np.sum(missing[missing > 0]))
+            self.dropped += dropped
+            return dropped
+
+    def drop(self, indices):
+        """Log frames read from the framegrabber but not stored as dropped frames
+
+        Args:
+            indices (array of int): The increasing framegrabber buffer index of each frame
+        """
+        if len(indices) == 0:
+            return
+        with self.lock:
+            if self.first is None:
+                self.first = int(indices[0])
+            self.last = int(indices[-1])
+            self.gaps.append((self.count, len(indices)))
+            self.dropped += len(indices)
+
+    def following(self, count):
+        """Return the buffer indices of frames directly following the last logged frame
+
+        Args:
+            count (int): The number of frames
+
+        Returns:
+            array: The consecutive buffer indices
+        """
+        first = 0 if self.last is None else self.last + 1
+        return np.arange(first, first + count)
+
+    def acquired_index(self, position):
+        """Return the index of a logged frame among the frames acquired, dropped ones included
+
+        Args:
+            position (int): The position of the frame in the log
+
+        Returns:
+            int: The number of frames acquired before it
+        """
+        return int(self.indices[position] - self.first)
+
+    def channels(self, light_count=1, start=0, stop=None):
+        """Return the light channel of logged frames, from their buffer index
+
+        Args:
+            light_count (int): The number of interleaved lights
+            start (int): The position of the first frame in the log
+            stop (int): The position following the last frame. Defaults to the end of the log.
+
+        Returns:
+            array: The light channel index of each frame
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        acquired = self.indices[start:stop] - (self.first or 0)
+        return (acquired % max(light_count, 1)).astype(np.uint8)
+
+    def save(self, directory):
+        """Save the buffer index and host timestamp of each frame as a NPY file
+
+        Args:
+            directory (str): The directory in which to save the file
+        """
+        log = np.empty(
+            self.count, dtype=[("buffer_index", np.int64), ("timestamp", float)]
+        )
+        log["buffer_index"] = self.indices[: self.count]
+        log["timestamp"] = self.timestamps[: self.count]
+        np.save(os.path.join(directory, "frame_log.npy"), log)
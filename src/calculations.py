@@ -5,7 +5,7 @@ import time
 
 
 def shrink_array(array, extents):
-    """Reduce the dimensions of frames to match ROI and return a list of frames
+    """Reduce the dimensions of frames to match ROI without copying an existing array
 
     Args:
         array (array): Array of frames
@@ -15,7 +15,9 @@ def shrink_array(array, extents):
         array: Reduced array of frames
     """
 
-    return np.array(array)[
+    if isinstance(array, list):
+        array = np.asarray(array)
+    return array[
         :, round(extents[2]) : round(extents[3]), round(extents[0]) : round(extents[1])
     ]
 
@@ -32,8 +34,33 @@ def get_dictionary(directory):
     return dictionary
 
 
-def find_rising_indices(array):
-    """Find indices of rising edges in an array"""
+def event_changes(events, channel):
+    """Find the sample indices at which a channel of transitions changes value
+
+    Args:
+        events (array): The compacted transitions of a protocol
+        channel (int): The index of the channel
+
+    Returns:
+        array: The sorted sample indices of the changes, after the first sample
+    """
+    samples = events["sample"][events["channel"] == channel]
+    return samples[samples > 0]
+
+
+def find_rising_indices(array, channel=None):
+    """Find indices of rising edges in an array
+
+    Args:
+        array (array): The signal, or the transitions of a protocol
+        channel (int): The channel of the transitions. Defaults to the last channel.
+
+    Returns:
+        array: The indices of the rising edges"""
+    if array.dtype.names:
+        if channel is None:
+            channel = array["channel"].max(initial=0)
+        return np.concatenate(([0], event_changes(array, channel)[1::2]))
     dy = np.diff(array)
     return np.concatenate(([0], np.where(dy == 1)[0][1::2] + 1))
 
@@ -53,21 +80,38 @@ def reduce_stack(stack, indices):
     return stack[:, indices]
 
 
-def separate_images(lights, frames):
+def separate_images(lights, frames, channels=None):
     """Separate images into different light channels
 
     Args:
         lights (list): List of lights
         frames (array): Array of frames
+        channels (array): Light channel index of each frame.
+                          Defaults to the lights cycling from the first frame.
 
     Returns:
         list: List of separated images"""
     separated_images = []
     for index in range(len(lights)):
-        separated_images.append(frames[index :: len(lights), :, :])
+        if channels is None:
+            separated_images.append(frames[index :: len(lights), :, :])
+        else:
+            separated_images.append(frames[np.flatnonzero(channels == index), :, :])
     return separated_images
 
 
+def light_frame_index(frame_indices, index):
+    """Find the frame of a light acquired last at or before a frame of the recording
+
+    Args:
+        frame_indices (array): Increasing indices of the frames of the light in the recording
+        index (int): Index of a frame in the recording
+
+    Returns:
+        int: Index of the frame among the frames of the light"""
+    return max(int(np.searchsorted(frame_indices, index, "right")) - 1, 0)
+
+
 def separate_vectors(lights, vector):
     """Separate vectors into different light channels
 
@@ -103,6 +147,42 @@ def extract_from_path(path):
     return (lights, frames, vector)
 
 
+def light_extension(camera):
+    """Get the number of samples by which lights are extended around their transitions
+
+    Args:
+        camera (array): Array of camera signal values
+
+    Returns:
+        int: The extension, 40% of the first camera pulse width
+    """
+    camera_indices = np.flatnonzero(np.diff(camera))
+    return round(0.4 * (camera_indices[1] - camera_indices[0]))
+
+
+def widen_transitions(lights, extend):
+    """Set the light signals high within a number of samples of each of their transitions
+
+    Args:
+        lights (array): Array of light signals
+        extend (int): The number of samples to set high on each side of a transition
+
+    Returns:
+        array: Array of extended light signals
+    """
+    lights = np.atleast_2d(np.asarray(lights))
+    transitions = np.zeros(lights.shape, dtype=bool)
+    np.not_equal(lights[:, 1:], lights[:, :-1], out=transitions[:, :-1])
+    counts = np.zeros((lights.shape[0], lights.shape[1] + 1), dtype=np.int32)
+    np.cumsum(transitions, axis=1, out=counts[:, 1:])
+    counts = np.pad(counts, ((0, 0), (extend, extend)), mode="edge")
+    length = lights.shape[1]
+    nearby = (
+        counts[:, 2 * extend + 1 : 2 * extend + 1 + length] - counts[:, 1 : 1 + length]
+    )
+    return np.logical_or(lights, nearby > 0)
+
+
 def extend_light_signal(lights, camera):
     """Extend the light signal to be wider the camera signal
 
@@ -113,32 +193,42 @@ def extend_light_signal(lights, camera):
     Returns:
         array: Array of extended light signals
     """
-    camera_dy = np.diff(camera)
-    camera_indices = np.where(abs(camera_dy) > 0)[0]
-    difference = camera_indices[1] - camera_indices[0]
-    extend = round(0.4 * difference)
-    signal_list = []
-    for signal in lights:
-        dy = np.diff(signal)
-        differential_indices = np.where(abs(dy) > 0)[0]
-        new_signal = np.copy(signal)
-        for index in differential_indices:
-            new_signal[index - extend : index + extend] = True
-        signal_list.append(new_signal)
-    return np.stack(signal_list)
-
-
-def frames_acquired_from_camera_signal(camera_signal):
-    """Generate an array of frames acquired from the camera signal at each timepoint"""
-    dy = np.diff(camera_signal)
-    indices = np.where(abs(dy) > 0)[0][1::2]
-    y_values = np.zeros(len(camera_signal))
-    try:
-        for index in indices:
-            y_values[index:] += 1
-    except Exception:
-        pass
-    return y_values
+    return widen_transitions(lights, light_extension(camera))
+
+
+def find_camera_edges(camera_signal, channel=None):
+    """Find the sample indices at which the number of frames acquired increases
+
+    Args:
+        camera_signal (array): The camera signal, or the transitions of a protocol
+        channel (int): The camera channel of the transitions. Defaults to the last channel.
+
+    Returns:
+        array: The sorted sample indices of the counted camera edges
+    """
+    if camera_signal.dtype.names:
+        if channel is None:
+            channel = camera_signal["channel"].max(initial=0)
+        return event_changes(camera_signal, channel)[1::2] - 1
+    return np.flatnonzero(np.diff(camera_signal))[1::2]
+
+
+def frames_acquired_from_camera_signal(camera_signal, compact=False):
+    """Generate an array of frames acquired from the camera signal at each timepoint
+
+    Args:
+        camera_signal (array): The camera signal
+        compact (bool): Whether to return only the sample indices of the counted edges
+
+    Returns:
+        array: The number of frames acquired at each sample, or the edge indices if compact
+    """
+    edges = find_camera_edges(camera_signal)
+    if compact:
+        return edges
+    increments = np.zeros(len(camera_signal), dtype=int)
+    increments[edges] = 1
+    return np.cumsum(increments)
 
 
 def average_baseline(frame_list, light_count=1, start_index=0):
@@ -170,21 +260,27 @@ def average_baseline(frame_list, light_count=1, start_index=0):
     return baselines
 
 
-def get_baseline_frame_indices(baseline_indices, frames_acquired):
+def get_baseline_frame_indices(baseline_indices, frames_acquired, compact=False):
     """Get the start/end baseline indices in terms of frames acquired
 
     Args:
         baseline_indices (list of tuples): List of baseline indices tuples
-        frames_acquired (list): List of frames acquired
+        frames_acquired (list): List of frames acquired, or the camera edge indices if compact
+        compact (bool): Whether frames_acquired holds the sorted camera edge indices
 
     Returns:
         list of tuples: List of start/end baseline indices in terms of frames acquired"""
     try:
         list_of_indices = []
         for index in baseline_indices:
-            list_of_indices.append(
-                [frames_acquired[index[0]], frames_acquired[index[1]]]
-            )
+            if compact:
+                list_of_indices.append(
+                    np.searchsorted(frames_acquired, index[:2], side="right").tolist()
+                )
+            else:
+                list_of_indices.append(
+                    [frames_acquired[index[0]], frames_acquired[index[1]]]
+                )
         return list_of_indices
     except Exception as err:
         print(err)
@@ -220,5 +316,4 @@ def get_timecourse(frames, start_index, end_index):
     Returns:
         array: Array of the mean of each frame"""
 
-    first_mean = np.mean(frames[start_index : end_index + 1], axis=1)
-    return np.mean(first_mean, axis=1)
+    return np.mean(np.asarray(frames[start_index : end_index + 1]), axis=(1, 2))
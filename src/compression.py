@@ -0,0 +1,370 @@
+import os
+import copy
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+CODEC = "bitshuffle-rle"
+EXTENSION = ".wfz"
+MAGIC = b"WFZ2"
+LEGACY_MAGIC = b"WFZ1"
+KEYFRAME_INTERVAL = 8
+COMPRESSION_LEVEL = 1
+ENCODER_WORKERS = os.cpu_count() or 4
+CHUNK_HEADER = struct.Struct("<4sII")
+FRAME_HEADER = struct.Struct("<BBI")
+LEGACY_FRAME_HEADER = struct.Struct("<BB")
+RAW_DENSITY = (0.3, 0.7)
+
+
+def bitshuffle(values, planes):
+    """Split unsigned values into bit-planes and pack each plane into bytes
+
+    Each plane is read from the byte holding it, which is faster than shifting
+    the whole values.
+
+    Args:
+        values (array): The flat unsigned values
+        planes (int): The number of low bit-planes to keep
+
+    Returns:
+        list of tuple: The packed bytes and the number of set bits of each plane,
+                       from the least to the most significant
+    """
+    values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+    value_bytes = values.view(np.uint8).reshape(len(values), values.itemsize)
+    shuffled = []
+    for plane in range(planes):
+        if plane % 8 == 0:
+            byte = np.ascontiguousarray(value_bytes[:, plane // 8])
+        bits = (byte >> np.uint8(plane % 8)) & np.uint8(1)
+        shuffled.append((np.packbits(bits).tobytes(), np.count_nonzero(bits)))
+    return shuffled
+
+
+def bitunshuffle(data, planes, count, dtype=np.uint32):
+    """Rebuild unsigned values from their packed bit-planes
+
+    Args:
+        data (bytes): The packed planes, from the least to the most significant
+        planes (int): The number of planes
+        count (int): The number of values
+        dtype (type): The data type of the values
+
+    Returns:
+        array: The flat values
+    """
+    values = np.zeros(count, dtype=dtype)
+    plane_size = -(-count // 8)
+    packed = np.frombuffer(data, dtype=np.uint8)
+    for plane in range(planes):
+        bits = np.unpackbits(packed[plane * plane_size : (plane + 1) * plane_size])
+        values |= bits[:count].astype(dtype) << plane
+    return values
+
+
+def encode_frame(frame, reference=None, level=COMPRESSION_LEVEL):
+    """Losslessly compress a frame, as a difference to a reference frame if given
+
+    Differences are zigzag encoded so that small changes of either sign only use
+    the low bit-planes, and planes above the largest value are not stored.
+    Planes of sensor noise, with about as many set bits as clear ones, cannot be
+    compressed and are stored raw. The other planes are run-length encoded by
+    zlib, which is several times faster than its default strategy on them.
+
+    Args:
+        frame (array): The frame to compress
+        reference (array): The previous frame, or None for a keyframe
+        level (int): The zlib compression level
+
+    Returns:
+        bytes: The compressed frame
+    """
+    values = np.asarray(frame, dtype=np.int32).ravel()
+    if reference is not None:
+        difference = values - np.asarray(reference, dtype=np.int32).ravel()
+        values = (difference << 1) ^ (difference >> 31)
+    values = values.view(np.uint32)
+    planes = int(values.max()).bit_length() if len(values) > 0 else 0
+    if planes <= 16:
+        values = values.astype(np.uint16)
+    raw_mask, raw, sparse = 0, [], []
+    for plane, (packed, ones) in enumerate(bitshuffle(values, planes)):
+        if RAW_DENSITY[0] * len(values) < ones < RAW_DENSITY[1] * len(values):
+            raw_mask |= 1 << plane
+            raw.append(packed)
+        else:
+            sparse.append(packed)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, zlib.Z_RLE)
+    return (
+        FRAME_HEADER.pack(planes, reference is not None, raw_mask)
+        + b"".join(raw)
+        + compressor.compress(b"".join(sparse))
+        + compressor.flush()
+    )
+
+
+def decode_frame(data, shape, dtype, reference=None, legacy=False):
+    """Decompress a frame compressed by encode_frame
+
+    Args:
+        data (bytes): The compressed frame
+        shape (tuple): The (height, width) dimensions of the frame
+        dtype (type): The data type of the frame
+        reference (array): The decoded previous frame, required if the frame is a difference
+        legacy (bool): If True, the frame is in the first format, with every plane
+                       compressed by zlib
+
+    Returns:
+        array: The frame
+    """
+    count = int(np.prod(shape))
+    if legacy:
+        planes, delta = LEGACY_FRAME_HEADER.unpack_from(data)
+        shuffled = zlib.decompress(data[LEGACY_FRAME_HEADER.size :])
+    else:
+        planes, delta, raw_mask = FRAME_HEADER.unpack_from(data)
+        plane_size = -(-count // 8)
+        body = FRAME_HEADER.size + bin(raw_mask).count("1") * plane_size
+        sources = (zlib.decompress(data[body:]), data[FRAME_HEADER.size : body])
+        positions, parts = [0, 0], []
+        for plane in range(planes):
+            stored = (raw_mask >> plane) & 1
+            start = positions[stored] * plane_size
+            parts.append(sources[stored][start : start + plane_size])
+            positions[stored] += 1
+        shuffled = b"".join(parts)
+    values = bitunshuffle(shuffled, planes, count).view(np.int32)
+    if delta:
+        values = (values >> 1) ^ -(values & 1)
+        values += np.asarray(reference, dtype=np.int32).ravel()
+    return values.astype(dtype).reshape(shape)
+
+
+def encode_group(frames, level=COMPRESSION_LEVEL):
+    """Compress a group of frames, the first as a keyframe and the others as differences
+
+    Args:
+        frames (array): The frames of the group
+        level (int): The zlib compression level
+
+    Returns:
+        list of bytes: The compressed frames
+    """
+    return [
+        encode_frame(frame, frames[index - 1] if index > 0 else None, level)
+        for index, frame in enumerate(frames)
+    ]
+
+
+def write_chunk(
+    path,
+    frames,
+    pool=None,
+    keyframe_interval=KEYFRAME_INTERVAL,
+    level=COMPRESSION_LEVEL,
+):
+    """Compress a chunk of frames to a file, encoding its groups of frames in parallel
+
+    The file starts with the number of frames and the keyframe interval,
+    followed by the offset of each compressed frame in the file. Groups are
+    written in order as soon as they are encoded, so only the groups in flight
+    are held in memory.
+
+    Args:
+        path (str): The path of the chunk file
+        frames (array): The frames of the chunk
+        pool (Executor): The pool encoding the groups. Defaults to the calling thread.
+        keyframe_interval (int): The number of frames between two keyframes
+        level (int): The zlib compression level
+
+    Returns:
+        int: The size of the file in bytes
+    """
+    groups = [
+        frames[start : start + keyframe_interval]
+        for start in range(0, len(frames), keyframe_interval)
+    ]
+    if pool is None:
+        encoded = (encode_group(group, level) for group in groups)
+    else:
+        encoded = pool.map(encode_group, groups, [level] * len(groups))
+    offsets = np.zeros(len(frames) + 1, dtype=np.uint64)
+    offsets[0] = CHUNK_HEADER.size + offsets.nbytes
+    with open(path, "wb") as file:
+        file.write(CHUNK_HEADER.pack(MAGIC, len(frames), keyframe_interval))
+        file.write(offsets.tobytes())
+        index = 0
+        for payloads in encoded:
+            for payload in payloads:
+                file.write(payload)
+                offsets[index + 1] = offsets[index] + len(payload)
+                index += 1
+        file.seek(CHUNK_HEADER.size)
+        file.write(offsets.tobytes())
+    return int(offsets[-1])
+
+
+def encoder_throughput(shape, workers=ENCODER_WORKERS, level=COMPRESSION_LEVEL):
+    """Measure the number of frames per second compressed by a pool of encoders
+
+    One group of synthetic 12-bit frames with sensor-like noise is encoded by
+    each worker, so the measure takes about the time of encoding one group.
+
+    Args:
+        shape (tuple): The (height, width) dimensions of a frame
+        workers (int): The number of encoder threads
+        level (int): The zlib compression level
+
+    Returns:
+        float: The number of frames compressed per second
+    """
+    random_generator = np.random.default_rng(0)
+    frames = (
+        (
+            random_generator.integers(500, 3500, (1, *shape))
+            + random_generator.normal(0, 20, (workers * KEYFRAME_INTERVAL, *shape))
+        )
+        .clip(0, 4095)
+        .astype(np.uint16)
+    )
+    groups = [
+        frames[start : start + KEYFRAME_INTERVAL]
+        for start in range(0, len(frames), KEYFRAME_INTERVAL)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        list(pool.map(encode_group, groups, [level] * len(groups)))
+        return len(frames) / (time.perf_counter() - start)
+
+
+def compressed_chunk_files(directory):
+    """Return the compressed chunk files of a recording in acquisition order
+
+    Args:
+        directory (str): The data directory of the recording
+
+    Returns:
+        list of str: The paths of the chunk files
+    """
+    starts = [
+        int(file[: -len(EXTENSION)])
+        for file in os.listdir(directory)
+        if file.endswith(EXTENSION) and file[: -len(EXTENSION)].isdigit()
+    ]
+    return [os.path.join(directory, f"{start}{EXTENSION}") for start in sorted(starts)]
+
+
+class CompressedChunk:
+    def __init__(self, path, shape, dtype, window=None):
+        """A read-only array of the frames of a compressed chunk, decoded on access
+
+        The last decoded group of frames is kept, so consecutive frames are
+        decoded once.
+
+        Args:
+            path (str): The path of the chunk file
+            shape (tuple): The (height, width) dimensions of a frame
+            dtype (type): The data type of the frames
+            window (tuple): The row and column slices of each frame. Defaults to every pixel.
+        """
+        self.path = path
+        self.frame_shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.window = (slice(None), slice(None)) if window is None else window
+        self.ndim = 3
+        with open(path, "rb") as file:
+            magic, count, self.keyframe_interval = CHUNK_HEADER.unpack(
+                file.read(CHUNK_HEADER.size)
+            )
+            if magic not in (MAGIC, LEGACY_MAGIC):
+                raise ValueError(f"{path} is not a compressed chunk")
+            self.legacy = magic == LEGACY_MAGIC
+            self.offsets = np.frombuffer(file.read(8 * (count + 1)), dtype=np.uint64)
+        self.lock = threading.Lock()
+        self.cached = (None, None)
+
+    @property
+    def shape(self):
+        rows, columns = (
+            range(size)[axis] for size, axis in zip(self.frame_shape, self.window)
+        )
+        return (len(self.offsets) - 1, len(rows), len(columns))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def group(self, index):
+        """Decode the group of frames starting at a keyframe
+
+        Args:
+            index (int): The index of the group in the chunk
+
+        Returns:
+            array: The full frames of the group
+        """
+        with self.lock:
+            if self.cached[0] == index:
+                return self.cached[1]
+        start = index * self.keyframe_interval
+        stop = min(start + self.keyframe_interval, len(self))
+        with open(self.path, "rb") as file:
+            file.seek(int(self.offsets[start]))
+            data = file.read(int(self.offsets[stop] - self.offsets[start]))
+        frames, previous = [], None
+        for position in range(start, stop):
+            payload = data[
+                int(self.offsets[position] - self.offsets[start]) : int(
+                    self.offsets[position + 1] - self.offsets[start]
+                )
+            ]
+            previous = decode_frame(
+                payload, self.frame_shape, self.dtype, previous, self.legacy
+            )
+            frames.append(previous)
+        frames = np.stack(frames)
+        with self.lock:
+            self.cached = (index, frames)
+        return frames
+
+    def read(self, positions):
+        """Decode frames of the chunk, cropped to the window
+
+        Args:
+            positions (array): The indices of the frames in the chunk
+
+        Returns:
+            array: The frames
+        """
+        frames = np.empty((len(positions), *self.shape[1:]), dtype=self.dtype)
+        groups = positions // self.keyframe_interval
+        for group in np.unique(groups):
+            selected = groups == group
+            frames[selected] = self.group(group)[
+                (positions[selected] - group * self.keyframe_interval, *self.window)
+            ]
+        return frames
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if (
+            isinstance(key[0], slice)
+            and key[0] == slice(None)
+            and len(key) == 3
+            and all(isinstance(axis, slice) for axis in key[1:])
+            and self.window == (slice(None), slice(None))
+        ):
+            view = copy.copy(self)
+            view.window = key[1:]
+            return view
+        if isinstance(key[0], (int, np.integer)):
+            return self.read(np.array([key[0] % len(self)]))[0][key[1:]]
+        return self.read(np.arange(len(self))[key[0]])[(slice(None), *key[1:])]
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self.read(np.arange(len(self)))
+        return frames if dtype is None else frames.astype(dtype)
@@ -0,0 +1,315 @@
+import os
+import copy
+import json
+import itertools
+import threading
+import numpy as np
+from src.calculations import get_dictionary
+from src.journal import sync_directory, sync_file
+from src.signals import load_signals
+
+FRAME_CHUNKS = (32, 128, 128)
+SIGNAL_CHUNK = 180000
+ARRAY_FILE = "array.json"
+ATTRIBUTES_FILE = "attributes.json"
+
+
+class Dataset:
+    def __init__(self, path, selection=None, sync=False):
+        """A chunked array stored as one NPY file per chunk, read lazily
+
+        Chunks are named by their index along each axis, as in Zarr stores.
+        Slicing returns another dataset without reading anything, and frames are
+        only read when indexed by an integer or an array or converted to an array,
+        loading the chunks that hold selected elements only.
+
+        Args:
+            path (str): The directory of the dataset
+            selection (tuple of range): The selected indices along each axis.
+                                        Defaults to the whole array.
+            sync (bool): If True, written files are forced to the disk before being
+                         renamed over the previous ones, so a crash leaves either version
+        """
+        self.path = path
+        self.sync = sync
+        array = get_dictionary(os.path.join(path, ARRAY_FILE))
+        self.full_shape = tuple(array["Shape"])
+        self.chunks = tuple(array["Chunks"])
+        self.dtype = np.dtype(array["Dtype"])
+        self.ndim = len(self.full_shape)
+        if selection is None:
+            selection = tuple(range(size) for size in self.full_shape)
+        self.selection = selection
+        self.lock = threading.Lock()
+        self.written = self.full_shape[0] - self.full_shape[0] % self.chunks[0]
+        self.pending = np.empty((0, *self.full_shape[1:]), dtype=self.dtype)
+        if self.written < self.full_shape[0]:
+            self.pending = self.read(
+                (
+                    range(self.written, self.full_shape[0]),
+                    *(range(size) for size in self.full_shape[1:]),
+                )
+            )
+
+    @property
+    def shape(self):
+        return tuple(len(axis) for axis in self.selection)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def chunk_path(self, index):
+        """Return the path of a chunk
+
+        Args:
+            index (tuple): The index of the chunk along each axis
+
+        Returns:
+            str: The path of the chunk file
+        """
+        return os.path.join(self.path, ".".join(str(value) for value in index) + ".npy")
+
+    def replace(self, path, save):
+        """Save a file under a temporary name and rename it once complete
+
+        Args:
+            path (str): The path of the file
+            save (function): Writes the content of the file to an open binary file
+        """
+        with open(f"{path}.tmp", "wb") as file:
+            save(file)
+            if self.sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def save_array(self):
+        """Save the shape, chunk shape and data type of the dataset"""
+        array = {
+            "Shape": list(self.full_shape),
+            "Chunks": list(self.chunks),
+            "Dtype": self.dtype.name,
+        }
+        self.replace(
+            os.path.join(self.path, ARRAY_FILE),
+            lambda file: file.write(json.dumps(array).encode()),
+        )
+        if self.sync:
+            sync_directory(self.path)
+
+    def write(self, start, array):
+        """Write an array starting at a chunk boundary of the first axis
+
+        Args:
+            start (int): The index of the first element along the first axis,
+                         a multiple of the chunk length
+            array (array): The elements to write
+        """
+        grid = [range(0, size, chunk) for size, chunk in zip(array.shape, self.chunks)]
+        for corner in itertools.product(*grid):
+            index = (
+                (start + corner[0]) // self.chunks[0],
+                *(value // chunk for value, chunk in zip(corner[1:], self.chunks[1:])),
+            )
+            elements = array[
+                tuple(
+                    slice(value, value + chunk)
+                    for value, chunk in zip(corner, self.chunks)
+                )
+            ]
+            elements = np.ascontiguousarray(elements)
+            self.replace(self.chunk_path(index), lambda file: np.save(file, elements))
+        if self.sync:
+            sync_directory(self.path)
+
+    def append(self, frames):
+        """Append elements along the first axis, writing every complete chunk
+
+        The elements of the last incomplete chunk are kept in memory, so that the
+        chunk is rewritten whole once it is complete.
+
+        Args:
+            frames (array): The elements to append
+        """
+        with self.lock:
+            if len(frames) == 0:
+                return
+            pending = np.concatenate((self.pending, np.asarray(frames, self.dtype)))
+            complete = len(pending) - len(pending) % self.chunks[0]
+            if complete > 0:
+                self.write(self.written, pending[:complete])
+            self.written += complete
+            self.pending = pending[complete:]
+            self.full_shape = (self.written + len(self.pending), *self.full_shape[1:])
+            self.selection = (range(self.full_shape[0]), *self.selection[1:])
+
+    def flush(self):
+        """Write the last incomplete chunk and save the shape of the dataset"""
+        with self.lock:
+            if len(self.pending) > 0:
+                self.write(self.written, self.pending)
+            self.save_array()
+
+    def read(self, selection):
+        """Read selected elements, loading only the chunks that hold some of them
+
+        Args:
+            selection (tuple of array): The indices selected along each axis
+
+        Returns:
+            array: The selected elements
+        """
+        output = np.empty(tuple(len(axis) for axis in selection), dtype=self.dtype)
+        chunk_indices = [
+            np.asarray(axis, dtype=np.int64) // chunk
+            for axis, chunk in zip(selection, self.chunks)
+        ]
+        for index in itertools.product(
+            *(np.unique(indices) for indices in chunk_indices)
+        ):
+            chunk = np.load(self.chunk_path(index), mmap_mode="r")
+            inside = [indices == value for indices, value in zip(chunk_indices, index)]
+            local = [
+                np.asarray(axis)[mask] - value * size
+                for axis, mask, value, size in zip(
+                    selection, inside, index, self.chunks
+                )
+            ]
+            output[np.ix_(*inside)] = chunk[np.ix_(*local)]
+        return output
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if all(isinstance(axis, slice) for axis in key):
+            view = copy.copy(self)
+            view.selection = tuple(
+                axis[value] for axis, value in zip(self.selection, key)
+            )
+            return view
+        selection = tuple(
+            np.atleast_1d(np.asarray(axis)[value])
+            for axis, value in zip(self.selection, key)
+        )
+        elements = self.read(selection)
+        return elements[
+            tuple(
+                0 if isinstance(value, (int, np.integer)) else slice(None)
+                for value in key
+            )
+        ]
+
+    def __array__(self, dtype=None, copy=None):
+        elements = self.read(self.selection)
+        return elements if dtype is None else elements.astype(dtype)
+
+
+def create_dataset(path, shape, chunks, dtype, sync=False):
+    """Create an empty chunked dataset
+
+    Args:
+        path (str): The directory of the dataset
+        shape (tuple): The initial shape of the dataset
+        chunks (tuple): The shape of each chunk
+        dtype (type): The data type of the elements
+        sync (bool): If True, written files are forced to the disk
+
+    Returns:
+        Dataset: The dataset
+    """
+    os.makedirs(path, exist_ok=True)
+    for file in os.listdir(path):
+        if file.endswith((".npy", ".tmp")):
+            os.remove(os.path.join(path, file))
+    with open(os.path.join(path, ARRAY_FILE), "w") as file:
+        json.dump(
+            {
+                "Shape": list(shape),
+                "Chunks": list(chunks),
+                "Dtype": np.dtype(dtype).name,
+            },
+            file,
+        )
+    if sync:
+        sync_file(os.path.join(path, ARRAY_FILE))
+    return Dataset(path, sync=sync)
+
+
+def save_dataset(path, array, chunks):
+    """Save a whole array as a chunked dataset
+
+    Args:
+        path (str): The directory of the dataset
+        array (array): The array to save
+        chunks (tuple): The shape of each chunk
+
+    Returns:
+        Dataset: The dataset
+    """
+    array = np.asarray(array)
+    dataset = create_dataset(path, array.shape, chunks, array.dtype)
+    dataset.write(0, array)
+    return dataset
+
+
+def light_path(directory, light):
+    """Return the directory of the dataset of a light channel
+
+    Args:
+        directory (str): The data directory of the recording
+        light (str): The name of the light
+
+    Returns:
+        str: The directory of the dataset
+    """
+    return os.path.join(directory, "lights", light)
+
+
+def open_light_datasets(directory, lights):
+    """Open the dataset of each light channel of a recording
+
+    Args:
+        directory (str): The data directory of the recording
+        lights (list of str): The names of the lights
+
+    Returns:
+        list of Dataset: The dataset of each light
+    """
+    return [Dataset(light_path(directory, light)) for light in lights]
+
+
+def save_experiment(directory, experiment_directory):
+    """Copy the metadata and signals of an experiment into its recording
+
+    The metadata is saved as the attributes of the recording, and the stimulation
+    signals and light data of each frame as datasets chunked along time.
+
+    Args:
+        directory (str): The data directory of the recording
+        experiment_directory (str): The directory of the experiment files
+    """
+    try:
+        attributes = get_dictionary(os.path.join(experiment_directory, "metadata.json"))
+        with open(os.path.join(directory, ATTRIBUTES_FILE), "w") as file:
+            json.dump(attributes, file)
+    except FileNotFoundError:
+        pass
+    try:
+        stim_signal = load_signals(os.path.join(experiment_directory, "stim_signal"))
+        save_dataset(
+            os.path.join(directory, "signals", "stim_signal"),
+            stim_signal,
+            (len(stim_signal), SIGNAL_CHUNK),
+        )
+    except FileNotFoundError:
+        pass
+    try:
+        light_signal = np.load(os.path.join(experiment_directory, "light_signal.npy"))
+        save_dataset(
+            os.path.join(directory, "signals", "light_signal"),
+            light_signal,
+            (len(light_signal), SIGNAL_CHUNK),
+        )
+    except FileNotFoundError:
+        pass
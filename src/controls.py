@@ -1,22 +1,38 @@
 import time
 import sys
 import os
+import threading
 
 try:
     import nidaqmx
-    from nidaqmx.constants import AcquisitionType
+    from nidaqmx.constants import AcquisitionType, RegenerationMode, Signal
     from pylablib.devices import IMAQ
+    from pylablib.devices.IMAQ import IMAQTimeoutError
 except ModuleNotFoundError:
-    pass
+    from src.simulation import AcquisitionType, RegenerationMode, Signal
+
+    IMAQTimeoutError = TimeoutError
 import numpy as np
 from src.calculations import (
     extend_light_signal,
-    shrink_array,
-    find_rising_indices,
+    find_camera_edges,
     reduce_stack,
     get_dictionary,
 )
-from src.waveforms import digital_square
+from src.waveforms import digital_square, light_events, segment_events, stream_events
+from src.buffers import FrameBuffer, FrameLog
+from src.signals import (
+    encode_runs,
+    line_changes,
+    pack_lines,
+    remove_signals,
+    save_runs,
+    save_signals,
+    unpack_lines,
+)
+from src.baselines import ActivationMaps, RunningBaseline
+from src.metrics import metrics
+from src.simulation import TRIGGER_DELAY, SimulatedTask, SimulatedCamera
 import warnings
 import logging
 
@@ -31,6 +47,13 @@ config = get_dictionary(
     os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.json")
 )
 
+WRITE_TIMEOUT = 1
+STREAM_BLOCK = 3000
+PACK_BLOCK = 3000 * 60
+STREAM_LOOKAHEAD = 4
+HARDWARE_TRIGGER_OFFSET = 1 / 3000
+TRIGGER_POLL_INTERVAL = 0.001
+
 
 class Instrument:
     def __init__(self, port, name):
@@ -53,19 +76,36 @@ class Camera(Instrument):
             name (str): The name of the camera (can be found using NI-MAX)
         """
         super().__init__(port, name)
-        self.frames = []
-        self.baseline_frames = []
+        self.buffer = FrameBuffer(
+            (int(1024 / config["Binning"]), int(1024 / config["Binning"])),
+            memory=config.get("Buffer Memory", 3072) * 1024**2,
+        )
+        self.writer = None
+        self.baseline_lock = threading.Lock()
+        self.baseline = None
+        self.baseline_windows = []
+        self.baseline_completed = False
+        self.average_baseline = None
+        self.activation_maps = None
         self.stop_signal = False
         self.frames_read = 0
+        self.frame_log = FrameLog()
+        self.frames_behind = 0
+        self.frames_missing = 0
         self.video_running = False
-        try:
-            self.set_binning(config["Binning"])
-            self.cam = IMAQ.IMAQCamera("img0")
-            self.set_window(config["Binning"])
-            self.cam.setup_acquisition()
+        self.video_started = threading.Event()
+        if config.get("Simulated", False):
+            self.cam = SimulatedCamera(self.buffer.shape)
             self.cam.start_acquisition()
-        except Exception as err:
-            pass
+        else:
+            try:
+                self.set_binning(config["Binning"])
+                self.cam = IMAQ.IMAQCamera("img0")
+                self.set_window(config["Binning"])
+                self.cam.setup_acquisition()
+                self.cam.start_acquisition()
+            except Exception as err:
+                pass
 
     def initialize(self, daq):
         """Initialize / Reset the camera parameters
@@ -75,10 +115,20 @@ class Camera(Instrument):
         """
         self.daq = daq
         self.daq.stop_signal = False
-        self.frames = []
-        self.frames_read_list = []
-        self.baseline_read_list = []
-        self.frames_read = 0
+        self.buffer.reset()
+        self.buffer.add_cursor("preview", lossless=False)
+        if self.writer is not None:
+            self.writer.start()
+        with self.baseline_lock:
+            if self.baseline is not None:
+                self.baseline.reset()
+            self.frames_read = 0
+            self.frame_log.reset()
+            self.frames_behind = 0
+            self.frames_missing = 0
+        metrics.register(
+            "buffer.used", lambda: self.buffer.capacity - self.buffer.free()
+        )
 
     def set_binning(self, binning):
         """Set the binning of the camera
@@ -122,47 +172,168 @@ class Camera(Instrument):
         self.cam.read_multiple_images()
 
     def loop(self, task):
-        """While camera is running, add each acquired frame to a frames list
+        """While camera is running, write each acquired frame to the frame buffer
+
+        Frames skipped by the framegrabber are detected from its buffer indices,
+        and the number of frames acquired is compared to the camera edges generated.
 
         Args:
             task (Task): The nidaqmx task used to track if acquisition is finished
         """
         self.task = task
-        while task.is_task_done() is False and self.daq.stop_signal is False:
+        errors = set()
+        try:
+            edges = self.daq.camera_edges()
+        except Exception:
+            edges = None
+        while not self.daq.finished.is_set():
             try:
                 self.cam.wait_for_frame(timeout=0.1)
-                new_frames = self.cam.read_multiple_images()
-                self.frames += new_frames
+                with metrics.timer("camera.read"):
+                    self.store(*self.read_frames())
                 self.video_running = True
-                if self.adding_frames:
-                    self.baseline_data += new_frames
-                    self.frames_read_list.append(self.frames_read)
-                if self.baseline_completed:
-                    self.baseline_frames += new_frames
-                    self.baseline_read_list.append(self.frames_read)
-                self.frames_read += len(new_frames)
-            except Exception as err:
+                self.video_started.set()
+                self.check_expected(edges)
+            except (TimeoutError, IMAQTimeoutError):
                 pass
-        self.frames += self.cam.read_multiple_images()
+            except Exception as err:
+                metrics.increment("camera.errors")
+                if str(err) not in errors:
+                    errors.add(str(err))
+                    logging.error(f"Frame acquisition failed: {err}")
+        self.store(*self.read_frames())
         self.video_running = False
+        if edges is not None and not self.daq.stop_signal:
+            self.frames_missing = max(
+                len(edges) + 1 - self.frames_read - self.frame_log.dropped, 0
+            )
+            if self.frames_missing > 0:
+                logging.warning(
+                    f"{self.frames_missing} frames were never received from the camera"
+                )
+
+    def read_frames(self):
+        """Read the frames available in the framegrabber with their buffer indices
+
+        Returns:
+            tuple: The new frames and the framegrabber buffer index of each frame
+        """
+        frames, info = self.cam.read_multiple_images(return_info=True)
+        return frames, [frame.frame_index for frame in info]
 
-    def save(self, directory, extents):
-        """Save the acquired frames (reduced if necessary) to a 3D NPY file
+    def check_expected(self, edges):
+        """Count the frames the camera should have acquired but were not received yet
 
         Args:
-            directory (str): The location in which to save the NPY file
-            extents (tuple): The positions of the corners used to resize the frames
-                             Equal to None if original size is kept
+            edges (array): The sample indices of the camera edges, or None if unknown
         """
-        try:
-            if extents:
-                self.frames = shrink_array(self.frames, extents)
-            if self.is_saving:
-                while self.is_saving:
+        if edges is None:
+            return
+        expected = int(
+            np.searchsorted(edges, self.task.out_stream.total_samp_per_chan_generated)
+        )
+        self.frames_behind = max(
+            expected - self.frames_read - self.frame_log.dropped, 0
+        )
+        metrics.set("camera.behind", self.frames_behind)
+
+    def store(self, new_frames, buffer_indices=None):
+        """Write new frames to the frame buffer and hand full chunks to the writer
+
+        Frames that the buffer cannot hold without overwriting unsaved frames are
+        logged as dropped.
+
+        Args:
+            new_frames (list of array): The frames read from the framegrabber
+            buffer_indices (list of int): The framegrabber buffer index of each frame.
+                                          Defaults to the frames following the last one.
+        """
+        if buffer_indices is None:
+            buffer_indices = self.frame_log.following(len(new_frames))
+        if self.writer is None:
+            stored = self.buffer.write(new_frames)
+        else:
+            stored = self.buffer.write(new_frames, timeout=WRITE_TIMEOUT)
+        dropped = self.frame_log.append(buffer_indices[:stored], time.time())
+        if self.writer is not None:
+            self.writer.poll()
+        metrics.increment("camera.frames", len(new_frames))
+        if dropped > 0:
+            metrics.increment("camera.dropped", dropped)
+            logging.warning(
+                f"{dropped} frames dropped by the framegrabber after frame {self.frames_read}"
+            )
+        if stored < len(new_frames):
+            self.frame_log.drop(buffer_indices[stored:])
+            metrics.increment("camera.dropped", len(new_frames) - stored)
+            metrics.increment("buffer.dropped", len(new_frames) - stored)
+            logging.warning(
+                f"{len(new_frames) - stored} frames dropped by the full frame buffer after frame {self.frames_read + stored}"
+            )
+        with self.baseline_lock:
+            if stored > 0:
+                self.accumulate(
+                    self.frame_log.acquired_index(self.frames_read),
+                    new_frames[:stored],
+                )
+            self.frames_read += stored
+
+    def track_baselines(self, windows, light_count=1):
+        """Average the frames of baseline windows as they are acquired
+
+        Frames of the first window that were already acquired are read back from
+        the frame buffer.
+
+        Args:
+            windows (list of list): The start and stop frame indices of each baseline
+            light_count (int): The number of interleaved lights
+        """
+        with self.baseline_lock:
+            self.baseline_windows = [[int(start), int(stop)] for start, stop in windows]
+            self.baseline = RunningBaseline(self.buffer.shape, light_count)
+            if len(self.baseline_windows) > 0 and self.frames_read > 0:
+                start = max(
+                    self.baseline_windows[0][0], self.frames_read - self.buffer.capacity
+                )
+                try:
+                    self.accumulate(start, self.buffer.view(start, self.frames_read))
+                except IndexError:
                     pass
-            np.save(
-                os.path.join(directory, "data", f"{self.file_index}.npy"), self.frames
+
+    def accumulate(self, first_index, frames):
+        """Add the frames falling in the current baseline window to its running mean
+
+        Args:
+            first_index (int): The absolute index of the first frame
+            frames (list of array): Consecutive frames
+        """
+        last_index = first_index + len(frames)
+        while len(self.baseline_windows) > 0:
+            start, stop = self.baseline_windows[0]
+            first, last = max(start, first_index), min(stop, last_index)
+            if first < last:
+                self.baseline.add(
+                    frames[first - first_index : last - first_index], first
+                )
+            if last_index < stop:
+                break
+            self.average_baseline = self.baseline.average()
+            self.activation_maps = ActivationMaps(
+                self.average_baseline, self.baseline.variance()
             )
+            self.baseline_completed = True
+            self.baseline_windows.pop(0)
+            self.baseline.reset()
+
+    def save(self):
+        """Save the frames of the last partial chunk, wait for the chunk writer and save the frame log
+
+        The light channel of each frame is deduced from its framegrabber buffer
+        index, so that dropped frames do not shift the following channels.
+        """
+        try:
+            self.writer.close(channels=self.frame_log.channels(len(self.daq.lights)))
+            self.frame_log.save(self.writer.directory)
         except Exception as err:
             pass
 
@@ -180,17 +351,40 @@ class DAQ:
             exposure (float): The exposure time in seconds
         """
         self.name = name
+        self.streaming = config.get("Stream Output", False)
         self.trigger_activated = False
-        self.trigger_port = None
+        self.trigger_port, self.trigger_terminal = None, None
+        self.hardware_trigger = config.get("Hardware Trigger", False)
+        self.trigger_mode, self.trigger_offset = None, None
+        self.trigger_offset_measured = False
         self.framerate, self.exposure = framerate, exposure
+        self.stopped = threading.Event()
+        self.finished = threading.Event()
+        self.triggered = threading.Event()
+        self.signals_ready = threading.Event()
         self.stop_signal = False
         self.lights, self.stimuli, self.camera = lights, stimuli, camera
-        self.tasks, self.light_signals, self.stim_signal, self.camera_signal = (
-            [],
-            [],
-            [],
-            None,
-        )
+        self.tasks, self.stim_signal, self.digital_lines = [], [], None
+
+    @property
+    def stop_signal(self):
+        """Whether the acquisition was asked to stop"""
+        return self.stopped.is_set()
+
+    @stop_signal.setter
+    def stop_signal(self, value):
+        """Ask the acquisition to stop, waking every thread waiting on the DAQ
+
+        Args:
+            value (bool): True to stop, False to allow a new acquisition
+        """
+        if value:
+            self.stopped.set()
+            self.finished.set()
+            self.triggered.set()
+            self.signals_ready.set()
+        else:
+            self.stopped.clear()
 
     def close_all_lights(self, ports):
         self.lights = [
@@ -200,9 +394,9 @@ class DAQ:
             Instrument(ports["blue"], "blue"),
         ]
 
-        if config["Widefield Computer"]:
-            with nidaqmx.Task(new_task_name="lights") as l_task:
-                with nidaqmx.Task(new_task_name="a_stimuli") as s_task:
+        if config["Widefield Computer"] or config.get("Simulated", False):
+            with self.new_task("lights") as l_task:
+                with self.new_task("a_stimuli") as s_task:
                     for light in self.lights:
                         l_task.do_channels.add_do_chan(f"{self.name}/{light.port}")
                     l_task.do_channels.add_do_chan(f"{self.name}/{self.camera.port}")
@@ -236,32 +430,61 @@ class DAQ:
 
         self.lights = []
 
-    def launch(self, name, time_values, stim_values):
+    def new_task(self, name):
+        """Create a nidaqmx task, or a simulated task when no hardware is used
+
+        Args:
+            name (str): The name of the task
+
+        Returns:
+            Task: The created task
+        """
+        if config.get("Simulated", False):
+            return SimulatedTask(name, self.camera)
+        return nidaqmx.Task(new_task_name=name)
+
+    def launch(self, name, time_values, stim_values, segments=None):
         """Generate stimulation, light and camera signal and write them to the DAQ
 
+        In streaming mode, only the segments are kept and the signals are generated
+        block by block while the DAQ is running.
+
         Args:
             name (str): The name of the experiment
             time_values (array): A array containing the time values
             stim_values (array): A array containing the stimulation values
+            segments (list of dict): The segments of the protocol, required in streaming mode
         """
         self.reset_daq()
         self.experiment_name = name
+        if self.streaming:
+            self.segments = segments
+            self.sample_count = sum(segment["samples"] for segment in segments)
+            self.seed = np.random.randint(2**31)
+            self.signals_ready.set()
+            return
         self.time_values = time_values
         self.stim_values = stim_values
+        self.sample_count = len(time_values)
         self.generate_stim_wave()
         if len(self.lights) > 0:
-            self.generate_light_wave()
             self.generate_camera_wave()
-            if config["Extend Signal"]:
-                self.extend_light_wave()
-        
+        self.signals_ready.set()
+
     def run(self):
         self.write_waveforms()
 
-    def set_trigger(self, port):
-        """Set the trigger port and activate it"""
+    def set_trigger(self, port, terminal=None):
+        """Set the trigger port and activate it
+
+        Args:
+            port (str): The digital line read to detect the trigger edge
+            terminal (str): The PFI terminal wired to the same signal, from which the
+                            hardware start trigger is routed. Defaults to no terminal.
+        """
         self.trigger_activated = True
         self.trigger_port = port
+        self.trigger_terminal = terminal
 
     def remove_trigger(self):
         """Deactivate the trigger"""
@@ -275,48 +498,141 @@ class DAQ:
         self.stim_signal[1][-1] = 0
         self.d_stim_signal[-1] = False
 
-    def generate_light_wave(self):
-        """Generate a light signal for each light used and set the last value to zero"""
-        self.light_signals = []
-        for potential_light_index in range(4):
-            if potential_light_index < len(self.lights):
-                signal = digital_square(
-                    self.time_values,
+    def generate_light_wave(self, start=0, stop=None):
+        """Generate a light signal for each light used and set the last value to zero
+
+        Args:
+            start (int): The index of the first sample. Defaults to the start of the protocol.
+            stop (int): The index after the last sample. Defaults to the end of the protocol.
+
+        Returns:
+            list of array: The signal of each light between the two samples
+        """
+        stop = self.sample_count if stop is None else stop
+        light_signals = []
+        for light_index in range(len(self.lights)):
+            delay = int(light_index * 3000 / (self.framerate))
+            signal = np.zeros(stop - start, dtype=bool)
+            first = max(start, delay)
+            if first < stop:
+                signal[first - start :] = digital_square(
+                    self.time_values[first - delay : stop - delay],
                     self.framerate / len(self.lights),
                     self.framerate * self.exposure / len(self.lights),
-                    int(potential_light_index * 3000 / (self.framerate)),
                 )
+            if stop == self.sample_count:
                 signal[-1] = False
-                self.light_signals.append(signal)
-        if len(self.light_signals) > 1:
-            self.stacked_lights = np.stack((self.light_signals))
-        else:
-            self.stacked_lights = self.light_signals
+            light_signals.append(signal)
+        return light_signals
 
     def generate_camera_wave(self):
-        """Generate camera signal using the light signals and add it to the list of all signals"""
-        try:
-            self.camera_signal = np.max(np.vstack((self.stacked_lights)), axis=0)
-        except ValueError:
-            self.camera_signal = np.zeros(len(self.stim_signal[0]))
-        self.all_signals = np.stack(self.light_signals + [self.camera_signal])
-        self.allz_signals = np.stack(
-            self.light_signals + [self.camera_signal] + [self.d_stim_signal]
+        """Generate the light and camera signals and pack them with the digital stimulation
+
+        The lines are generated and packed into bit-planes block by block, so only
+        the bit-planes and the boolean lines of one block are held in memory.
+        """
+        self.digital_lines = np.empty(
+            (-(-(len(self.lights) + 2) // 8), self.sample_count), dtype=np.uint8
         )
+        for start in range(0, self.sample_count, PACK_BLOCK):
+            stop = min(start + PACK_BLOCK, self.sample_count)
+            light_signals = self.generate_light_wave(start, stop)
+            camera_signal = light_signals[0].copy()
+            for signal in light_signals[1:]:
+                camera_signal |= signal
+            self.digital_lines[:, start:stop] = pack_lines(
+                light_signals + [camera_signal, self.d_stim_signal[start:stop]]
+            )
+        self.d_stim_signal = None
+
+    def digital_signals(self):
+        """Unpack the light, camera and digital stimulation lines to write them to the DAQ
+
+        Returns:
+            array: The boolean signal of each line
+        """
+        return unpack_lines(self.digital_lines, len(self.lights) + 2)
 
     def extend_light_wave(self):
-        """Extend the light signal to be wider than the camera signal"""
-        self.stacked_lights = extend_light_signal(
-            self.stacked_lights, self.camera_signal
+        """Return the light signals extended to be wider than the camera signal
+
+        Returns:
+            array: The extended light signals
+        """
+        lines = unpack_lines(self.digital_lines, len(self.lights) + 1)
+        return extend_light_signal(lines[:-1], lines[-1])
+
+    def generate_light_block(self, start, stop):
+        """Generate the light signals between two sample indices of the protocol
+
+        Args:
+            start (int): The index of the first sample
+            stop (int): The index after the last sample
+
+        Returns:
+            array: The stacked light signals
+        """
+        samples = np.arange(start, stop)
+        lights = []
+        for light_index in range(len(self.lights)):
+            delay = int(light_index * 3000 / (self.framerate))
+            signal = digital_square(
+                (samples - delay) / 3000,
+                self.framerate / len(self.lights),
+                self.framerate * self.exposure / len(self.lights),
+            )
+            signal[samples < delay] = False
+            if stop == self.sample_count:
+                signal[-1] = False
+            lights.append(signal)
+        return np.stack(lights)
+
+    def stream_blocks(self):
+        """Generate the analog and digital signals of the protocol block by block
+
+        The stimulation signals are rendered from the transitions of the protocol,
+        so only the transitions and one block are held in memory.
+
+        Yields:
+            tuple: The analog stimulation block and the digital block
+        """
+        random_state = np.random.RandomState(self.seed)
+        events, _ = segment_events(self.segments, random_state)
+        start = 0
+        for stimuli in stream_events(events, self.sample_count, STREAM_BLOCK):
+            stop = start + stimuli.shape[1]
+            analog, stim3 = stimuli[:2], stimuli[2].astype(bool)
+            if stop == self.sample_count:
+                analog[:, -1] = 0
+                stim3[-1] = False
+            if len(self.lights) > 0:
+                lights = self.generate_light_block(start, stop)
+                digital = np.vstack((lights, np.max(lights, axis=0), stim3))
+            else:
+                digital = stim3
+            yield (analog, digital)
+            start = stop
+
+    def camera_edges(self):
+        """Return the sample indices at which the frames acquired counter increases
+
+        Returns:
+            array: The sample indices of the counted camera edges
+        """
+        if not self.streaming:
+            return line_changes(self.digital_lines, len(self.lights))[1::2]
+        events = light_events(
+            self.sample_count, self.framerate, self.exposure, len(self.lights)
         )
+        return find_camera_edges(events, len(self.lights))
 
     def write_waveforms(self):
         """Write lights, stimuli and camera signal to the DAQ"""
 
-        if config["Widefield Computer"]:
-            with nidaqmx.Task(new_task_name="lights") as l_task:
+        if config["Widefield Computer"] or config.get("Simulated", False):
+            with self.new_task("lights") as l_task:
                 self.control_task = l_task
-                with nidaqmx.Task(new_task_name="a_stimuli") as s_task:
+                with self.new_task("a_stimuli") as s_task:
                     null_lights = [[False, False]]
                     self.tasks = [l_task, s_task]
                     for light in self.lights:
@@ -337,62 +653,162 @@ class DAQ:
                             )
                             null_lights.append([False, False])
                     self.camera.initialize(self)
-                    self.sample([s_task, l_task], self.stim_signal[0])
+                    metrics.reset()
+                    metrics.start()
+                    with metrics.timer("daq.load"):
+                        self.load([s_task, l_task])
                     if len(self.lights) > 0:
-                        self.write(
-                            [s_task, l_task], [self.stim_signal, self.allz_signals]
-                        )
                         self.camera.delete_frames()
-                        if self.trigger_activated:
-                            with nidaqmx.Task(new_task_name="trigger") as t_task:
-                                t_task.di_channels.add_di_chan(
-                                    (f"{self.name}/{self.trigger_port}")
-                                )
-                                while True:
-                                    time.sleep(0.001)
-                                    if t_task.read():
-                                        break
-                        self.start_time = time.time()
-                        self.start([s_task, l_task])
-                        self.camera.loop(l_task)
+                        self.watch(l_task)
+                        if self.trigger_start([s_task, l_task]):
+                            self.camera.loop(l_task)
                         self.stop([s_task, l_task])
+                        self.disarm([s_task, l_task])
                         s_task.write([[0, 0], [0, 0]])
                         l_task.write(null_lights)
                         self.start([s_task, l_task])
                     else:
-                        self.write(
-                            [s_task, l_task], [self.stim_signal, self.d_stim_signal]
-                        )
                         self.camera.delete_frames()
-                        if self.trigger_activated:
-                            with nidaqmx.Task(new_task_name="trigger") as t_task:
-                                t_task.di_channels.add_di_chan(
-                                    (f"{self.name}/{self.trigger_port}")
-                                )
-                                while True:
-                                    time.sleep(0.001)
-                                    if t_task.read():
-                                        break
-                        self.start_time = time.time()
-                        self.start([s_task, l_task])
-                        while (
-                            s_task.is_task_done() is False and self.stop_signal is False
-                        ):
-                            time.sleep(0.01)
-                            pass
+                        self.watch(s_task)
+                        if self.trigger_start([s_task, l_task]):
+                            self.finished.wait()
                         self.stop([s_task, l_task])
+                        self.disarm([s_task, l_task])
                         s_task.write([[0, 0], [0, 0]])
                         l_task.write([False, False])
                         self.start([s_task, l_task])
+                    metrics.stop()
+                    metrics.register("daq.lookahead", None)
 
         else:
+            if self.trigger_activated:
+                self.trigger_mode = "Simulated"
+                self.stopped.wait(TRIGGER_DELAY)
+                self.trigger_offset = HARDWARE_TRIGGER_OFFSET
+                self.trigger_offset_measured = False
             self.start_time = time.time()
-            while (
-                time.time() - self.start_time < len(self.stim_signal[0]) / 3000
-                and not self.stop_signal
-            ):
-                time.sleep(0.01)
-                pass
+            self.stopped.wait(self.sample_count / 3000)
+
+    def trigger_start(self, tasks):
+        """Start the stimuli and lights tasks, at the trigger edge if the trigger is activated
+
+        With a hardware trigger, the tasks are armed with a digital edge start
+        trigger on the PFI terminal of the trigger, so that the device starts them
+        on the first sample clock edge after the trigger edge. The trigger line is
+        not watched, and the trigger offset is assumed to be one sample clock
+        period, as it cannot be measured from the host.
+        Otherwise, or if no trigger terminal is set, the tasks are started once the
+        trigger edge is detected and the measured latency is kept.
+
+        Args:
+            tasks (list): The stimuli and lights nidaqmx tasks
+
+        Returns:
+            bool: False if the acquisition was stopped before the start
+        """
+        if self.trigger_activated and self.hardware_trigger:
+            if self.trigger_terminal:
+                for task in tasks:
+                    task.triggers.start_trigger.cfg_dig_edge_start_trig(
+                        f"/{self.name}/{self.trigger_terminal}"
+                    )
+                self.start(tasks)
+                self.trigger_mode = "Hardware"
+                self.trigger_offset = HARDWARE_TRIGGER_OFFSET
+                self.trigger_offset_measured = False
+                self.start_time = time.time()
+                return not self.stop_signal
+            logging.warning("No trigger terminal is set, using the software trigger")
+        if self.trigger_activated:
+            self.wait_for_trigger()
+            if self.stop_signal:
+                return False
+            self.start(tasks)
+            self.trigger_mode = "Software"
+            self.trigger_offset = time.perf_counter() - self.trigger_time
+            self.trigger_offset_measured = True
+        elif self.stop_signal:
+            return False
+        else:
+            self.start(tasks)
+        self.start_time = time.time()
+        return True
+
+    def wait_for_trigger(self):
+        """Wait for a rising edge on the trigger port, or until the acquisition is stopped
+
+        M and X series boards only support change detection on port0, so a trigger
+        line on port0 is watched by change detection and no thread polls it. On
+        other ports, or if change detection fails, the line is polled.
+        """
+        self.triggered.clear()
+        if self.stop_signal:
+            return
+        if self.trigger_port.split("/")[0] == "port0":
+            try:
+                self.watch_trigger()
+                return
+            except Exception as err:
+                logging.warning(
+                    f"Change detection failed on {self.trigger_port}, polling it: {err}"
+                )
+        self.poll_trigger()
+
+    def watch_trigger(self):
+        """Wait for a rising edge of the trigger line detected by change detection
+
+        The line is read again once change detection is armed, so an edge arriving
+        while it is armed is not missed.
+        """
+        with self.new_task("trigger") as t_task:
+            t_task.di_channels.add_di_chan(f"{self.name}/{self.trigger_port}")
+            if t_task.read():
+                self.trigger_time = time.perf_counter()
+                return
+
+            def set_triggered(task_handle, signal_type, callback_data):
+                self.trigger_time = time.perf_counter()
+                self.triggered.set()
+                return 0
+
+            t_task.timing.cfg_change_detection_timing(
+                rising_edge_chan=f"{self.name}/{self.trigger_port}",
+                sample_mode=AcquisitionType.CONTINUOUS,
+            )
+            t_task.register_signal_event(Signal.CHANGE_DETECTION_EVENT, set_triggered)
+            t_task.start()
+            with self.new_task("trigger state") as s_task:
+                s_task.di_channels.add_di_chan(f"{self.name}/{self.trigger_port}")
+                if s_task.read() and not self.triggered.is_set():
+                    self.trigger_time = time.perf_counter()
+                    self.triggered.set()
+            self.triggered.wait()
+
+    def poll_trigger(self):
+        """Read the trigger line until it is high or the acquisition is stopped"""
+        with self.new_task("trigger") as t_task:
+            t_task.di_channels.add_di_chan(f"{self.name}/{self.trigger_port}")
+            while not t_task.read():
+                if self.stopped.wait(TRIGGER_POLL_INTERVAL):
+                    return
+            self.trigger_time = time.perf_counter()
+
+    def watch(self, task):
+        """Set the finished event once a task has output every sample of the protocol
+
+        In streaming mode, the event is set by the block writer instead.
+
+        Args:
+            task (Task): The nidaqmx task to watch
+        """
+        if self.streaming:
+            return
+
+        def set_finished(task_handle, status, callback_data):
+            self.finished.set()
+            return 0
+
+        task.register_done_event(set_finished)
 
     def return_lights(self):
         """Return the lights used in the experiment
@@ -406,28 +822,171 @@ class DAQ:
         return lights
 
     def save(self, directory):
-        """Save the light and stimulation data for each frame as a NPY file
+        """Save the light data for each frame and the stimulation signals
+
+        The stimulation signals are run-length encoded in a NPZ file when the
+        "Encode Signals" setting is enabled, and saved raw in a NPY file otherwise.
 
         Args:
-            directory (str): The directory in which to save the NPY file
+            directory (str): The directory in which to save the files
         """
+        if self.streaming:
+            self.save_stream(directory)
+            return
         try:
-            indices = find_rising_indices(self.all_signals[-1])
-            reduced_stack = reduce_stack(self.all_signals, indices)
+            indices = np.concatenate(([0], self.camera_edges() + 1))
+            reduced_stack = unpack_lines(
+                reduce_stack(self.digital_lines, indices), len(self.lights) + 1
+            )
             np.save(f"{directory}/light_signal", reduced_stack)
         except Exception as err:
             pass
-        np.save(f"{directory}/stim_signal", self.stim_signal)
+        save_signals(
+            f"{directory}/stim_signal",
+            self.stim_signal,
+            config.get("Encode Signals", False),
+        )
+
+    def save_stream(self, directory):
+        """Regenerate a streamed protocol block by block to save its light and stimulation data
+
+        Args:
+            directory (str): The directory in which to save the NPY files
+        """
+        encode = config.get("Encode Signals", False)
+        if encode:
+            runs, previous = [([], []), ([], [])], [None, None]
+        else:
+            remove_signals(f"{directory}/stim_signal")
+            stim_signal = np.lib.format.open_memmap(
+                f"{directory}/stim_signal.npy", mode="w+", shape=(2, self.sample_count)
+            )
+        if len(self.lights) > 0:
+            indices = np.concatenate(([0], self.camera_edges() + 1))
+            reduced_stack = np.empty((len(self.lights) + 1, len(indices)), dtype=bool)
+        start = 0
+        for analog, digital in self.stream_blocks():
+            stop = start + analog.shape[1]
+            if encode:
+                for channel, signal in enumerate(analog):
+                    starts, values = encode_runs(signal, start, previous[channel])
+                    runs[channel][0].append(starts)
+                    runs[channel][1].append(values)
+                    previous[channel] = signal[-1]
+            else:
+                stim_signal[:, start:stop] = analog
+            if len(self.lights) > 0:
+                first, last = np.searchsorted(indices, [start, stop])
+                reduced_stack[:, first:last] = digital[:-1, indices[first:last] - start]
+            start = stop
+        if encode:
+            save_runs(
+                f"{directory}/stim_signal",
+                [
+                    (np.concatenate(starts), np.concatenate(values))
+                    for starts, values in runs
+                ],
+                self.sample_count,
+            )
+        else:
+            stim_signal.flush()
+        if len(self.lights) > 0:
+            np.save(f"{directory}/light_signal", reduced_stack)
 
     def reset_daq(self):
         """Reset the DAQ parameters"""
-        self.light_signals, self.stim_signal, self.camera_signal, self.time_values = (
-            [],
-            [],
-            None,
-            None,
+        self.signals_ready.clear()
+        self.finished.clear()
+        self.trigger_mode, self.trigger_offset = None, None
+        self.trigger_offset_measured = False
+        self.stim_signal, self.digital_lines, self.time_values = [], None, None
+
+    def load(self, tasks):
+        """Configure the sampling of the stimuli and lights tasks and write their signals
+
+        Args:
+            tasks (list): The stimuli and lights nidaqmx tasks
+        """
+        if self.streaming:
+            self.write_stream(tasks)
+        elif len(self.lights) > 0:
+            self.sample(tasks, self.stim_signal[0])
+            self.write(tasks, [self.stim_signal, self.digital_signals()])
+        else:
+            self.sample(tasks, self.stim_signal[0])
+            self.write(tasks, [self.stim_signal, self.d_stim_signal])
+
+    def write_stream(self, tasks):
+        """Configure tasks for continuous output and write the first blocks of the protocol
+
+        The following blocks are generated and written each time a block is
+        transferred to the device, so only a bounded lookahead is held in memory.
+
+        Args:
+            tasks (list): The stimuli and lights nidaqmx tasks
+        """
+        for task in tasks:
+            task.timing.cfg_samp_clk_timing(
+                3000,
+                sample_mode=AcquisitionType.CONTINUOUS,
+                samps_per_chan=STREAM_BLOCK * STREAM_LOOKAHEAD,
+            )
+            task.out_stream.regen_mode = RegenerationMode.DONT_ALLOW_REGENERATION
+        self.blocks = self.stream_blocks()
+        self.blocks_written = 0
+        metrics.register(
+            "daq.lookahead",
+            lambda: (
+                self.blocks_written * STREAM_BLOCK
+                - tasks[1].out_stream.total_samp_per_chan_generated
+            )
+            / 3000,
+        )
+        for _ in range(STREAM_LOOKAHEAD):
+            self.write_block(tasks)
+
+        def write_next_block(task_handle, event_type, samples, callback_data):
+            self.write_block(tasks)
+            if self.is_done(tasks[1]):
+                self.finished.set()
+            return 0
+
+        tasks[1].register_every_n_samples_transferred_from_buffer_event(
+            STREAM_BLOCK, write_next_block
         )
 
+    def write_block(self, tasks):
+        """Write the next block of the protocol, or low signals once it is over
+
+        Args:
+            tasks (list): The stimuli and lights nidaqmx tasks
+        """
+        start = time.perf_counter()
+        block = next(self.blocks, None)
+        if block is None:
+            analog = np.zeros((2, STREAM_BLOCK))
+            if len(self.lights) > 0:
+                digital = np.zeros((len(self.lights) + 2, STREAM_BLOCK), dtype=bool)
+            else:
+                digital = np.zeros(STREAM_BLOCK, dtype=bool)
+            block = (analog, digital)
+        self.write(tasks, block)
+        self.blocks_written += 1
+        metrics.observe("daq.block", time.perf_counter() - start)
+
+    def is_done(self, task):
+        """Check if a task has output every sample of the protocol
+
+        Args:
+            task (Task): The nidaqmx task to check
+
+        Returns:
+            bool: True if the task is done
+        """
+        if self.streaming:
+            return task.out_stream.total_samp_per_chan_generated >= self.sample_count
+        return task.is_task_done()
+
     def start(self, tasks):
         """Start each nidaqmx task in a list
 
@@ -437,6 +996,15 @@ class DAQ:
         for task in tasks:
             task.start()
 
+    def disarm(self, tasks):
+        """Disable the start trigger of each nidaqmx task in a list, so that they start right away
+
+        Args:
+            tasks (list): A list of nidaqmx tasks
+        """
+        for task in tasks:
+            task.triggers.start_trigger.disable_start_trig()
+
     def wait(self, tasks):
         """Wait for completion of nidaqmx tasks in a list
 
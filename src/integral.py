@@ -0,0 +1,183 @@
+import os
+import numpy as np
+from src.buffers import CHUNK_SIZE
+from src.recording import open_frames, save_derived
+
+BLOCK_SIZE = 4
+MAX_VALUE = 4095
+
+
+def integral_dtype(shape, max_value=MAX_VALUE):
+    """Return the smallest unsigned type holding the sum of every pixel of a frame
+
+    Args:
+        shape (tuple): The (height, width) dimensions of a frame
+        max_value (int): The maximum value of a pixel
+
+    Returns:
+        type: The data type of the integral images
+    """
+    if max_value * shape[0] * shape[1] < 2**32:
+        return np.uint32
+    return np.uint64
+
+
+def block_integrals(frames, block_size=BLOCK_SIZE, dtype=np.uint64):
+    """Compute the integral image of the block sums of each frame
+
+    Element [i, y, x] is the sum of the pixels of frame i above row y * block_size
+    and left of column x * block_size. Pixels beyond the last full block are ignored.
+
+    Args:
+        frames (array): Array of frames
+        block_size (int): The side of the square blocks, in pixels
+        dtype (type): The data type of the integral images
+
+    Returns:
+        array: The integral images, one row and column larger than the block grid
+    """
+    frames = np.asarray(frames)
+    rows, columns = frames.shape[1] // block_size, frames.shape[2] // block_size
+    blocks = (
+        frames[:, : rows * block_size, : columns * block_size]
+        .reshape(len(frames), rows, block_size, columns, block_size)
+        .sum(axis=(2, 4), dtype=np.uint64)
+    )
+    integrals = np.zeros((len(frames), rows + 1, columns + 1), dtype=dtype)
+    np.cumsum(blocks, axis=1, out=blocks)
+    np.cumsum(blocks, axis=2, out=blocks)
+    integrals[:, 1:, 1:] = blocks
+    return integrals
+
+
+def integral_path(directory, block_size=BLOCK_SIZE):
+    """Return the path of the integral index of a recording
+
+    Args:
+        directory (str): The data directory of the recording
+        block_size (int): The side of the square blocks, in pixels
+
+    Returns:
+        str: The path of the index file
+    """
+    return os.path.join(directory, f"integral_{block_size}.npy")
+
+
+def snap_extents(extents, shape, block_size=BLOCK_SIZE):
+    """Snap ROI extents to the nearest block boundaries, keeping at least one block
+
+    Args:
+        extents (list): The (left, right, bottom, top) extents of the ROI in pixels
+        shape (tuple): The (height, width) dimensions of a frame
+        block_size (int): The side of the square blocks, in pixels
+
+    Returns:
+        tuple: The snapped extents, in pixels
+    """
+    snapped = []
+    for low, high, size in zip(extents[::2], extents[1::2], shape[::-1]):
+        limit = size // block_size
+        low, high = sorted((low, high))
+        low = min(max(round(low / block_size), 0), limit - 1)
+        high = min(max(round(high / block_size), low + 1), limit)
+        snapped += [low * block_size, high * block_size]
+    return tuple(snapped)
+
+
+class IntegralIndex:
+    def __init__(self, integrals, block_size=BLOCK_SIZE):
+        """Rectangular ROI means of every frame from four lookups in per-frame integral images
+
+        ROIs are snapped to the grid of blocks the integral images were built on.
+
+        Args:
+            integrals (array): The integral images of the block sums of each frame
+            block_size (int): The side of the square blocks, in pixels
+        """
+        self.integrals = integrals
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.integrals)
+
+    def snap(self, extents):
+        """Snap ROI extents to the blocks of the integral images
+
+        Args:
+            extents (list): The (left, right, bottom, top) extents of the ROI in pixels
+
+        Returns:
+            tuple: The snapped extents, in pixels
+        """
+        shape = (
+            (self.integrals.shape[1] - 1) * self.block_size,
+            (self.integrals.shape[2] - 1) * self.block_size,
+        )
+        return snap_extents(extents, shape, self.block_size)
+
+    def time_course(self, extents=None, frame_indices=slice(None)):
+        """Compute the mean of a ROI in each frame
+
+        Args:
+            extents (list): The extents of the ROI, snapped to the blocks. Defaults to every block.
+            frame_indices (slice or array): The frames to compute the mean of
+
+        Returns:
+            array: The mean of the snapped ROI in each frame
+        """
+        if extents is None:
+            left, bottom = 0, 0
+            top, right = self.integrals.shape[1] - 1, self.integrals.shape[2] - 1
+        else:
+            left, right, bottom, top = (
+                value // self.block_size for value in self.snap(extents)
+            )
+        corners = self.integrals[
+            :, [top, bottom, top, bottom], [right, right, left, left]
+        ][frame_indices].astype(np.int64)
+        sums = corners[:, 0] - corners[:, 1] - corners[:, 2] + corners[:, 3]
+        return sums / ((right - left) * (top - bottom) * self.block_size**2)
+
+
+def build_integral_index(directory, block_size=BLOCK_SIZE, chunk_size=CHUNK_SIZE):
+    """Build the integral index of a recording chunk by chunk and save it next to it
+
+    Args:
+        directory (str): The data directory of the recording
+        block_size (int): The side of the square blocks, in pixels
+        chunk_size (int): The number of frames processed at once
+
+    Returns:
+        IntegralIndex: The index of the recording
+    """
+    frames = open_frames(directory)
+    rows, columns = frames.shape[1] // block_size, frames.shape[2] // block_size
+    dtype = integral_dtype(frames.shape[1:])
+    save_derived(
+        directory,
+        os.path.basename(integral_path(directory, block_size)),
+        frames,
+        (rows + 1, columns + 1),
+        dtype,
+        lambda chunk: block_integrals(chunk, block_size, dtype),
+        chunk_size,
+    )
+    del frames
+    return open_integral_index(directory, block_size)
+
+
+def open_integral_index(directory, block_size=BLOCK_SIZE):
+    """Open the integral index of a recording if it was built
+
+    Args:
+        directory (str): The data directory of the recording
+        block_size (int): The side of the square blocks, in pixels
+
+    Returns:
+        IntegralIndex: The index of the recording, or None if it was not built
+    """
+    try:
+        integrals = np.load(integral_path(directory, block_size), mmap_mode="r")
+    except FileNotFoundError:
+        return None
+    return IntegralIndex(integrals, block_size)
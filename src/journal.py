@@ -0,0 +1,180 @@
+import os
+import json
+import threading
+import numpy as np
+from src.signals import decode_runs, encode_runs
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+def sync_file(path):
+    """Force the content of a file to the disk
+
+    Args:
+        path (str): The path of the file
+    """
+    with open(path, "rb+") as file:
+        os.fsync(file.fileno())
+
+
+def sync_directory(path):
+    """Force the entries of a directory to the disk, so that renamed files persist
+
+    Directories cannot be opened on Windows, where renames are committed with the file.
+
+    Args:
+        path (str): The path of the directory
+    """
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def encode_channels(channels, start, light_count):
+    """Encode the light channels of frames as runs of their phase in the light cycle
+
+    The phase only changes where frames were dropped, so a chunk is encoded
+    by a few runs.
+
+    Args:
+        channels (array): The light channel index of each frame
+        start (int): The index of the first frame in the recording
+        light_count (int): The number of interleaved lights
+
+    Returns:
+        list of list: The index of the first frame and the phase of each run
+    """
+    phase = (
+        np.asarray(channels, dtype=np.int64) - np.arange(start, start + len(channels))
+    ) % max(light_count, 1)
+    starts, values = encode_runs(phase, start)
+    return [[int(first), int(value)] for first, value in zip(starts, values)]
+
+
+def decode_channels(runs, start, count, light_count):
+    """Rebuild the light channels of frames from the runs of their phase
+
+    Args:
+        runs (list of list): The index of the first frame and the phase of each run
+        start (int): The index of the first frame in the recording
+        count (int): The number of frames
+        light_count (int): The number of interleaved lights
+
+    Returns:
+        array: The light channel index of each frame
+    """
+    starts = np.array([run[0] for run in runs], dtype=np.int64) - start
+    phase = decode_runs(
+        starts, np.array([run[1] for run in runs], dtype=np.int64), count
+    )
+    return ((np.arange(start, start + count) + phase) % max(light_count, 1)).astype(
+        np.uint8
+    )
+
+
+class Journal:
+    def __init__(self, directory, append=False):
+        """An append-only log of the chunks of a recording that reached the disk
+
+        Each event is a JSON line flushed and synced before returning, so the
+        journal never claims more than what a crash leaves on disk.
+
+        Args:
+            directory (str): The data directory of the recording
+            append (bool): If True, events are added to the existing journal
+                           instead of starting a new one
+        """
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.lock = threading.Lock()
+        self.file = open(self.path, "a" if append else "w")
+        if self.file.tell() > 0:
+            with open(self.path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def append(self, event, **fields):
+        """Append an event to the journal and sync it
+
+        Args:
+            event (str): The kind of event, "Begin", "Chunk", "End" or "Recovered"
+            fields (dict): The entries of the event
+        """
+        line = json.dumps({"Event": event, **fields})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        """Close the journal file"""
+        with self.lock:
+            self.file.close()
+
+
+def read_journal(directory):
+    """Read the events of the journal of a recording
+
+    Lines cut by a crash are skipped.
+
+    Args:
+        directory (str): The data directory of the recording
+
+    Returns:
+        list of dict: The events, in the order they were appended
+    """
+    events = []
+    with open(os.path.join(directory, JOURNAL_FILE)) as file:
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
+
+
+def recording_open(directory):
+    """Return whether a recording was begun and was neither closed nor recovered
+
+    Such a recording is still being acquired, or was interrupted by a crash.
+
+    Args:
+        directory (str): The data directory of the recording
+
+    Returns:
+        bool: True if the journal of the recording has not ended
+    """
+    try:
+        events = read_journal(directory)
+    except FileNotFoundError:
+        return False
+    return any(event["Event"] == "Begin" for event in events) and not any(
+        event["Event"] in ("End", "Recovered") for event in events
+    )
+
+
+def committed_chunks(events):
+    """Return the chunks written contiguously from the first frame
+
+    Chunks may complete out of order, so chunks after the first missing one are
+    left out.
+
+    Args:
+        events (list of dict): The events of the journal
+
+    Returns:
+        list of dict: The chunk events, in acquisition order
+    """
+    chunks = {event["Start"]: event for event in events if event["Event"] == "Chunk"}
+    ordered, position = [], 0
+    while position in chunks and chunks[position]["Frames"] > 0:
+        ordered.append(chunks[position])
+        position += chunks[position]["Frames"]
+    return ordered
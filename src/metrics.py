@@ -0,0 +1,288 @@
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+SAMPLE_INTERVAL = 1
+WINDOW_SIZE = 600
+LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+
+class LatencyHistogram:
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        """A histogram of durations over fixed buckets, cheap enough to update on every frame
+
+        Args:
+            bounds (tuple): The increasing upper bounds of the buckets in seconds.
+                            Longer durations fall in an extra last bucket.
+        """
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.counts = np.zeros(len(bounds) + 1, dtype=np.int64)
+        self.total = 0.0
+        self.maximum = 0.0
+
+    @property
+    def count(self):
+        """Return the number of observed durations"""
+        return int(self.counts.sum())
+
+    def observe(self, duration):
+        """Add a duration to the histogram
+
+        Args:
+            duration (float): The duration in seconds
+        """
+        self.counts[np.searchsorted(self.bounds, duration)] += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+
+    def quantile(self, fraction):
+        """Estimate a quantile of the observed durations by the upper bound of its bucket
+
+        Args:
+            fraction (float): The fraction of durations below the quantile, between 0 and 1
+
+        Returns:
+            float: The estimated quantile in seconds, or 0 if nothing was observed
+        """
+        count = self.count
+        if count == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), fraction * count))
+        if bucket >= len(self.bounds):
+            return self.maximum
+        return min(float(self.bounds[bucket]), self.maximum)
+
+    def summary(self):
+        """Return the count, mean, median, 99th percentile and maximum of the durations
+
+        Returns:
+            dict: The summary of the histogram
+        """
+        count = self.count
+        return {
+            "count": count,
+            "mean": self.total / count if count > 0 else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.maximum,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, interval=SAMPLE_INTERVAL, window_size=WINDOW_SIZE):
+        """Counters, gauges and latency histograms of the acquisition stages
+
+        The stages update the metrics from their own threads. A sampling thread
+        periodically records a snapshot of every metric, with the rate of each
+        counter, in a rolling window of fixed length.
+
+        Args:
+            interval (float): The time between two samples in seconds
+            window_size (int): The number of samples kept in the window
+        """
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window_size)
+        self.sources = {}
+        self.sampling = threading.Event()
+        self.thread = None
+        self.reset()
+
+    def reset(self):
+        """Forget every metric value and sample, keeping the registered gauge sources"""
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.samples.clear()
+            self.start_time = time.time()
+            self.last_counters = {}
+            self.last_time = time.perf_counter()
+
+    def increment(self, name, value=1):
+        """Add a value to a counter
+
+        Args:
+            name (str): The name of the counter
+            value (int): The value to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """Set the current value of a gauge
+
+        Args:
+            name (str): The name of the gauge
+            value (float): The value of the gauge
+        """
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, duration):
+        """Add a duration to a latency histogram
+
+        Args:
+            name (str): The name of the histogram
+            duration (float): The duration in seconds
+        """
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].observe(duration)
+
+    @contextmanager
+    def timer(self, name):
+        """Observe the duration of a block of code in a latency histogram
+
+        Args:
+            name (str): The name of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def register(self, name, source):
+        """Read a gauge from a function each time the metrics are sampled
+
+        Args:
+            name (str): The name of the gauge
+            source (function): Returns the value of the gauge, or None to register nothing
+        """
+        with self.lock:
+            if source is None:
+                self.sources.pop(name, None)
+            else:
+                self.sources[name] = source
+
+    def sample(self):
+        """Record a snapshot of every metric in the rolling window
+
+        Returns:
+            dict: The recorded sample
+        """
+        with self.lock:
+            sources = dict(self.sources)
+        gauges = {}
+        for name, source in sources.items():
+            try:
+                gauges[name] = source()
+            except Exception:
+                pass
+        with self.lock:
+            self.gauges.update(gauges)
+            now = time.perf_counter()
+            elapsed = max(now - self.last_time, 1e-9)
+            sample = {
+                "time": round(time.time() - self.start_time, 3),
+                "counters": dict(self.counters),
+                "rates": {
+                    name: (value - self.last_counters.get(name, 0)) / elapsed
+                    for name, value in self.counters.items()
+                },
+                "gauges": dict(self.gauges),
+                "latencies": {
+                    name: histogram.summary()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+            self.last_counters, self.last_time = dict(self.counters), now
+            self.samples.append(sample)
+            return sample
+
+    def latest(self):
+        """Return the last recorded sample
+
+        Returns:
+            dict: The last sample, or None if nothing was sampled
+        """
+        with self.lock:
+            return self.samples[-1] if len(self.samples) > 0 else None
+
+    def start(self):
+        """Start sampling the metrics periodically on a background thread"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.sampling.clear()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        """Sample the metrics until sampling is stopped"""
+        while not self.sampling.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        """Stop the sampling thread and record a last sample"""
+        self.sampling.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.sample()
+
+    def save(self, path):
+        """Save the rolling window and the final value of every metric as a JSON file
+
+        Args:
+            path (str): The path of the file
+        """
+        with self.lock:
+            dictionary = {
+                "Interval": self.interval,
+                "Counters": dict(self.counters),
+                "Gauges": dict(self.gauges),
+                "Latencies": {
+                    name: histogram.summary()
+                    for name, histogram in self.histograms.items()
+                },
+                "Latency Bounds": list(LATENCY_BOUNDS),
+                "Latency Counts": {
+                    name: histogram.counts.tolist()
+                    for name, histogram in self.histograms.items()
+                },
+                "Samples": list(self.samples),
+            }
+        with open(path, "w") as file:
+            json.dump(dictionary, file, default=float)
+
+
+def health_summary(sample):
+    """Format a metrics sample as the short lines of the health panel
+
+    Args:
+        sample (dict): A sample recorded by the registry, or None
+
+    Returns:
+        str: One line per acquisition stage
+    """
+    if sample is None:
+        return "No acquisition"
+    rates, gauges = sample["rates"], sample["gauges"]
+    latencies, counters = sample["latencies"], sample["counters"]
+
+    def latency(name):
+        return 1000 * latencies.get(name, {}).get("p99", 0)
+
+    return "\n".join(
+        [
+            f"Camera: {rates.get('camera.frames', 0):.1f} fps, "
+            f"read p99 {latency('camera.read'):.1f} ms",
+            f"Dropped: {counters.get('camera.dropped', 0)}, "
+            f"behind: {gauges.get('camera.behind', 0)}",
+            f"Buffer: {gauges.get('buffer.used', 0)} frames, "
+            f"writer queue: {gauges.get('writer.queue', 0)}",
+            f"Disk: {rates.get('writer.bytes', 0) / 1e6:.1f} MB/s, "
+            f"chunk p99 {latency('writer.chunk'):.0f} ms",
+            f"Preview: {rates.get('preview.frames', 0):.1f} fps, "
+            f"skipped {rates.get('preview.skipped', 0):.1f}/s",
+            f"DAQ: block p99 {latency('daq.block'):.1f} ms",
+        ]
+    )
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,96 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+import numpy as np
+
+PREVIEW_INTERVAL = 0.04
+DISPLAY_SIZE = 512
+ACTIVATION_SCALES = {"Normal": 200, "Logarithmic": 2000, "Z-Score": 400}
+
+
+class PreviewRenderer(QObject):
+    frame_ready = pyqtSignal(object, object)
+
+    def __init__(self, canvas, image, shape):
+        """Draw preview frames on the Qt thread by blitting a single image
+
+        Frames are submitted from an acquisition thread, downsampled to the
+        displayed resolution and handed to the Qt thread through a signal. A new
+        frame is dropped while the previous one is still waiting to be drawn.
+
+        Args:
+            canvas (FigureCanvas): The canvas of the preview figure
+            image (AxesImage): The image displaying the preview
+            shape (tuple): The (height, width) dimensions of a full resolution frame
+        """
+        super().__init__()
+        self.canvas = canvas
+        self.image = image
+        self.image.set_animated(True)
+        self.image.set_extent((-0.5, shape[1] - 0.5, -0.5, shape[0] - 0.5))
+        self.display_size = DISPLAY_SIZE
+        self.background = None
+        self.style = None
+        self.busy = False
+        self.canvas.mpl_connect("draw_event", self.capture_background)
+        self.frame_ready.connect(self.draw)
+
+    def capture_background(self, event):
+        """Save the figure without the image after each full redraw, then draw the image
+
+        Args:
+            event (DrawEvent): The matplotlib draw event
+        """
+        bbox = self.image.axes.bbox
+        self.background = self.canvas.copy_from_bbox(bbox)
+        self.display_size = max(int(max(bbox.width, bbox.height)), 1)
+        self.image.axes.draw_artist(self.image)
+        self.canvas.blit(bbox)
+
+    def submit(self, frame, maps=None, light_index=0, mode="None", exposure=4096):
+        """Downsample a frame, compute its activation map and send it to the Qt thread
+
+        Args:
+            frame (array): The full resolution frame
+            maps (ActivationMaps): The baseline activation maps, or None before the baseline
+            light_index (int): The index of the light of the frame
+            mode (str): The activation map mode
+            exposure (int): The maximum value of the colour scale
+
+        Returns:
+            bool: False if the frame was dropped because the last one is not drawn yet
+        """
+        if self.busy:
+            return False
+        step = max(max(frame.shape) // self.display_size, 1)
+        frame = frame[::step, ::step]
+        if maps is None or mode == "None":
+            image = np.array(frame)
+            style = ("binary_r", 0, exposure)
+        else:
+            image = np.array(maps.compute(frame, light_index, mode, step))
+            scale = ACTIVATION_SCALES[mode]
+            style = ("seismic", -exposure / scale, exposure / scale)
+        self.busy = True
+        self.frame_ready.emit(image, style)
+        return True
+
+    def draw(self, image, style):
+        """Replace the displayed frame, changing the colour scale only when it changed
+
+        Args:
+            image (array): The downsampled frame or activation map
+            style (tuple): The colormap name and the limits of the colour scale
+        """
+        try:
+            self.image.set_data(image)
+            if style != self.style:
+                self.style = style
+                self.image.set_cmap(style[0])
+                self.image.set_clim(style[1], style[2])
+            if self.background is None:
+                self.canvas.draw_idle()
+            else:
+                self.canvas.restore_region(self.background)
+                self.image.axes.draw_artist(self.image)
+                self.canvas.blit(self.image.axes.bbox)
+        finally:
+            self.busy = False
@@ -0,0 +1,183 @@
+import os
+import threading
+import numpy as np
+from src.buffers import CHUNK_SIZE
+from src.recording import open_frames, save_derived
+
+PYRAMID_FACTORS = (4, 16)
+SCRUB_PIXELS = 256 * 256
+REFINE_DELAY = 0.15
+
+
+def downsample(frames, factor):
+    """Downsample frames by averaging square blocks of pixels
+
+    Args:
+        frames (array): Array of frames
+        factor (int): The side of the averaged blocks, in pixels
+
+    Returns:
+        array: The rounded downsampled frames, with the data type of the frames
+    """
+    frames = np.asarray(frames)
+    rows, columns = frames.shape[1] // factor, frames.shape[2] // factor
+    blocks = frames[:, : rows * factor, : columns * factor].reshape(
+        len(frames), rows, factor, columns, factor
+    )
+    return np.rint(blocks.mean(axis=(2, 4))).astype(frames.dtype)
+
+
+def pyramid_path(directory, factor):
+    """Return the path of a level of the preview pyramid of a recording
+
+    Args:
+        directory (str): The data directory of the recording
+        factor (int): The downsampling factor of the level
+
+    Returns:
+        str: The path of the level file
+    """
+    return os.path.join(directory, f"preview_{factor}.npy")
+
+
+def build_preview_pyramid(directory, factors=PYRAMID_FACTORS, chunk_size=CHUNK_SIZE):
+    """Build the downsampled levels of a recording and save them next to it
+
+    Each level is computed from the previous one, so the recording is read once.
+
+    Args:
+        directory (str): The data directory of the recording
+        factors (tuple): The increasing downsampling factors of the levels
+        chunk_size (int): The number of frames processed at once
+
+    Returns:
+        list of array: The memory-mapped levels, from the finest to the coarsest
+    """
+    frames, previous_factor = open_frames(directory), 1
+    for factor in factors:
+        step = factor // previous_factor
+        shape = (frames.shape[1] // step, frames.shape[2] // step)
+        if min(shape) == 0:
+            break
+        save_derived(
+            directory,
+            os.path.basename(pyramid_path(directory, factor)),
+            frames,
+            shape,
+            frames.dtype,
+            lambda chunk: downsample(chunk, step),
+            chunk_size,
+        )
+        frames = np.load(pyramid_path(directory, factor), mmap_mode="r")
+        previous_factor = factor
+    del frames
+    return open_preview_pyramid(directory, factors)
+
+
+def open_preview_pyramid(directory, factors=PYRAMID_FACTORS):
+    """Open the levels of the preview pyramid of a recording that were built
+
+    Args:
+        directory (str): The data directory of the recording
+        factors (tuple): The increasing downsampling factors of the levels
+
+    Returns:
+        list of array: The memory-mapped levels, from the finest to the coarsest
+    """
+    levels = []
+    for factor in factors:
+        try:
+            levels.append(np.load(pyramid_path(directory, factor), mmap_mode="r"))
+        except FileNotFoundError:
+            break
+    return levels
+
+
+def scrub_level(levels, pixels=SCRUB_PIXELS):
+    """Choose the finest level small enough to be shown while scrubbing
+
+    Args:
+        levels (list of array): The levels, from the finest to the coarsest
+        pixels (int): The maximum number of pixels of a frame shown while scrubbing
+
+    Returns:
+        array: The chosen level, or None if there is no level
+    """
+    for level in levels:
+        if level.shape[1] * level.shape[2] <= pixels:
+            return level
+    return levels[-1] if levels else None
+
+
+class PreviewScheduler:
+    def __init__(self, render, refine_delay=REFINE_DELAY):
+        """Render the latest requested frame on a single thread, coarse first
+
+        Requests made while a frame is rendered replace each other, so only the
+        latest one is rendered. The full resolution frame is rendered once no new
+        frame has been requested for the refine delay.
+
+        Args:
+            render (function): Renders a frame, called with its index and True for the
+                               full resolution or False for a coarse level. Returns True
+                               if the frame was rendered at full resolution.
+            refine_delay (float): The idle time before the full resolution is rendered
+        """
+        self.render = render
+        self.refine_delay = refine_delay
+        self.condition = threading.Condition()
+        self.requested = None
+        self.running = True
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def request(self, index):
+        """Request the rendering of a frame, replacing the pending request
+
+        Args:
+            index (int): The index of the frame
+        """
+        with self.condition:
+            self.requested = index
+            self.condition.notify()
+
+    def wait_for_request(self, timeout=None):
+        """Wait for a request or for the scheduler to close
+
+        Args:
+            timeout (float): The maximum waiting time in seconds. Defaults to no limit.
+
+        Returns:
+            int: The requested index, or None if there was no request
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.requested is not None or not self.running, timeout
+            )
+            index, self.requested = self.requested, None
+            return index
+
+    def work(self):
+        """Render the coarse then the full resolution frame of the latest request"""
+        index = None
+        while self.running:
+            if index is None:
+                index = self.wait_for_request()
+                continue
+            try:
+                refined = self.render(index, False)
+            except Exception:
+                refined = False
+            following = self.wait_for_request(self.refine_delay)
+            if following is None and self.running and not refined:
+                try:
+                    self.render(index, True)
+                except Exception:
+                    pass
+            index = following
+
+    def close(self):
+        """Stop the rendering thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
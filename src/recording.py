@@ -0,0 +1,545 @@
+import os
+import json
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.buffers import CHUNK_SIZE
+from src.calculations import get_dictionary
+from src.container import FRAME_CHUNKS, create_dataset, light_path, open_light_datasets
+from src.journal import sync_directory, sync_file
+from src.compression import (
+    CODEC,
+    COMPRESSION_LEVEL,
+    ENCODER_WORKERS,
+    EXTENSION,
+    CompressedChunk,
+    compressed_chunk_files,
+    write_chunk,
+)
+
+HEADER_SIZE = 128
+
+
+def npy_header(shape, dtype):
+    """Create a NPY header padded to a fixed size so it can be rewritten in place
+
+    Args:
+        shape (tuple): The shape of the stored array
+        dtype (type): The data type of the stored array
+
+    Returns:
+        bytes: The NPY header
+    """
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": tuple(int(value) for value in shape),
+        }
+    )
+    header = header.ljust(HEADER_SIZE - 11) + "\n"
+    return np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode()
+
+
+def save_index(directory, frame_count, shape, dtype, lights, channels=None, **fields):
+    """Save the light channel of each frame and the sidecar index of a recording
+
+    Args:
+        directory (str): The data directory of the recording
+        frame_count (int): The number of frames of the recording
+        shape (tuple): The (height, width) dimensions of a frame
+        dtype (type): The data type of the frames
+        lights (list of str): The names of the interleaved light channels
+        channels (array): The light channel index of each frame.
+                          Defaults to the lights cycling from the first frame.
+        fields (dict): Other entries of the index
+    """
+    if channels is None:
+        channels = np.arange(frame_count) % max(len(lights), 1)
+    np.save(
+        os.path.join(directory, "channels.npy"), np.asarray(channels, dtype=np.uint8)
+    )
+    with open(os.path.join(directory, "index.json"), "w") as file:
+        json.dump(
+            {
+                "Frames": frame_count,
+                "Shape": list(shape),
+                "Dtype": np.dtype(dtype).name,
+                "Lights": lights,
+                **fields,
+            },
+            file,
+        )
+
+
+class Recording:
+    def __init__(self, directory, shape, lights, dtype=np.uint16):
+        """A recording streamed into a single NPY file through a memory map
+
+        The NPY header is written up front and the file is grown in place by
+        chunks. A sidecar index stores the frame count, shape, data type and the
+        light channel of each frame.
+
+        Args:
+            directory (str): The directory in which to save the recording
+            shape (tuple): The (height, width) dimensions of a frame
+            lights (list of str): The names of the interleaved light channels
+            dtype (type): The data type of the frames
+        """
+        self.directory = directory
+        self.shape = tuple(int(value) for value in shape)
+        self.lights = lights
+        self.dtype = np.dtype(dtype)
+        self.path = os.path.join(directory, "frames.npy")
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.lock = threading.Lock()
+        self.frame_count = 0
+        self.capacity = 0
+        self.frames = None
+        with open(self.path, "wb") as file:
+            file.write(npy_header((0, *self.shape), self.dtype))
+
+    def grow(self, capacity):
+        """Extend the file and remap it so that it can hold a number of frames
+
+        Args:
+            capacity (int): The minimum number of frames the file must hold
+        """
+        capacity = -(-capacity // CHUNK_SIZE) * CHUNK_SIZE
+        if self.frames is not None:
+            self.frames.flush()
+            self.frames = None
+        with open(self.path, "r+b") as file:
+            file.truncate(HEADER_SIZE + capacity * self.frame_bytes)
+        self.frames = np.memmap(
+            self.path,
+            dtype=self.dtype,
+            mode="r+",
+            offset=HEADER_SIZE,
+            shape=(capacity, *self.shape),
+        )
+        self.capacity = capacity
+
+    def write(self, start, frames):
+        """Write frames at a given position of the recording and force them to the disk
+
+        Args:
+            start (int): The index of the first frame in the recording
+            frames (array): The frames to write
+        """
+        with self.lock:
+            if start + len(frames) > self.capacity:
+                self.grow(start + len(frames))
+            self.frames[start : start + len(frames)] = frames
+            self.frames.flush()
+            sync_file(self.path)
+            self.frame_count = max(self.frame_count, start + len(frames))
+
+    def close(self, channels=None):
+        """Trim the file to the written frames, rewrite its header and save the index
+
+        Args:
+            channels (array): The light channel index of each frame.
+                              Defaults to the lights cycling from the first frame.
+        """
+        with self.lock:
+            self.frames = None
+            with open(self.path, "r+b") as file:
+                file.write(npy_header((self.frame_count, *self.shape), self.dtype))
+                file.truncate(HEADER_SIZE + self.frame_count * self.frame_bytes)
+            save_index(
+                self.directory,
+                self.frame_count,
+                self.shape,
+                self.dtype,
+                self.lights,
+                channels,
+            )
+
+
+class CompressedRecording:
+    def __init__(
+        self,
+        directory,
+        shape,
+        lights,
+        dtype=np.uint16,
+        workers=ENCODER_WORKERS,
+        level=COMPRESSION_LEVEL,
+    ):
+        """A recording saved as losslessly compressed chunk files
+
+        Each chunk is split in groups of frames encoded in parallel by a pool of
+        threads, the codec releasing the GIL while it compresses.
+
+        Args:
+            directory (str): The directory in which to save the recording
+            shape (tuple): The (height, width) dimensions of a frame
+            lights (list of str): The names of the interleaved light channels
+            dtype (type): The data type of the frames
+            workers (int): The number of encoder threads
+            level (int): The zlib compression level
+        """
+        self.directory = directory
+        self.shape = tuple(int(value) for value in shape)
+        self.lights = lights
+        self.dtype = np.dtype(dtype)
+        self.level = level
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.frame_count = 0
+        self.compressed_bytes = 0
+        for path in compressed_chunk_files(directory):
+            os.remove(path)
+        if os.path.isfile(os.path.join(directory, "frames.npy")):
+            os.remove(os.path.join(directory, "frames.npy"))
+
+    def write(self, start, frames):
+        """Compress frames to the chunk file of their position in the recording
+
+        The file is forced to the disk before it is renamed, so a chunk file is
+        never left incomplete.
+
+        Args:
+            start (int): The index of the first frame in the recording
+            frames (array): The frames to write
+        """
+        path = os.path.join(self.directory, f"{start}{EXTENSION}")
+        size = write_chunk(f"{path}.tmp", frames, self.pool, level=self.level)
+        sync_file(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        sync_directory(self.directory)
+        with self.lock:
+            self.compressed_bytes += size
+            self.frame_count = max(self.frame_count, start + len(frames))
+
+    def close(self, channels=None):
+        """Stop the encoder threads and save the index
+
+        Args:
+            channels (array): The light channel index of each frame.
+                              Defaults to the lights cycling from the first frame.
+        """
+        self.pool.shutdown()
+        with self.lock:
+            save_index(
+                self.directory,
+                self.frame_count,
+                self.shape,
+                self.dtype,
+                self.lights,
+                channels,
+                Compression=CODEC,
+            )
+
+
+class LightRecording:
+    def __init__(
+        self,
+        directory,
+        shape,
+        lights,
+        dtype=np.uint16,
+        channels=None,
+        chunks=FRAME_CHUNKS,
+    ):
+        """A recording writing each light channel to its own chunked dataset as frames arrive
+
+        The datasets are chunked along time and space, so that reading a light, a
+        ROI or a time course only loads the chunks holding it.
+
+        Args:
+            directory (str): The directory in which to save the recording
+            shape (tuple): The (height, width) dimensions of a frame
+            lights (list of str): The names of the interleaved light channels
+            dtype (type): The data type of the frames
+            channels (function): Returns the light channel index of the frames between
+                                 two positions. Defaults to the lights cycling from the first frame.
+            chunks (tuple): The (frames, height, width) dimensions of each chunk
+        """
+        self.directory = directory
+        self.shape = tuple(int(value) for value in shape)
+        self.lights = lights
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.datasets = [
+            create_dataset(
+                light_path(directory, light),
+                (0, *self.shape),
+                chunks,
+                self.dtype,
+                sync=True,
+            )
+            for light in (lights if len(lights) > 0 else ["frames"])
+        ]
+        self.condition = threading.Condition()
+        self.frame_count = 0
+        self.routed = []
+
+    def write(self, start, frames):
+        """Append frames to the dataset of their light, in acquisition order
+
+        Frames written ahead of their turn by another writer thread wait for the
+        preceding frames. The last incomplete chunk of each dataset is written too,
+        so every appended frame is on disk when the write returns. If the frames
+        cannot be written, they are skipped so the following frames are not blocked.
+
+        Args:
+            start (int): The index of the first frame in the recording
+            frames (array): The frames to write
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_count >= start)
+            try:
+                if self.channels is None:
+                    channels = np.arange(start, start + len(frames)) % len(
+                        self.datasets
+                    )
+                else:
+                    channels = np.asarray(self.channels(start, start + len(frames)))
+                for index, dataset in enumerate(self.datasets):
+                    dataset.append(frames[channels == index])
+                    dataset.flush()
+                self.routed.append(channels)
+            finally:
+                self.frame_count = max(self.frame_count, start + len(frames))
+                self.condition.notify_all()
+
+    def skip(self, start, count):
+        """Skip frames that could not be written, so the following frames are not blocked
+
+        Args:
+            start (int): The index of the first skipped frame in the recording
+            count (int): The number of skipped frames
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_count >= start)
+            self.frame_count = max(self.frame_count, start + count)
+            self.condition.notify_all()
+
+    def close(self, channels=None):
+        """Write the last incomplete chunks and save the index
+
+        Skipped frames are left out of the recording.
+
+        Args:
+            channels (array): Ignored, the light channels used to route the frames are saved
+        """
+        with self.condition:
+            for dataset in self.datasets:
+                dataset.flush()
+            routed = np.concatenate(self.routed) if self.routed else []
+            save_index(
+                self.directory,
+                len(routed),
+                self.shape,
+                self.dtype,
+                self.lights,
+                routed,
+                Layout="lights",
+            )
+
+
+def interleave_lights(datasets, channels):
+    """Open the frames of per-light datasets in acquisition order
+
+    Args:
+        datasets (list of Dataset): The dataset of each light
+        channels (array): The light channel index of each frame
+
+    Returns:
+        FrameStack: The lazily read frames
+    """
+    offsets = np.cumsum([0] + [len(dataset) for dataset in datasets])
+    indices = np.empty(len(channels), dtype=np.int64)
+    for channel in range(len(datasets)):
+        positions = np.flatnonzero(channels == channel)
+        indices[positions] = offsets[channel] + np.arange(len(positions))
+    return FrameStack(datasets, indices)
+
+
+class FrameStack:
+    def __init__(self, chunks, indices=None, rows=None, columns=None):
+        """A read-only virtual concatenation of memory-mapped chunks of frames
+
+        Slicing the stack along any axis returns another stack without reading
+        anything. Frames are only read from disk when a single frame is indexed
+        or when the stack is converted to an array.
+
+        Args:
+            chunks (list of array): The memory-mapped chunks, in acquisition order
+            indices (array): The indices of the frames of the stack in the chunks.
+                             Defaults to every frame.
+            rows (range): The rows of each frame in the stack. Defaults to every row.
+            columns (range): The columns of each frame in the stack. Defaults to every column.
+        """
+        self.chunks = chunks
+        self.offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+        height, width = chunks[0].shape[1:] if chunks else (0, 0)
+        self.indices = np.arange(self.offsets[-1]) if indices is None else indices
+        self.rows = range(height) if rows is None else rows
+        self.columns = range(width) if columns is None else columns
+        self.dtype = chunks[0].dtype if chunks else np.dtype(np.uint16)
+        self.ndim = 3
+
+    @property
+    def shape(self):
+        return (len(self.indices), len(self.rows), len(self.columns))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def window(self):
+        """Return the spatial window of the stack as slices
+
+        Returns:
+            tuple: The row and column slices of each frame
+        """
+        return tuple(
+            (
+                slice(axis.start, axis.stop if axis.stop >= 0 else None, axis.step)
+                if len(axis)
+                else slice(0, 0)
+            )
+            for axis in (self.rows, self.columns)
+        )
+
+    def read(self, index):
+        """Read a single frame of the stack from disk
+
+        Args:
+            index (int): The index of the frame in the stack
+
+        Returns:
+            array: The frame
+        """
+        position = self.indices[index]
+        chunk = np.searchsorted(self.offsets, position, "right") - 1
+        return np.array(
+            self.chunks[chunk][position - self.offsets[chunk]][self.window()]
+        )
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if isinstance(key[0], (int, np.integer)):
+            return self.read(key[0])[key[1:]]
+        if not all(isinstance(axis, slice) for axis in key[1:]):
+            return np.asarray(self[key[0]])[(slice(None), *key[1:])]
+        rows = self.rows[key[1]] if len(key) > 1 else self.rows
+        columns = self.columns[key[2]] if len(key) > 2 else self.columns
+        return FrameStack(self.chunks, self.indices[key[0]], rows, columns)
+
+    def __array__(self, dtype=None, copy=None):
+        frames = np.empty(self.shape, dtype=self.dtype)
+        chunk_indices = np.searchsorted(self.offsets, self.indices, "right") - 1
+        window = self.window()
+        for chunk in np.unique(chunk_indices):
+            selected = chunk_indices == chunk
+            positions = self.indices[selected] - self.offsets[chunk]
+            if np.all(np.diff(positions) == 1):
+                positions = slice(positions[0], positions[-1] + 1)
+            frames[selected] = self.chunks[chunk][(slice(None), *window)][positions]
+        return frames if dtype is None else frames.astype(dtype)
+
+
+def chunk_files(directory):
+    """Return the numbered NPY chunk files of a directory in acquisition order
+
+    Args:
+        directory (str): The directory containing the chunks
+
+    Returns:
+        list of str: The paths of the chunk files
+    """
+    indices = [
+        int(file[:-4])
+        for file in os.listdir(directory)
+        if file.endswith(".npy") and file[:-4].isdigit()
+    ]
+    return [os.path.join(directory, f"{index}.npy") for index in sorted(indices)]
+
+
+def open_frames(directory):
+    """Open the frames of a recording without copying them
+
+    Args:
+        directory (str): The data directory of the recording
+
+    Returns:
+        array: The frames of the recording, memory-mapped or lazily read or decoded from chunks
+    """
+    if os.path.isfile(os.path.join(directory, "index.json")):
+        index = get_dictionary(os.path.join(directory, "index.json"))
+        if index.get("Layout", False) == "lights":
+            return interleave_lights(
+                open_light_datasets(directory, index["Lights"] or ["frames"]),
+                np.load(os.path.join(directory, "channels.npy")),
+            )
+        if index.get("Compression", False):
+            return FrameStack(
+                [
+                    CompressedChunk(path, index["Shape"], index["Dtype"])
+                    for path in compressed_chunk_files(directory)
+                ]
+            )
+        frames = np.load(os.path.join(directory, "frames.npy"), mmap_mode="r")
+        return frames[: index["Frames"]]
+    return FrameStack([np.load(path, mmap_mode="r") for path in chunk_files(directory)])
+
+
+def open_channels(directory, light_count, frame_count):
+    """Open the light channel index of each frame of a recording
+
+    Args:
+        directory (str): The data directory of the recording
+        light_count (int): The number of interleaved lights
+        frame_count (int): The number of frames of the recording
+
+    Returns:
+        array: The light channel index of each frame, cycling from the first frame
+               if the recording has no channels file
+    """
+    try:
+        channels = np.load(os.path.join(directory, "channels.npy"))
+        if len(channels) == frame_count:
+            return channels
+    except FileNotFoundError:
+        pass
+    return (np.arange(frame_count) % max(light_count, 1)).astype(np.uint8)
+
+
+def save_derived(
+    directory, name, frames, shape, dtype, transform, chunk_size=CHUNK_SIZE
+):
+    """Compute an array from frames chunk by chunk and save it next to the recording
+
+    The array is written under a temporary name and renamed once complete, so a
+    partially built array is never opened.
+
+    Args:
+        directory (str): The data directory of the recording
+        name (str): The name of the NPY file
+        frames (array): The frames to compute the array from
+        shape (tuple): The shape of the array derived from each frame
+        dtype (type): The data type of the array
+        transform (function): Computes the derived array of a chunk of frames
+        chunk_size (int): The number of frames processed at once
+
+    Returns:
+        str: The path of the saved array
+    """
+    path = os.path.join(directory, name)
+    temporary_path = path[:-4] + ".tmp.npy"
+    derived = np.lib.format.open_memmap(
+        temporary_path, mode="w+", dtype=dtype, shape=(len(frames), *shape)
+    )
+    for start in range(0, len(frames), chunk_size):
+        derived[start : start + chunk_size] = transform(
+            frames[start : start + chunk_size]
+        )
+    derived.flush()
+    del derived
+    os.replace(temporary_path, path)
+    return path
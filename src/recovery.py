@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from src.compression import CODEC, EXTENSION, CompressedChunk, compressed_chunk_files
+from src.container import ARRAY_FILE, light_path, save_experiment
+from src.journal import (
+    JOURNAL_FILE,
+    Journal,
+    committed_chunks,
+    decode_channels,
+    read_journal,
+)
+from src.recording import HEADER_SIZE, npy_header, save_index
+
+
+def find_recording(directory):
+    """Return the data directory of a recording from its own or its experiment directory
+
+    Args:
+        directory (str): The data directory of the recording or the directory of its experiment
+
+    Returns:
+        str: The data directory of the recording
+    """
+    if os.path.isfile(os.path.join(directory, "data", JOURNAL_FILE)):
+        return os.path.join(directory, "data")
+    return directory
+
+
+def chunk_path(directory, chunk):
+    """Return the path of the compressed file of a chunk
+
+    Args:
+        directory (str): The data directory of the recording
+        chunk (dict): The chunk event
+
+    Returns:
+        str: The path of the chunk file
+    """
+    return os.path.join(directory, f"{chunk['Start']}{EXTENSION}")
+
+
+def recover_frames(directory, begin, frame_count):
+    """Cut the frames file to the committed frames and rewrite its header
+
+    Args:
+        directory (str): The data directory of the recording
+        begin (dict): The first event of the journal, describing the recording
+        frame_count (int): The number of committed frames
+    """
+    frame_bytes = int(np.prod(begin["Shape"])) * np.dtype(begin["Dtype"]).itemsize
+    with open(os.path.join(directory, "frames.npy"), "r+b") as file:
+        file.write(npy_header((frame_count, *begin["Shape"]), begin["Dtype"]))
+        file.truncate(HEADER_SIZE + frame_count * frame_bytes)
+
+
+def recover_compressed(directory, chunks):
+    """Keep the compressed chunk files of the committed chunks that can be opened
+
+    Args:
+        directory (str): The data directory of the recording
+        chunks (list of dict): The committed chunk events, in acquisition order
+
+    Returns:
+        list of dict: The chunks kept
+    """
+    for file in os.listdir(directory):
+        if file.endswith(f"{EXTENSION}.tmp"):
+            os.remove(os.path.join(directory, file))
+    kept = []
+    for chunk in chunks:
+        try:
+            opened = CompressedChunk(chunk_path(directory, chunk), (0, 0), np.uint16)
+            if len(opened) != chunk["Frames"]:
+                break
+        except (OSError, ValueError):
+            break
+        kept.append(chunk)
+    paths = {chunk_path(directory, chunk) for chunk in kept}
+    for path in compressed_chunk_files(directory):
+        if path not in paths:
+            os.remove(path)
+    return kept
+
+
+def recover_lights(directory, lights, channels):
+    """Set the length of each light dataset to its number of committed frames
+
+    Args:
+        directory (str): The data directory of the recording
+        lights (list of str): The names of the lights
+        channels (array): The light channel index of each committed frame
+    """
+    for index, light in enumerate(lights if len(lights) > 0 else ["frames"]):
+        path = os.path.join(light_path(directory, light), ARRAY_FILE)
+        with open(path) as file:
+            array = json.load(file)
+        array["Shape"][0] = int(np.sum(channels == index))
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(array, file)
+        os.replace(f"{path}.tmp", path)
+
+
+def recover(directory):
+    """Rebuild a consistent recording from its journal and the files that reached the disk
+
+    The recording is cut after the last chunk committed contiguously from the
+    first frame, and its index is rebuilt from the light channels in the
+    journal. A recording closed normally is left unchanged.
+
+    Args:
+        directory (str): The data directory of the recording or the directory of its experiment
+
+    Returns:
+        int: The number of frames of the recording
+    """
+    directory = find_recording(directory)
+    events = read_journal(directory)
+    if len(events) == 0 or events[0]["Event"] != "Begin":
+        raise ValueError(f"The journal of {directory} has no recording")
+    ended = [event for event in events if event["Event"] in ("End", "Recovered")]
+    if ended:
+        return ended[-1]["Frames"]
+    begin = events[0]
+    chunks = committed_chunks(events)
+    fields = {}
+    if begin["Layout"] == "compressed":
+        chunks = recover_compressed(directory, chunks)
+        fields["Compression"] = CODEC
+    frame_count = sum(chunk["Frames"] for chunk in chunks)
+    channels = np.concatenate(
+        [np.zeros(0, dtype=np.uint8)]
+        + [
+            decode_channels(
+                chunk["Phase"], chunk["Start"], chunk["Frames"], len(begin["Lights"])
+            )
+            for chunk in chunks
+        ]
+    )
+    if begin["Layout"] == "lights":
+        recover_lights(directory, begin["Lights"], channels)
+        fields["Layout"] = "lights"
+    elif begin["Layout"] == "frames":
+        recover_frames(directory, begin, frame_count)
+    save_index(
+        directory,
+        frame_count,
+        begin["Shape"],
+        begin["Dtype"],
+        begin["Lights"],
+        channels,
+        Recovered=True,
+        **fields,
+    )
+    if begin["Layout"] == "lights":
+        save_experiment(directory, os.path.dirname(os.path.abspath(directory)))
+    journal = Journal(directory, append=True)
+    journal.append("Recovered", Frames=frame_count)
+    journal.close()
+    return frame_count
+
+
+def main(arguments=None):
+    """Recover a recording from the command line
+
+    Args:
+        arguments (list of str): The command line arguments. Defaults to sys.argv.
+
+    Returns:
+        int: The exit status
+    """
+    parser = argparse.ArgumentParser(
+        description="Rebuild a recording interrupted by a crash from its journal"
+    )
+    parser.add_argument(
+        "directory", help="The data directory of the recording or of its experiment"
+    )
+    arguments = parser.parse_args(arguments)
+    try:
+        frame_count = recover(arguments.directory)
+    except (OSError, ValueError) as err:
+        print(f"Recovery failed: {err}")
+        return 1
+    print(f"Recovered {frame_count} frames in {find_recording(arguments.directory)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
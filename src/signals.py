@@ -0,0 +1,152 @@
+import os
+import numpy as np
+
+
+def pack_lines(lines):
+    """Pack digital lines into bit-planes, one byte per sample for every 8 lines
+
+    The lines are packed one at a time, without stacking them first.
+
+    Args:
+        lines (list of array): The boolean signal of each line
+
+    Returns:
+        array: The packed lines, bit i of row j being line 8 * j + i
+    """
+    lines = list(lines)
+    packed = np.zeros(
+        (-(-len(lines) // 8), len(lines[0]) if lines else 0), dtype=np.uint8
+    )
+    for index, line in enumerate(lines):
+        packed[index // 8] |= np.asarray(line, dtype=bool).view(np.uint8) << np.uint8(
+            index % 8
+        )
+    return packed
+
+
+def unpack_lines(packed, count):
+    """Unpack bit-planes into a stack of digital lines
+
+    Args:
+        packed (array): The packed lines
+        count (int): The number of lines
+
+    Returns:
+        array: The boolean signal of each line
+    """
+    return np.unpackbits(packed, axis=0, count=count, bitorder="little").view(bool)
+
+
+def line_changes(packed, line):
+    """Find the samples after which a packed digital line changes, without unpacking it
+
+    Args:
+        packed (array): The packed lines
+        line (int): The index of the line
+
+    Returns:
+        array: The indices i at which the line differs between samples i and i + 1,
+               as np.flatnonzero(np.diff(line))
+    """
+    row = packed[line // 8]
+    return np.flatnonzero((row[1:] ^ row[:-1]) & np.uint8(1 << line % 8))
+
+
+def encode_runs(signal, offset=0, previous=None):
+    """Encode a signal as the start index and value of each run of equal values
+
+    Args:
+        signal (array): The signal to encode
+        offset (int): The index of the first sample of the signal in the protocol
+        previous (float): The value of the sample preceding the signal, if it continues a run
+
+    Returns:
+        tuple: The start indices and the values of the runs
+    """
+    signal = np.asarray(signal)
+    starts = np.concatenate(([0], np.flatnonzero(signal[1:] != signal[:-1]) + 1))
+    if len(signal) == 0:
+        starts = starts[:0]
+    values = signal[starts]
+    if previous is not None and len(signal) > 0 and signal[0] == previous:
+        starts, values = starts[1:], values[1:]
+    return starts + offset, values
+
+
+def decode_runs(starts, values, length):
+    """Rebuild a signal from the start index and value of each of its runs
+
+    Args:
+        starts (array): The start indices of the runs
+        values (array): The values of the runs
+        length (int): The number of samples of the signal
+
+    Returns:
+        array: The decoded signal
+    """
+    return np.repeat(values, np.diff(np.append(starts, length)))
+
+
+def remove_signals(path):
+    """Remove the signals previously saved at a path, raw or run-length encoded
+
+    Args:
+        path (str): The path of the file, without extension
+    """
+    for extension in (".npy", ".npz"):
+        if os.path.isfile(f"{path}{extension}"):
+            os.remove(f"{path}{extension}")
+
+
+def save_runs(path, runs, length):
+    """Save run-length encoded signals as a NPZ file
+
+    Args:
+        path (str): The path of the file, without extension
+        runs (list of tuple): The start indices and values of the runs of each signal
+        length (int): The number of samples of each signal
+    """
+    remove_signals(path)
+    arrays = {"length": np.array(length)}
+    for index, (starts, values) in enumerate(runs):
+        arrays[f"starts_{index}"] = starts
+        arrays[f"values_{index}"] = values
+    np.savez(f"{path}.npz", **arrays)
+
+
+def save_signals(path, signals, encode=True):
+    """Save a stack of signals, run-length encoded or raw
+
+    Args:
+        path (str): The path of the file, without extension
+        signals (array): The stack of signals
+        encode (bool): If True, the signals are saved run-length encoded as a NPZ file
+    """
+    if encode:
+        save_runs(path, [encode_runs(signal) for signal in signals], len(signals[0]))
+    else:
+        remove_signals(path)
+        np.save(f"{path}.npy", signals)
+
+
+def load_signals(path):
+    """Load a stack of signals saved raw or run-length encoded
+
+    Args:
+        path (str): The path of the file, without extension
+
+    Returns:
+        array: The stack of signals
+    """
+    if not os.path.isfile(f"{path}.npz"):
+        return np.load(f"{path}.npy")
+    with np.load(f"{path}.npz") as arrays:
+        length = int(arrays["length"])
+        return np.stack(
+            [
+                decode_runs(
+                    arrays[f"starts_{index}"], arrays[f"values_{index}"], length
+                )
+                for index in range(len(arrays.files) // 2)
+            ]
+        )
@@ -0,0 +1,429 @@
+import time
+import threading
+from collections import namedtuple
+import numpy as np
+
+TRIGGER_DELAY = 0.5
+
+FrameInfo = namedtuple("FrameInfo", ["frame_index"])
+
+
+class AcquisitionType:
+    """Sample modes mirroring nidaqmx.constants.AcquisitionType"""
+
+    FINITE = "finite"
+    CONTINUOUS = "continuous"
+
+
+def mode_name(mode):
+    """Return the simulated constant of a nidaqmx or simulated acquisition type
+
+    Args:
+        mode (AcquisitionType): A nidaqmx enum member or a simulated constant
+
+    Returns:
+        str: The lower case name of the mode, or None if no mode is given
+    """
+    if mode is None:
+        return None
+    return str(getattr(mode, "name", mode)).lower()
+
+
+class RegenerationMode:
+    """Regeneration modes mirroring nidaqmx.constants.RegenerationMode"""
+
+    ALLOW_REGENERATION = "allow"
+    DONT_ALLOW_REGENERATION = "dont_allow"
+
+
+class Signal:
+    """Signals mirroring nidaqmx.constants.Signal"""
+
+    CHANGE_DETECTION_EVENT = "change_detection"
+
+
+class SimulatedChannels:
+    def __init__(self, task):
+        """A collection of channels of a simulated task
+
+        Args:
+            task (SimulatedTask): The task owning the channels
+        """
+        self.task = task
+
+    def add_channel(self, name):
+        """Add a physical channel to the task
+
+        Args:
+            name (str): The name of the physical channel
+        """
+        self.task.channels.append(name)
+
+    add_do_chan = add_channel
+    add_di_chan = add_channel
+    add_ao_voltage_chan = add_channel
+
+
+class SimulatedTiming:
+    def __init__(self):
+        """The sample clock of a simulated task"""
+        self.rate = 3000
+        self.sample_mode = AcquisitionType.FINITE
+        self.samples = 0
+
+    def cfg_samp_clk_timing(self, rate, sample_mode=None, samps_per_chan=1000):
+        """Configure the sample clock
+
+        Args:
+            rate (float): The sampling rate in Hz
+            sample_mode (AcquisitionType): The acquisition type, nidaqmx or simulated
+            samps_per_chan (int): The number of samples to generate in finite mode
+        """
+        self.rate = rate
+        self.sample_mode = mode_name(sample_mode)
+        self.samples = samps_per_chan
+
+    def cfg_change_detection_timing(
+        self, rising_edge_chan="", falling_edge_chan="", sample_mode=None
+    ):
+        """Sample digital lines when they change
+
+        Args:
+            rising_edge_chan (str): The lines on which rising edges are detected
+            falling_edge_chan (str): The lines on which falling edges are detected
+            sample_mode (AcquisitionType): The acquisition type, nidaqmx or simulated
+        """
+        self.sample_mode = mode_name(sample_mode)
+
+
+class SimulatedStartTrigger:
+    def __init__(self):
+        """The start trigger of a simulated task"""
+        self.source = None
+
+    def cfg_dig_edge_start_trig(self, trigger_source):
+        """Start the task on a rising edge of a digital line
+
+        Args:
+            trigger_source (str): The terminal of the trigger line
+        """
+        self.source = trigger_source
+
+    def disable_start_trig(self):
+        """Start the task as soon as it is started"""
+        self.source = None
+
+
+class SimulatedTriggers:
+    def __init__(self):
+        """The triggers of a simulated task"""
+        self.start_trigger = SimulatedStartTrigger()
+
+
+class SimulatedStream:
+    def __init__(self, task):
+        """The output stream of a simulated task
+
+        Args:
+            task (SimulatedTask): The task owning the stream
+        """
+        self.task = task
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+
+    @property
+    def total_samp_per_chan_generated(self):
+        """Return the number of samples generated since the task started"""
+        return self.task.generated()
+
+
+class SimulatedTask:
+    def __init__(self, new_task_name="", camera=None):
+        """A task replaying written samples in real time, used instead of a nidaqmx task
+
+        When one of its digital lines is the camera port, the camera edges of the
+        written samples are exposed to the simulated camera so that frames follow
+        the generated camera waveform.
+
+        Args:
+            new_task_name (str): The name of the task
+            camera (Camera): The camera triggered by the task. Defaults to None.
+        """
+        self.name = new_task_name
+        self.camera = camera
+        self.channels = []
+        self.do_channels = SimulatedChannels(self)
+        self.di_channels = SimulatedChannels(self)
+        self.ao_channels = SimulatedChannels(self)
+        self.timing = SimulatedTiming()
+        self.triggers = SimulatedTriggers()
+        self.out_stream = SimulatedStream(self)
+        self.lock = threading.Lock()
+        self.callback = None
+        self.done_callback = None
+        self.signal_callback = None
+        self.created = time.perf_counter()
+        self.running = False
+        self.stopped = False
+        self.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def clear(self):
+        """Forget the written samples"""
+        self.written = 0
+        self.elapsed = 0
+        self.camera_edges = np.empty(0, dtype=int)
+
+    def camera_line(self):
+        """Return the index of the camera line in the written samples, or None"""
+        if self.camera is None:
+            return None
+        for index, channel in enumerate(self.channels):
+            if channel.endswith(self.camera.port):
+                return index
+        return None
+
+    def write(self, data):
+        """Append samples to the output buffer of the task
+
+        Args:
+            data (array): The samples of each channel
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[None, :] if len(self.channels) == 1 else data[:, None]
+        with self.lock:
+            if self.stopped:
+                self.clear()
+                self.stopped = False
+            line = self.camera_line()
+            if line is not None:
+                camera = data[line].astype(np.int8)
+                if self.written > 0:
+                    camera = np.concatenate(([self.last_camera], camera))
+                    offset = self.written
+                else:
+                    camera = np.concatenate(([0], camera))
+                    offset = 0
+                edges = np.flatnonzero(np.diff(camera) == -1) + offset
+                self.camera_edges = np.concatenate((self.camera_edges, edges))
+                self.last_camera = camera[-1]
+                self.camera.cam.follow(self)
+            self.written += data.shape[1]
+
+    def read(self):
+        """Read the trigger line, which goes high some time after the task is created
+
+        Returns:
+            bool: The state of the line
+        """
+        return time.perf_counter() - self.created >= TRIGGER_DELAY
+
+    def start(self):
+        """Start generating the written samples, one sample after the trigger edge if armed"""
+        self.start_time = time.perf_counter()
+        if self.triggers.start_trigger.source is not None:
+            trigger_time = max(self.start_time, self.created + TRIGGER_DELAY)
+            self.start_time = trigger_time + 1 / self.timing.rate
+        self.running = True
+        if self.callback is not None:
+            threading.Thread(target=self.run_callbacks, daemon=True).start()
+        if self.done_callback is not None:
+            threading.Thread(target=self.run_done_callback, daemon=True).start()
+        if self.signal_callback is not None:
+            delay = max(TRIGGER_DELAY - (time.perf_counter() - self.created), 0)
+            threading.Timer(
+                delay, self.signal_callback, (None, Signal.CHANGE_DETECTION_EVENT, None)
+            ).start()
+
+    def stop(self):
+        """Stop generating samples"""
+        if self.running:
+            self.elapsed = self.generated()
+        self.running = False
+        self.stopped = True
+
+    def close(self):
+        """Release the task"""
+        self.stop()
+
+    def generated(self):
+        """Return the number of samples generated since the task started
+
+        Returns:
+            int: The number of generated samples
+        """
+        if not self.running:
+            return self.elapsed
+        samples = max(
+            int((time.perf_counter() - self.start_time) * self.timing.rate), 0
+        )
+        if self.timing.sample_mode == AcquisitionType.CONTINUOUS:
+            return min(samples, self.written)
+        return min(samples, self.timing.samples, self.written)
+
+    def is_task_done(self):
+        """Check if every sample was generated in finite mode"""
+        if not self.running:
+            return self.stopped
+        return (
+            self.timing.sample_mode != AcquisitionType.CONTINUOUS
+            and self.generated() >= min(self.timing.samples, self.written)
+        )
+
+    def wait_until_done(self, timeout=10):
+        """Wait until the task is done
+
+        Args:
+            timeout (float): The maximum time to wait in seconds
+        """
+        start = time.perf_counter()
+        while not self.is_task_done() and time.perf_counter() - start < timeout:
+            time.sleep(0.01)
+
+    def register_every_n_samples_transferred_from_buffer_event(self, samples, callback):
+        """Call a function each time a number of samples has been generated
+
+        Args:
+            samples (int): The number of samples between calls
+            callback (function): The function called with the nidaqmx callback arguments
+        """
+        self.callback = (samples, callback)
+
+    def register_done_event(self, callback):
+        """Call a function when every sample was generated in finite mode
+
+        Args:
+            callback (function): The function called with the nidaqmx callback arguments
+        """
+        self.done_callback = callback
+
+    def register_signal_event(self, signal, callback):
+        """Call a function when the trigger line rises
+
+        Args:
+            signal (str): The signal to watch
+            callback (function): The function called with the nidaqmx callback arguments
+        """
+        self.signal_callback = callback
+
+    def run_done_callback(self):
+        """Call the registered function once the task is done, unless it is stopped first"""
+        while self.running and not self.is_task_done():
+            remaining = min(self.timing.samples, self.written) - self.generated()
+            time.sleep(max(remaining / self.timing.rate, 0.001))
+        if self.running:
+            self.done_callback(None, 0, None)
+
+    def run_callbacks(self):
+        """Call the registered function while the task is running"""
+        samples, callback = self.callback
+        calls = 0
+        while self.running:
+            while self.generated() >= (calls + 1) * samples:
+                calls += 1
+                callback(None, None, samples, None)
+            time.sleep(samples / self.timing.rate / 10)
+
+
+class SimulatedCamera:
+    def __init__(self, shape, framerate=57, pool_size=8, buffer_size=None):
+        """A camera emitting synthetic 12-bit frames, used instead of an IMAQ camera
+
+        Frames are emitted at each falling edge of the camera line of the followed
+        task, or at a fixed framerate when no task is followed. Like a framegrabber
+        ring buffer, only the latest frames are kept when more than the buffer size
+        were emitted since the last read.
+
+        Args:
+            shape (tuple): The (height, width) dimensions of a frame
+            framerate (float): The framerate used when no task is followed
+            pool_size (int): The number of distinct synthetic frames
+            buffer_size (int): The number of frames held until read. Defaults to no limit.
+        """
+        random_generator = np.random.default_rng(0)
+        self.pool = random_generator.integers(
+            0, 4096, (pool_size, *shape), dtype=np.uint16
+        )
+        self.framerate = framerate
+        self.buffer_size = buffer_size
+        self.task = None
+        self.acquiring = False
+        self.frames_read = 0
+
+    def follow(self, task):
+        """Emit frames following the camera line of a task
+
+        Args:
+            task (SimulatedTask): The task generating the camera signal
+        """
+        if task is not self.task:
+            self.task = task
+            self.frames_read = 0
+
+    def setup_acquisition(self, *args, **kwargs):
+        """Prepare the acquisition"""
+        pass
+
+    def start_acquisition(self):
+        """Start the acquisition"""
+        self.acquiring = True
+        self.start_time = time.perf_counter()
+        self.frames_read = 0
+
+    def stop_acquisition(self):
+        """Stop the acquisition"""
+        self.acquiring = False
+
+    def set_grabber_attribute_value(self, *args, **kwargs):
+        """Ignore the framegrabber attributes"""
+        pass
+
+    def frames_ready(self):
+        """Return the number of frames emitted since the acquisition started"""
+        if not self.acquiring:
+            return self.frames_read
+        if self.task is not None:
+            return int(
+                np.searchsorted(self.task.camera_edges, self.task.generated(), "left")
+            )
+        return int((time.perf_counter() - self.start_time) * self.framerate)
+
+    def wait_for_frame(self, timeout=None):
+        """Wait until a new frame is available
+
+        Args:
+            timeout (float): The maximum time to wait in seconds
+        """
+        start = time.perf_counter()
+        while self.frames_ready() <= self.frames_read:
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError("No frame acquired")
+            time.sleep(0.001)
+
+    def read_multiple_images(self, missing_frame="skip", return_info=False):
+        """Return the frames emitted since the last read that are still in the buffer
+
+        Args:
+            missing_frame (str): How frames overwritten before being read are handled.
+                                 Only "skip" is supported.
+            return_info (bool): If True, the frame information is also returned
+
+        Returns:
+            list of array: The new frames, and their information if requested
+        """
+        ready = self.frames_ready()
+        first = self.frames_read
+        if self.buffer_size is not None:
+            first = max(first, ready - self.buffer_size)
+        frames = [
+            self.pool[index % len(self.pool)].copy() for index in range(first, ready)
+        ]
+        self.frames_read = ready
+        if return_info:
+            return frames, [FrameInfo(index) for index in range(first, ready)]
+        return frames
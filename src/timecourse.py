@@ -0,0 +1,150 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from src.buffers import CHUNK_SIZE
+from src.calculations import shrink_array
+
+TIME_COURSE_WORKERS = 4
+CACHE_SIZE = 32
+PROGRESS_INTERVAL = 0.2
+
+
+def chunk_means(frames, start, stop):
+    """Compute the mean of each frame of a range of frames
+
+    Args:
+        frames (array): Array of frames
+        start (int): Index of the first frame of the range
+        stop (int): Index following the last frame of the range
+
+    Returns:
+        array: The mean of each frame of the range
+    """
+    return np.asarray(frames[start:stop]).mean(axis=(1, 2))
+
+
+class TimeCourseEngine:
+    def __init__(self, workers=TIME_COURSE_WORKERS, chunk_size=CHUNK_SIZE):
+        """Compute the mean of a ROI in every frame of a light, chunk by chunk in a thread pool
+
+        The means of every frame are cached for each light and ROI, so that
+        changing the start and end of a time course does not read any frame again.
+
+        Args:
+            workers (int): The number of threads reading and averaging chunks
+            chunk_size (int): The number of frames averaged by each task
+        """
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.generation = 0
+        self.index = None
+        self.light_frames = None
+
+    def use_index(self, index, light_frames=None):
+        """Compute the time courses from the integral index of the recording
+
+        Args:
+            index (IntegralIndex): The integral index of every frame, or None to average pixels
+            light_frames (list of array): The indices of the frames of each light in the
+                                          recording. Defaults to every frame for each light.
+        """
+        self.clear()
+        self.index = index
+        self.light_frames = light_frames
+
+    def key(self, light_index, extents):
+        """Return the cache key of a light and ROI
+
+        Args:
+            light_index (int): The index of the light
+            extents (list): The extents of the ROI, or None for the whole frame
+
+        Returns:
+            tuple: The key of the time course in the cache
+        """
+        if extents is None:
+            return (light_index, None)
+        return (light_index, tuple(round(value) for value in extents))
+
+    def compute(self, frames, light_index, extents=None, progress=None):
+        """Return the mean of a ROI in each frame, computing it if it is not cached
+
+        Starting a new computation abandons the one in progress. With an integral
+        index, the ROI is snapped to its blocks and no frame is read.
+
+        Args:
+            frames (array): The frames of the light
+            light_index (int): The index of the light
+            extents (list): The extents of the ROI, or None for the whole frame
+            progress (function): Called with the partial means while they are computed,
+                                 NaN for the frames not averaged yet
+
+        Returns:
+            array: The mean of each frame, or None if the computation was abandoned
+        """
+        index = self.index
+        if index is not None and extents is not None:
+            extents = index.snap(extents)
+        key = self.key(light_index, extents)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            self.generation += 1
+            generation = self.generation
+        if index is not None:
+            frame_indices = slice(None)
+            if self.light_frames is not None:
+                frame_indices = self.light_frames[light_index]
+            values = index.time_course(extents, frame_indices)
+            self.store(key, values)
+            return values
+        if extents is not None:
+            frames = shrink_array(frames, extents)
+        values = np.full(len(frames), np.nan)
+        futures = {
+            self.pool.submit(
+                chunk_means, frames, start, min(start + self.chunk_size, len(frames))
+            ): start
+            for start in range(0, len(frames), self.chunk_size)
+        }
+        last_progress = time.perf_counter()
+        for future in as_completed(futures):
+            if generation != self.generation:
+                for pending in futures:
+                    pending.cancel()
+                return None
+            means = future.result()
+            values[futures[future] : futures[future] + len(means)] = means
+            if progress is not None and (
+                time.perf_counter() - last_progress > PROGRESS_INTERVAL
+            ):
+                last_progress = time.perf_counter()
+                progress(values)
+        self.store(key, values)
+        return values
+
+    def store(self, key, values):
+        """Cache a time course, forgetting the oldest one when the cache is full
+
+        Args:
+            key (tuple): The key of the time course
+            values (array): The mean of each frame
+        """
+        with self.lock:
+            if len(self.cache) >= CACHE_SIZE:
+                del self.cache[next(iter(self.cache))]
+            self.cache[key] = values
+
+    def clear(self):
+        """Forget every cached time course and abandon the computation in progress"""
+        with self.lock:
+            self.cache = {}
+            self.generation += 1
+
+    def close(self):
+        """Stop the threads of the pool"""
+        self.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
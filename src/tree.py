@@ -1,7 +1,7 @@
 import os
 import random
 import numpy as np
-from src.waveforms import digital_square, make_signal
+from src.waveforms import make_segment, render_segments, sample_events, segment_events
 from PyQt5.QtWidgets import QTreeWidget, QTreeWidgetItem
 from PyQt5.QtGui import QBrush, QColor, QIcon
 from src.blocks import Block, Stimulation
@@ -15,6 +15,7 @@ class Tree(QTreeWidget):
         self.stim1_values = []
         self.stim2_values = []
         self.baseline_values = []
+        self.segments = []
         pass
 
     def first_stimulation(self):
@@ -142,140 +143,83 @@ class Tree(QTreeWidget):
         tree_item.setText(19, str(dictionary["canal2"]))
         tree_item.setText(30, str(dictionary["canal3"]))
 
-    def graph(self, item=None, current=False):
+    def graph(self, item=None, current=False, dense=True):
         """
         Generate the x and y values for an item in the tree
 
         Args:
             item (QTreeWidgetItem): The item to graph. Defaults to current item.
+            dense (bool): If False, the signals are only sampled around their
+                          transitions, without rendering the whole protocol
         """
         try:
-            if item == self.invisibleRootItem() or current:
-                self.elapsed_time = 0
-                self.baseline_values = []
-                self.x_values = []
-                self.stim1_values = []
-                self.stim2_values = []
-                self.stim3_values = np.empty(0, dtype=bool)
-            if item.childCount() > 0:
-                if item == self.invisibleRootItem():
-                    jitter, block_delay, iterations = 0, 0, 1
-                else:
-                    jitter = float(item.text(3))
-                    iterations = int(item.text(1))
-                    block_delay = float(item.text(2))
-                for i in range(iterations):
-                    for index in range(item.childCount()):
-                        child = item.child(index)
-                        self.graph(child)
-                    delay = block_delay + random.random() * jitter
-                    time_values = np.linspace(
-                        self.elapsed_time,
-                        self.elapsed_time + delay,
-                        int(round(delay * 3000)),
-                    )
-                    data = np.zeros(len(time_values))
-                    ddata = np.full(len(time_values), False)
-                    self.elapsed_time += delay
-                    self.x_values = np.concatenate((self.x_values, time_values))
-                    self.stim1_values = np.concatenate((self.stim1_values, data))
-                    self.stim2_values = np.concatenate((self.stim2_values, data))
-                    self.stim3_values = np.concatenate((self.stim3_values, ddata))
+            segments = []
+            self.compile(item, segments)
+            if dense:
+                (
+                    self.x_values,
+                    self.stim1_values,
+                    self.stim2_values,
+                    self.stim3_values,
+                    self.baseline_values,
+                ) = render_segments(segments)
             else:
-                duration = float(item.text(6))
-                # PROBLEMATIC
-                time_values = np.linspace(0, duration, int(round(duration * 3000)))
-                if item.text(18) == "True":
-                    (
-                        sign_type,
-                        pulses,
-                        jitter,
-                        width,
-                        frequency,
-                        duty,
-                        heigth,
-                    ) = self.get_attributes(item, canal=1)
-                    data = make_signal(
-                        time_values,
-                        sign_type,
-                        width,
-                        pulses,
-                        jitter,
-                        frequency,
-                        duty,
-                        heigth,
-                    )
-                    self.stim1_values = np.concatenate((self.stim1_values, data))
-                else:
-                    self.stim1_values = np.concatenate(
-                        (self.stim1_values, np.zeros(len(time_values)))
-                    )
-
-                if item.text(19) == "True":
-                    (
-                        sign_type2,
-                        pulses2,
-                        jitter2,
-                        width2,
-                        frequency2,
-                        duty2,
-                        heigth2,
-                    ) = self.get_attributes(item, canal=2)
-                    data2 = make_signal(
-                        time_values,
-                        sign_type2,
-                        width2,
-                        pulses2,
-                        jitter2,
-                        frequency2,
-                        duty2,
-                        heigth2,
-                    )
-                    self.stim2_values = np.concatenate((self.stim2_values, data2))
-                else:
-                    self.stim2_values = np.concatenate(
-                        (self.stim2_values, np.zeros(len(time_values)))
-                    )
-
-                if item.text(30) == "True":
-                    (
-                        sign_type3,
-                        pulses3,
-                        jitter3,
-                        width3,
-                        frequency3,
-                        duty3,
-                        heigth3,
-                    ) = self.get_attributes(item, canal=3)
-
-                    data3 = digital_square(time_values, frequency3, duty3)
-                    self.stim3_values = np.concatenate((self.stim3_values, data3))
-                else:
-                    self.stim3_values = np.concatenate(
-                        (self.stim3_values, np.full(len(time_values), False))
-                    )
-
-                if (
-                    item.text(18) == "False"
-                    and item.text(19) == "False"
-                    and item.text(30) == "False"
-                    and item.text(17) == "True"
-                ):
-                    baseline_start_index = len(self.x_values)
-                    baseline_stop_index = len(self.x_values) + len(time_values)
-                    self.baseline_values.append(
-                        [baseline_start_index, baseline_stop_index]
-                    )
-                time_values += self.elapsed_time
-                self.x_values = np.concatenate((self.x_values, time_values))
-                self.elapsed_time += duration
+                events, self.baseline_values = segment_events(segments)
+                (
+                    self.x_values,
+                    self.stim1_values,
+                    self.stim2_values,
+                    self.stim3_values,
+                ) = sample_events(
+                    events, sum(segment["samples"] for segment in segments)
+                )
+            self.segments = segments
+            self.elapsed_time = sum(segment["duration"] for segment in segments)
         except Exception as err:
             self.x_values = []
             self.stim1_values = []
             self.stim2_values = []
             self.stim3_values = np.empty(0, dtype=bool)
+            self.baseline_values = []
+            self.segments = []
             self.elapsed_time = 0
 
+    def compile(self, item, segments):
+        """
+        Recursively flatten an item of the tree into a list of segments
+
+        Args:
+            item (QTreeWidgetItem): The item to flatten
+            segments (list of dict): The list to which the segments are added
+        """
+        if item.childCount() > 0:
+            if item == self.invisibleRootItem():
+                jitter, block_delay, iterations = 0, 0, 1
+            else:
+                jitter = float(item.text(3))
+                iterations = int(item.text(1))
+                block_delay = float(item.text(2))
+            for i in range(iterations):
+                for index in range(item.childCount()):
+                    self.compile(item.child(index), segments)
+                delay = block_delay + random.random() * jitter
+                segments.append(make_segment(delay))
+        else:
+            signals = []
+            for canal, column in [(1, 18), (2, 19), (3, 30)]:
+                if item.text(column) == "True":
+                    signals.append(self.get_attributes(item, canal=canal))
+                else:
+                    signals.append(None)
+            segments.append(
+                make_segment(
+                    float(item.text(6)),
+                    signals,
+                    baseline=signals == [None, None, None] and item.text(17) == "True",
+                    seed=np.random.randint(2**31),
+                )
+            )
+
     def create_blocks(self, item=None):
         """Recursively create blocks from tree items
 
@@ -42,7 +42,29 @@ def digital_square(time, frequency, duty, delay=0):
     return np.concatenate((np.full(delay, False), pulses))[:-delay]
 
 
-def random_square(time, pulses, width, jitter):
+def random_pulse_bounds(duration, pulses, width, jitter, random_state=None):
+    """Draw the bounds of the pulses of a random square signal
+
+    Args:
+        duration (float): The time of the last sample of the signal
+        pulses (int): The number of pulses to generate
+        width (float): The width of each individual pulse
+        jitter (float): The random delay between each individual pulse
+        random_state (RandomState, optional): The random generator to use. Defaults to the global one.
+
+    Returns:
+        tuple: The times after which and before which each pulse is high
+    """
+    if random_state is None:
+        random_state = np.random
+    buffer = (float(width) + jitter, float(duration - width - jitter))
+    uniform_distribution = np.linspace(*buffer, pulses)
+    random_numbers = np.around(random_state.uniform(-jitter, jitter, pulses), 3)
+    randomized_distribution = uniform_distribution + random_numbers
+    return randomized_distribution - width / 2, randomized_distribution + width / 2
+
+
+def random_square(time, pulses, width, jitter, random_state=None):
     """Generate a random square signal
 
     Args:
@@ -50,21 +72,31 @@ def random_square(time, pulses, width, jitter):
         pulses (int): The number of pulses to generate
         width (float): The width of each individual pulse
         jitter (float): The random delay between each individual pulse
+        random_state (RandomState, optional): The random generator to use. Defaults to the global one.
 
     Returns:
         array of float: The generated signal
     """
     pulse_signal = np.zeros(len(time))
-    buffer = (float(width) + jitter, float(time[-1] - width - jitter))
-    uniform_distribution = np.linspace(*buffer, pulses)
-    random_numbers = np.around(np.random.uniform(-jitter, jitter, pulses), 3)
-    randomized_distribution = uniform_distribution + random_numbers
-    for value in randomized_distribution:
-        pulse_signal[(time > value - width / 2) & (time < value + width / 2)] = 5
+    lows, highs = random_pulse_bounds(time[-1], pulses, width, jitter, random_state)
+    starts = np.searchsorted(time, lows, side="right")
+    stops = np.searchsorted(time, highs, side="left")
+    for start, stop in zip(starts, stops):
+        pulse_signal[start:stop] = 5
     return pulse_signal
 
 
-def make_signal(time, pulse_type, width, pulses, jitter, frequency, duty, heigth):
+def make_signal(
+    time,
+    pulse_type,
+    width,
+    pulses,
+    jitter,
+    frequency,
+    duty,
+    heigth,
+    random_state=None,
+):
     """ " Generate a signal based on the given pulse type
 
     Args:
@@ -75,6 +107,7 @@ def make_signal(time, pulse_type, width, pulses, jitter, frequency, duty, heigth
         jitter (float): The random delay between each individual pulse
         frequency (float): The frequency of the signal
         duty (float): The duty cycle of the signal
+        random_state (RandomState, optional): The random generator used by random signals
 
     Returns:
         array of float: The generated signal
@@ -82,4 +115,465 @@ def make_signal(time, pulse_type, width, pulses, jitter, frequency, duty, heigth
     if pulse_type == "square":
         return square_signal(time, frequency, duty, heigth)
     if pulse_type == "random-square":
-        return random_square(time, pulses, width, jitter)
+        return random_square(time, pulses, width, jitter, random_state)
+
+
+def make_segment(duration, signals=(None, None, None), baseline=False, seed=None):
+    """Describe a portion of a protocol to be rendered by render_segments
+
+    Args:
+        duration (float): The duration of the segment in seconds
+        signals (tuple): The attributes of each stimulation channel, or None if the channel is off
+        baseline (bool): Whether the segment is a baseline
+        seed (int): The seed of the random signals of the segment, so that they are
+                    the same wherever the segment is rendered. Defaults to drawing
+                    them from the random generator of the protocol.
+
+    Returns:
+        dict: The segment
+    """
+    return {
+        "duration": duration,
+        "samples": int(round(duration * 3000)),
+        "signals": tuple(signals),
+        "baseline": baseline,
+        "seed": seed,
+    }
+
+
+def segment_random_state(segment, random_state=None):
+    """Return the random generator of the random signals of a segment
+
+    Args:
+        segment (dict): The segment created by make_segment
+        random_state (RandomState, optional): The random generator of the protocol
+
+    Returns:
+        RandomState: A generator seeded by the segment if it has a seed, the
+                     generator of the protocol otherwise
+    """
+    if segment.get("seed") is not None:
+        return np.random.RandomState(segment["seed"])
+    return random_state
+
+
+def render_signal(canal, time, attributes, random_state=None):
+    """Generate the signal of a stimulation channel
+
+    Args:
+        canal (int): The index of the channel (0, 1 or 2)
+        time (array of float): The array of time values
+        attributes (tuple): The type, pulses, jitter, width, frequency, duty and heigth of the signal
+        random_state (RandomState, optional): The random generator used by random signals
+
+    Returns:
+        array: The generated signal
+    """
+    sign_type, pulses, jitter, width, frequency, duty, heigth = attributes
+    if canal == 2:
+        return digital_square(time, frequency, duty)
+    signal = make_signal(
+        time, sign_type, width, pulses, jitter, frequency, duty, heigth, random_state
+    )
+    if signal is None:
+        raise ValueError(f"Unknown signal type: {sign_type}")
+    return signal
+
+
+def render_segments(segments):
+    """Render a flat list of segments into time and stimulation arrays
+
+    The output arrays are allocated once and filled in place. Deterministic
+    waveforms are rendered once per set of attributes and reused.
+
+    Args:
+        segments (list of dict): The segments created by make_segment
+
+    Returns:
+        tuple: The time values, the three stimulation signals and the baseline indices
+    """
+    samples = [segment["samples"] for segment in segments]
+    offsets = np.concatenate(([0], np.cumsum(samples, dtype=int)))
+    x_values = np.empty(offsets[-1])
+    stim_values = (
+        np.zeros(offsets[-1]),
+        np.zeros(offsets[-1]),
+        np.zeros(offsets[-1], dtype=bool),
+    )
+    baseline_values = []
+    cache = {}
+    elapsed_time = 0
+    for segment, start, stop in zip(segments, offsets[:-1], offsets[1:]):
+        random_state = segment_random_state(segment)
+        time_key = (segment["duration"], segment["samples"])
+        if time_key not in cache:
+            cache[time_key] = np.linspace(0, segment["duration"], segment["samples"])
+        time = cache[time_key]
+        np.add(time, elapsed_time, out=x_values[start:stop])
+        for canal, attributes in enumerate(segment["signals"]):
+            if attributes is None:
+                continue
+            if canal == 2 or attributes[0] == "square":
+                key = (canal, time_key, tuple(attributes))
+                if key not in cache:
+                    cache[key] = render_signal(canal, time, attributes)
+                stim_values[canal][start:stop] = cache[key]
+            else:
+                stim_values[canal][start:stop] = render_signal(
+                    canal, time, attributes, random_state
+                )
+        if segment["baseline"]:
+            baseline_values.append([int(start), int(stop)])
+        elapsed_time += segment["duration"]
+    return (x_values, *stim_values, baseline_values)
+
+
+EVENT_DTYPE = np.dtype([("sample", np.int64), ("channel", np.uint8), ("value", float)])
+
+
+def segment_time(duration, samples):
+    """Return the time of samples of a segment, as given by np.linspace(0, duration, samples)
+
+    Args:
+        duration (float): The duration of the segment in seconds
+        samples (int): The number of samples of the segment
+
+    Returns:
+        function: The time of an array of sample indices
+    """
+    step = duration / max(samples - 1, 1)
+    return lambda indices: np.where(indices == samples - 1, duration, indices * step)
+
+
+def estimate_indices(time_at, samples, values):
+    """Estimate the first sample at or after each time from the slope of the time values
+
+    Args:
+        time_at (function): The increasing time of an array of sample indices
+        samples (int): The number of samples
+        values (array of float): The times to find
+
+    Returns:
+        array of int: The estimated sample indices, between 0 and samples
+    """
+    first, last = time_at(np.array([0, max(samples - 1, 0)]))
+    if last <= first:
+        return np.zeros(len(values), dtype=np.int64)
+    slope = (last - first) / (samples - 1)
+    indices = np.ceil((np.asarray(values, dtype=float) - first) / slope)
+    return np.clip(np.nan_to_num(indices), 0, samples).astype(np.int64)
+
+
+def search_time(time_at, samples, values, side="left"):
+    """Find the sample indices where times would be inserted, like np.searchsorted
+
+    Only the samples around the estimated indices are evaluated.
+
+    Args:
+        time_at (function): The increasing time of an array of sample indices
+        samples (int): The number of samples
+        values (array of float): The times to find
+        side (str): "left" for the first sample at or after each time, "right" for after
+
+    Returns:
+        array of int: The sample indices
+    """
+    values = np.asarray(values, dtype=float)
+    indices = estimate_indices(time_at, samples, values)
+    reached = (lambda t: t >= values) if side == "left" else (lambda t: t > values)
+    while True:
+        left = (indices > 0) & reached(time_at(np.maximum(indices - 1, 0)))
+        right = (indices < samples) & ~reached(
+            time_at(np.minimum(indices, samples - 1))
+        )
+        if not (left.any() or right.any()):
+            return indices
+        indices = indices - left + right
+
+
+def square_intervals(time_at, samples, frequency, duty):
+    """Find the sample intervals where a sampled square wave is high
+
+    The wave is high where scipy.signal.square(2 * pi * frequency * t, duty) is
+    positive, as in square_signal and digital_square. Only the samples around
+    each theoretical edge are evaluated.
+
+    Args:
+        time_at (function): The increasing time of an array of sample indices
+        samples (int): The number of samples
+        frequency (float): The frequency of the wave
+        duty (float): The duty cycle of the wave
+
+    Returns:
+        tuple: The first and following sample indices of each high interval
+    """
+    if samples <= 0 or duty <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    def high(indices):
+        valid = (indices >= 0) & (indices < samples)
+        times = time_at(np.clip(indices, 0, samples - 1))
+        return valid & (
+            np.mod(2 * np.pi * frequency * times, 2 * np.pi) < duty * 2 * np.pi
+        )
+
+    def settle(candidates, rising):
+        found = []
+        for offset in range(-2, 3):
+            indices = np.unique(candidates) + offset
+            indices = indices[(indices >= 0) & (indices <= samples)]
+            changed = high(indices) != high(indices - 1)
+            found.append(indices[changed & (high(indices) == rising)])
+        return np.unique(np.concatenate(found))
+
+    first, last = time_at(np.array([0, samples - 1])) * frequency
+    cycles = np.arange(np.floor(first) - 1, np.floor(last) + 2)
+    if frequency == 0:
+        cycles = np.zeros(1)
+    starts = settle(
+        estimate_indices(time_at, samples, cycles / max(frequency, 1e-300)), True
+    )
+    stops = settle(
+        estimate_indices(time_at, samples, (cycles + duty) / max(frequency, 1e-300)),
+        False,
+    )
+    return starts, stops
+
+
+def signal_intervals(canal, duration, samples, attributes, random_state=None):
+    """Find the sample intervals where a stimulation channel is high, without rendering it
+
+    Args:
+        canal (int): The index of the channel (0, 1 or 2)
+        duration (float): The duration of the segment in seconds
+        samples (int): The number of samples of the segment
+        attributes (tuple): The type, pulses, jitter, width, frequency, duty and heigth of the signal
+        random_state (RandomState, optional): The random generator used by random signals
+
+    Returns:
+        tuple: The first and following sample indices and the value of each high interval
+    """
+    sign_type, pulses, jitter, width, frequency, duty, heigth = attributes
+    time_at = segment_time(duration, samples)
+    if canal == 2:
+        starts, stops = square_intervals(time_at, samples, frequency, duty)
+        return starts, stops, np.ones(len(starts))
+    if sign_type == "square":
+        starts, stops = square_intervals(time_at, samples, frequency, duty)
+        return starts, stops, np.full(len(starts), float(heigth))
+    if sign_type == "random-square":
+        lows, highs = random_pulse_bounds(
+            time_at(np.array(samples - 1)), pulses, width, jitter, random_state
+        )
+        starts = search_time(time_at, samples, lows, side="right")
+        stops = search_time(time_at, samples, highs, side="left")
+        return starts, stops, np.full(len(starts), 5.0)
+    raise ValueError(f"Unknown signal type: {sign_type}")
+
+
+def interval_events(channel, starts, stops, values):
+    """Create the transitions of a channel from its high intervals
+
+    Args:
+        channel (int): The index of the channel
+        starts (array of int): The first sample index of each interval
+        stops (array of int): The sample index following each interval
+        values (array of float): The value of each interval
+
+    Returns:
+        array: The unsorted transitions, with the EVENT_DTYPE fields
+    """
+    kept = stops > starts
+    events = np.empty(2 * np.count_nonzero(kept), dtype=EVENT_DTYPE)
+    events["sample"] = np.concatenate((starts[kept], stops[kept]))
+    events["channel"] = channel
+    events["value"] = np.concatenate((values[kept], np.zeros(np.count_nonzero(kept))))
+    return events
+
+
+def compact_events(events):
+    """Sort transitions and keep only those that change the value of their channel
+
+    While any of its intervals is high, a channel holds the value of the latest
+    started one, and zero otherwise. Intervals of equal values are merged where
+    they touch or overlap, and touching intervals of different values change the
+    value at their boundary. All channels start at zero.
+
+    Args:
+        events (array): The transitions, with the EVENT_DTYPE fields
+
+    Returns:
+        array: The transitions sorted by sample index, then by channel
+    """
+    events = events[np.lexsort((events["sample"], events["channel"]))]
+    compacted = []
+    for channel in np.unique(events["channel"]):
+        transitions = events[events["channel"] == channel]
+        rising = transitions["value"] != 0
+        level = np.cumsum(np.where(rising, 1, -1))
+        latest = np.maximum.accumulate(np.where(rising, np.arange(len(transitions)), 0))
+        last = np.append(
+            np.flatnonzero(np.diff(transitions["sample"])), len(transitions) - 1
+        )
+        values = np.where(level[last] > 0, transitions["value"][latest[last]], 0.0)
+        changed = np.diff(values, prepend=0.0) != 0
+        kept = transitions[last[changed]]
+        kept["value"] = values[changed]
+        compacted.append(kept)
+    if not compacted:
+        return events
+    events = np.concatenate(compacted)
+    return events[np.lexsort((events["channel"], events["sample"]))]
+
+
+def segment_events(segments, random_state=None):
+    """Generate the transitions of the stimulation channels of a protocol
+
+    Random signals draw from the random generator in the same order as
+    render_segments, so the same seed gives the same protocol.
+
+    Args:
+        segments (list of dict): The segments created by make_segment
+        random_state (RandomState, optional): The random generator used by random signals
+
+    Returns:
+        tuple: The transitions, with the EVENT_DTYPE fields, and the baseline indices
+    """
+    events, baseline_values, start = [], [], 0
+    for segment in segments:
+        segment_state = segment_random_state(segment, random_state)
+        for canal, attributes in enumerate(segment["signals"]):
+            if attributes is None:
+                continue
+            starts, stops, values = signal_intervals(
+                canal,
+                segment["duration"],
+                segment["samples"],
+                attributes,
+                segment_state,
+            )
+            events.append(interval_events(canal, starts + start, stops + start, values))
+        if segment["baseline"]:
+            baseline_values.append([start, start + segment["samples"]])
+        start += segment["samples"]
+    events = np.concatenate(events) if events else np.empty(0, dtype=EVENT_DTYPE)
+    return compact_events(events), baseline_values
+
+
+def sample_events(events, sample_count, channels=3):
+    """Sample the signals of a protocol around each transition, to plot them without rendering them
+
+    Args:
+        events (array): The sorted transitions, with the EVENT_DTYPE fields
+        sample_count (int): The number of samples of the protocol
+        channels (int): The number of channels to sample
+
+    Returns:
+        tuple: The time values and the value of each channel at the sampled indices
+    """
+    samples = np.unique(
+        np.concatenate(([0], events["sample"], [max(sample_count - 1, 0)]))
+    )
+    samples = samples[samples < max(sample_count, 1)]
+    indices = np.unique(np.concatenate((samples, np.maximum(samples - 1, 0))))
+    values = []
+    for channel in range(channels):
+        transitions = events[events["channel"] == channel]
+        previous = np.searchsorted(transitions["sample"], indices, side="right") - 1
+        values.append(
+            np.where(previous >= 0, transitions["value"][np.maximum(previous, 0)], 0.0)
+            if len(transitions) > 0
+            else np.zeros(len(indices))
+        )
+    return (indices / 3000, *values)
+
+
+def light_events(sample_count, framerate, exposure, light_count):
+    """Generate the transitions of the light and camera signals of a protocol
+
+    The lights are the signals generated by the DAQ, channels 0 to light_count - 1,
+    and the camera is their union, channel light_count.
+
+    Args:
+        sample_count (int): The number of samples of the protocol
+        framerate (float): The framerate of the camera
+        exposure (float): The exposure time of each frame in seconds
+        light_count (int): The number of interleaved lights
+
+    Returns:
+        array: The transitions, with the EVENT_DTYPE fields
+    """
+    events = []
+    for light_index in range(light_count):
+        delay = int(light_index * 3000 / framerate)
+        starts, stops = square_intervals(
+            lambda indices: indices / 3000,
+            sample_count - delay,
+            framerate / light_count,
+            framerate * exposure / light_count,
+        )
+        starts = starts + delay
+        stops = np.minimum(stops + delay, sample_count - 1)
+        values = np.ones(len(starts))
+        events.append(interval_events(light_index, starts, stops, values))
+        events.append(interval_events(light_count, starts, stops, values))
+    events = np.concatenate(events) if events else np.empty(0, dtype=EVENT_DTYPE)
+    return compact_events(events)
+
+
+def render_events(events, start, stop, channels=3, initial=None):
+    """Render the transitions of a protocol into dense signals between two samples
+
+    Args:
+        events (array): The sorted transitions, with the EVENT_DTYPE fields
+        start (int): The index of the first sample
+        stop (int): The index following the last sample
+        channels (int): The number of channels to render
+        initial (array, optional): The value of each channel before the first sample.
+                                   Defaults to the values set by the previous transitions.
+
+    Returns:
+        array: The value of each channel at each sample
+    """
+    first, last = np.searchsorted(events["sample"], [start, stop])
+    if initial is None:
+        initial = np.zeros(channels)
+        for channel in range(channels):
+            values = events["value"][:first][events["channel"][:first] == channel]
+            if len(values) > 0:
+                initial[channel] = values[-1]
+    window = events[first:last]
+    signals = np.empty((channels, stop - start))
+    for channel in range(channels):
+        transitions = window[window["channel"] == channel]
+        starts = np.concatenate(([0], transitions["sample"] - start))
+        values = np.concatenate(([initial[channel]], transitions["value"]))
+        signals[channel] = np.repeat(values, np.diff(np.append(starts, stop - start)))
+    return signals
+
+
+def stream_events(events, sample_count, block_size, channels=3):
+    """Render the transitions of a protocol block by block
+
+    Args:
+        events (array): The sorted transitions, with the EVENT_DTYPE fields
+        sample_count (int): The number of samples of the protocol
+        block_size (int): The number of samples in each block
+        channels (int): The number of channels to render
+
+    Yields:
+        array: The value of each channel at each sample of a block
+    """
+    state = np.zeros(channels)
+    starts = np.arange(0, sample_count, block_size)
+    bounds = np.searchsorted(events["sample"], np.append(starts, sample_count))
+    for index, start in enumerate(starts):
+        signals = render_events(
+            events[bounds[index] : bounds[index + 1]],
+            start,
+            min(start + block_size, sample_count),
+            channels,
+            state,
+        )
+        state = signals[:, -1].copy()
+        yield signals
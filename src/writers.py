@@ -0,0 +1,228 @@
+import time
+import queue
+import logging
+import threading
+import numpy as np
+from src.buffers import CHUNK_SIZE
+from src.calculations import shrink_array
+from src.journal import Journal, encode_channels
+from src.recording import CompressedRecording, LightRecording, Recording
+from src.metrics import metrics
+
+
+class ChunkWriter:
+    def __init__(
+        self,
+        buffer,
+        directory,
+        extents=None,
+        lights=None,
+        workers=1,
+        queue_size=None,
+        compress=False,
+        light_datasets=False,
+        channels=None,
+    ):
+        """A background stage writing full chunks of the frame buffer to a recording
+
+        The grab loop submits chunks through a bounded queue and one or more writer
+        threads crop them to the ROI and write them to the recording. Slots of the
+        frame buffer are released in order once their chunk is on disk, which
+        throttles the grab loop when the disk falls behind. Each chunk on disk is
+        committed to an append-only journal, from which a recording interrupted by a
+        crash can be recovered.
+
+        Args:
+            buffer (FrameBuffer): The frame buffer to read the chunks from
+            directory (str): The directory in which to save the recording
+            extents (tuple): The positions of the corners used to resize the frames
+                             Equal to None if original size is kept
+            lights (list of str): The names of the interleaved light channels. Defaults to none.
+            workers (int): The number of writer threads
+            queue_size (int): The maximum number of chunks waiting to be written.
+                              Defaults to the number of chunks held by the buffer.
+            compress (bool): If True, the chunks are saved losslessly compressed
+            light_datasets (bool): If True, each light is saved to its own chunked dataset
+            channels (function): Returns the light channel index of the frames between two
+                                 positions of the buffer, used to route them to their dataset
+        """
+        self.buffer = buffer
+        self.directory = directory
+        self.extents = extents
+        self.lights = [] if lights is None else list(lights)
+        self.workers = workers
+        self.compress = compress
+        self.light_datasets = light_datasets
+        self.channels = channels
+        if queue_size is None:
+            queue_size = max(buffer.capacity // CHUNK_SIZE, 1)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.closed = True
+
+    def start(self):
+        """Create the recording, register the saver cursor and start the writer threads"""
+        shape = self.buffer.shape
+        if self.extents:
+            shape = shrink_array(np.empty((0, *shape)), self.extents).shape[1:]
+        if self.light_datasets:
+            layout = "lights"
+            self.recording = LightRecording(
+                self.directory,
+                shape,
+                self.lights,
+                dtype=self.buffer.dtype,
+                channels=self.channels,
+            )
+        elif self.compress:
+            layout = "compressed"
+            self.recording = CompressedRecording(
+                self.directory, shape, self.lights, dtype=self.buffer.dtype
+            )
+        else:
+            layout = "frames"
+            self.recording = Recording(
+                self.directory, shape, self.lights, dtype=self.buffer.dtype
+            )
+        self.journal = Journal(self.directory)
+        self.journal.append(
+            "Begin",
+            Layout=layout,
+            Shape=list(shape),
+            Dtype=np.dtype(self.buffer.dtype).name,
+            Lights=self.lights,
+        )
+        self.buffer.add_cursor("saver", 0)
+        self.submitted = 0
+        self.completed = {}
+        self.bytes_written = 0
+        self.write_time = 0
+        self.alarm = False
+        self.closed = False
+        self.threads = []
+        metrics.register("writer.queue", lambda: self.queue_depth)
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def queue_depth(self):
+        """Return the number of chunks waiting to be written"""
+        return self.queue.qsize()
+
+    @property
+    def bandwidth(self):
+        """Return the write bandwidth in bytes per second"""
+        if self.write_time == 0:
+            return 0
+        return self.bytes_written / self.write_time
+
+    def poll(self):
+        """Submit every full chunk of the buffer and check if the disk falls behind"""
+        while self.buffer.written - self.submitted >= CHUNK_SIZE:
+            self.submit(self.submitted, CHUNK_SIZE)
+        behind = self.buffer.free() < CHUNK_SIZE
+        if behind and not self.alarm:
+            logging.warning(
+                f"Chunk writer is falling behind ({self.queue_depth} chunks queued)"
+            )
+        self.alarm = behind
+
+    def submit(self, start, count):
+        """Queue a chunk of frames to be written
+
+        Args:
+            start (int): The absolute index of the first frame of the chunk
+            count (int): The number of frames in the chunk
+        """
+        self.queue.put((start, count))
+        self.submitted = start + count
+
+    def work(self):
+        """Write the queued chunks until the writer is closed"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            start, count = item
+            try:
+                frames = self.buffer.view(start, start + count)
+                if self.extents:
+                    frames = shrink_array(frames, self.extents)
+                write_start = time.perf_counter()
+                self.recording.write(start, frames)
+                with self.lock:
+                    self.write_time += time.perf_counter() - write_start
+                    self.bytes_written += frames.nbytes
+                metrics.observe("writer.chunk", time.perf_counter() - write_start)
+                metrics.increment("writer.bytes", frames.nbytes)
+                self.commit(start, count)
+            except Exception as err:
+                metrics.increment("writer.errors")
+                logging.error(f"Frames {start} to {start + count} not written: {err}")
+                if isinstance(self.recording, LightRecording):
+                    self.recording.skip(start, count)
+            self.release(start, count)
+
+    def commit(self, start, count):
+        """Record in the journal that a chunk is on disk, with the light channel of its frames
+
+        Args:
+            start (int): The absolute index of the first frame of the chunk
+            count (int): The number of frames in the chunk
+        """
+        if self.channels is None:
+            channels = np.arange(start, start + count) % max(len(self.lights), 1)
+        else:
+            channels = self.channels(start, start + count)
+        self.journal.append(
+            "Chunk",
+            Start=start,
+            Frames=count,
+            Phase=encode_channels(channels, start, len(self.lights)),
+        )
+
+    def release(self, start, count):
+        """Release buffer slots in order once their chunk is written
+
+        Args:
+            start (int): The absolute index of the first frame of the chunk
+            count (int): The number of frames in the chunk
+        """
+        with self.lock:
+            self.completed[start] = count
+            position = self.buffer.cursors["saver"]
+            for chunk_start in sorted(self.completed):
+                if chunk_start > position:
+                    break
+                released = chunk_start + self.completed.pop(chunk_start) - position
+                if released > 0:
+                    self.buffer.advance("saver", released)
+                    position += released
+
+    def close(self, save_remaining=True, channels=None):
+        """Write the last partial chunk if needed, wait for the writer threads and close the recording
+
+        Args:
+            save_remaining (bool): If True, the frames of the last partial chunk are saved
+            channels (array): The light channel index of each frame.
+                              Defaults to the lights cycling from the first frame.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.poll()
+        if save_remaining and self.buffer.written > self.submitted:
+            self.submit(self.submitted, self.buffer.written - self.submitted)
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.buffer.remove_cursor("saver")
+        if channels is not None:
+            channels = channels[: self.recording.frame_count]
+        self.recording.close(channels)
+        self.journal.append("End", Frames=self.recording.frame_count)
+        self.journal.close()
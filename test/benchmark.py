@@ -0,0 +1,376 @@
+import argparse
+import tempfile
+import tracemalloc
+import json
+import time
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import CHUNK_SIZE, FrameBuffer
+from src.writers import ChunkWriter
+from src.recording import CompressedRecording, LightRecording, Recording, open_frames
+from src.compression import ENCODER_WORKERS
+from src.baselines import RunningBaseline
+from src.waveforms import (
+    digital_square,
+    make_segment,
+    render_segments,
+    segment_events,
+    stream_events,
+)
+from src.calculations import (
+    average_baseline,
+    extend_light_signal,
+    frames_acquired_from_camera_signal,
+    get_timecourse,
+    separate_images,
+    shrink_array,
+)
+import numpy as np
+
+BASELINES = os.path.join(os.path.dirname(__file__), "benchmark_baselines.json")
+FRAMERATE = 57
+EXPOSURE = 0.015
+
+
+def camera_signals(duration, light_count=2):
+    """Generate the light and camera signals of a protocol like the DAQ does
+
+    Args:
+        duration (float): The duration of the protocol in seconds
+        light_count (int): The number of interleaved lights
+
+    Returns:
+        tuple: The stacked light signals and the camera signal
+    """
+    time_values = np.linspace(0, duration, int(duration * 3000))
+    lights = np.stack(
+        [
+            digital_square(
+                time_values,
+                FRAMERATE / light_count,
+                FRAMERATE * EXPOSURE / light_count,
+                int(light_index * 3000 / FRAMERATE),
+            )
+            for light_index in range(light_count)
+        ]
+    )
+    return lights, np.max(lights, axis=0)
+
+
+def protocol_segments(duration):
+    """Create the segments of a realistic protocol of baselines and stimulations
+
+    Args:
+        duration (float): The duration of the protocol in seconds
+
+    Returns:
+        list of dict: The segments of the protocol
+    """
+    segments = []
+    for _ in range(max(int(duration // 30), 1)):
+        segments.append(make_segment(10, baseline=True))
+        segments.append(
+            make_segment(
+                5,
+                (
+                    ("random-square", 20, 0.1, 0.05, 0, 0, 5),
+                    ("square", 0, 0, 0, 10, 0.5, 5),
+                    ("square", 0, 0, 0, 20, 0.2, 5),
+                ),
+            )
+        )
+        segments.append(make_segment(15))
+    return segments
+
+
+def bench_render_protocol(duration, directory):
+    """Render the signals of a protocol, as done by Tree.graph"""
+    segments = protocol_segments(duration)
+    samples = sum(segment["samples"] for segment in segments)
+    return (lambda: render_segments(segments), samples, "samples/s")
+
+
+def bench_protocol_events(duration, directory):
+    """Generate the transitions of a protocol and render them block by block"""
+    segments = protocol_segments(duration)
+    samples = sum(segment["samples"] for segment in segments)
+
+    def run():
+        events, _ = segment_events(segments)
+        for _ in stream_events(events, samples, 3000):
+            pass
+
+    return (run, samples, "samples/s")
+
+
+def bench_extend_light_signal(duration, directory):
+    """Extend the light signals of a protocol around the camera signal"""
+    lights, camera = camera_signals(duration)
+    return (lambda: extend_light_signal(lights, camera), len(camera), "samples/s")
+
+
+def bench_frames_acquired(duration, directory):
+    """Count the frames acquired at each sample of a protocol"""
+    _, camera = camera_signals(duration)
+    return (
+        lambda: frames_acquired_from_camera_signal(camera),
+        len(camera),
+        "samples/s",
+    )
+
+
+def bench_chunk_write(duration, directory):
+    """Crop and record two chunks of frames through the chunk writer"""
+    frames = np.random.default_rng(0).integers(
+        0, 4096, (CHUNK_SIZE // 10, 256, 256), dtype=np.uint16
+    )
+    count = 2 * CHUNK_SIZE
+
+    def run():
+        buffer = FrameBuffer(frames.shape[1:])
+        writer = ChunkWriter(buffer, directory, (0, 200, 0, 200), ["red", "ir"])
+        writer.start()
+        for _ in range(count // len(frames)):
+            buffer.write(frames, timeout=1)
+            writer.poll()
+        writer.close()
+
+    return (run, count, "frames/s")
+
+
+def compressed_frames(size, count):
+    """Generate noisy 12-bit frames like those of the camera
+
+    Args:
+        size (int): The height and width of the frames
+        count (int): The number of frames
+
+    Returns:
+        array: The frames
+    """
+    random_generator = np.random.default_rng(0)
+    background = random_generator.integers(500, 3500, (1, size, size))
+    return (
+        (background + random_generator.normal(0, 20, (count, size, size)))
+        .clip(0, 4095)
+        .astype(np.uint16)
+    )
+
+
+def bench_compressed_write(duration, directory):
+    """Compress a chunk of noisy 12-bit frames with the encoder pool, at binning 2"""
+    frames = compressed_frames(512, 120)
+
+    def run():
+        recording = CompressedRecording(directory, (512, 512), ["red", "ir"])
+        recording.write(0, frames)
+        recording.close()
+
+    return (run, len(frames), "frames/s")
+
+
+def bench_compressed_write_full(duration, directory):
+    """Compress a chunk of noisy 12-bit frames with the encoder pool, at binning 1
+
+    The throughput must stay above the live frame rate for compression to be
+    used at full resolution.
+    """
+    frames = compressed_frames(1024, 8 * ENCODER_WORKERS)
+
+    def run():
+        recording = CompressedRecording(directory, (1024, 1024), ["red", "ir"])
+        recording.write(0, frames)
+        recording.close()
+
+    return (run, len(frames), "frames/s")
+
+
+def bench_light_write(duration, directory):
+    """Route frames of two lights to their chunked datasets, at binning 1"""
+    frames = np.random.default_rng(0).integers(
+        0, 4096, (240, 1024, 1024), dtype=np.uint16
+    )
+
+    def run():
+        recording = LightRecording(directory, (1024, 1024), ["red", "ir"])
+        recording.write(0, frames)
+        recording.close()
+
+    return (run, len(frames), "frames/s")
+
+
+def bench_average_baseline(duration, directory):
+    """Average the baseline frames of two lights at full resolution"""
+    frames = list(
+        np.random.default_rng(0).integers(0, 4096, (100, 1024, 1024), dtype=np.uint16)
+    )
+    return (lambda: average_baseline(frames, 2, 1), len(frames), "frames/s")
+
+
+def bench_running_baseline(duration, directory):
+    """Add baseline frames of two lights to their running statistics, at binning 1"""
+    frames = np.random.default_rng(0).integers(
+        0, 4096, (96, 1024, 1024), dtype=np.uint16
+    )
+
+    def run():
+        baseline = RunningBaseline((1024, 1024), 2)
+        for start in range(0, len(frames), 8):
+            baseline.add(frames[start : start + 8], start)
+
+    return (run, len(frames), "frames/s")
+
+
+def bench_scout_time_course(duration, directory):
+    """Open a recording and compute the time course of a ROI for each light"""
+    frame_count = 2 * CHUNK_SIZE
+    recording = Recording(directory, (256, 256), ["red", "ir"])
+    for start in range(0, frame_count, CHUNK_SIZE):
+        recording.write(
+            start, np.full((CHUNK_SIZE, 256, 256), start // CHUNK_SIZE, np.uint16)
+        )
+    recording.close()
+
+    def run():
+        split_frames = separate_images(["red", "ir"], open_frames(directory))
+        for frames in split_frames:
+            get_timecourse(shrink_array(frames, (20, 120, 40, 200)), 0, len(frames))
+
+    return (run, frame_count, "frames/s")
+
+
+BENCHMARKS = {
+    "render_protocol": bench_render_protocol,
+    "protocol_events": bench_protocol_events,
+    "extend_light_signal": bench_extend_light_signal,
+    "frames_acquired": bench_frames_acquired,
+    "chunk_write": bench_chunk_write,
+    "compressed_write": bench_compressed_write,
+    "compressed_write_full": bench_compressed_write_full,
+    "light_write": bench_light_write,
+    "average_baseline": bench_average_baseline,
+    "running_baseline": bench_running_baseline,
+    "scout_time_course": bench_scout_time_course,
+}
+
+
+def measure(function, units):
+    """Measure the execution time, peak memory and throughput of a function
+
+    Args:
+        function (function): The function to measure
+        units (int): The number of samples or frames processed by the function
+
+    Returns:
+        dict: The time in seconds, the peak memory in bytes and the throughput
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"Time": elapsed, "Peak Memory": peak, "Throughput": units / elapsed}
+
+
+def run(names, duration, repeat=3):
+    """Run benchmarks and keep the fastest of a number of repetitions
+
+    Args:
+        names (list of str): The names of the benchmarks to run
+        duration (float): The duration of the generated protocols in seconds
+        repeat (int): The number of repetitions of each benchmark
+
+    Returns:
+        dict: The results of each benchmark
+    """
+    results = {}
+    for name in names:
+        with tempfile.TemporaryDirectory() as directory:
+            function, units, unit = BENCHMARKS[name](duration, directory)
+            measures = [measure(function, units) for _ in range(repeat)]
+        result = min(measures, key=lambda measure: measure["Time"])
+        result["Unit"] = unit
+        results[name] = result
+    return results
+
+
+def report(results, baselines, tolerance):
+    """Print the results next to their baselines and list the regressions
+
+    Args:
+        results (dict): The results of each benchmark
+        baselines (dict): The stored results of each benchmark
+        tolerance (float): The slowdown ratio above which a result is a regression
+
+    Returns:
+        list of str: The names of the regressed benchmarks
+    """
+    regressions = []
+    print(
+        f"{'Benchmark':<22}{'Time (s)':>12}{'Peak (MB)':>12}"
+        f"{'Throughput':>16}  {'Unit':<10}{'vs baseline':>12}{'vs live':>10}"
+    )
+    for name, result in results.items():
+        comparison = ""
+        if name in baselines:
+            ratio = result["Time"] / baselines[name]["Time"]
+            comparison = f"{ratio:.2f}x"
+            if ratio > tolerance:
+                comparison += " SLOWER"
+                regressions.append(name)
+        live = ""
+        if result["Unit"] == "frames/s":
+            live = f"{result['Throughput'] / FRAMERATE:.1f}x"
+            if result["Throughput"] < FRAMERATE:
+                live += " LOW"
+        print(
+            f"{name:<22}{result['Time']:>12.4f}{result['Peak Memory'] / 2**20:>12.1f}"
+            f"{result['Throughput']:>16.0f}  {result['Unit']:<10}{comparison:>12}"
+            f"{live:>14}"
+        )
+    return regressions
+
+
+def main(arguments=None):
+    """Run the benchmarks from the command line and compare them to the baselines
+
+    Args:
+        arguments (list of str): The command line arguments. Defaults to sys.argv.
+
+    Returns:
+        int: 1 if a benchmark regressed, 0 otherwise
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the acquisition and analysis hot paths"
+    )
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS))
+    parser.add_argument(
+        "--duration", type=int, default=3600, help="protocol duration in seconds"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument(
+        "--save", action="store_true", help="store the results as the new baselines"
+    )
+    arguments = parser.parse_args(arguments)
+    try:
+        with open(BASELINES, "r") as file:
+            stored = json.load(file)
+    except FileNotFoundError:
+        stored = {}
+    baselines = stored.get(str(arguments.duration), {})
+    results = run(arguments.names, arguments.duration, arguments.repeat)
+    regressions = report(results, baselines, arguments.tolerance)
+    if arguments.save:
+        baselines.update(results)
+        stored[str(arguments.duration)] = baselines
+        with open(BASELINES, "w") as file:
+            json.dump(stored, file, indent=4)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src import controls
+from src.controls import Camera
+from src.baselines import ActivationMaps, RunningBaseline
+from src.calculations import average_baseline
+import numpy as np
+
+
+class TestRunningBaseline(unittest.TestCase):
+    def test_running_mean(self):
+        """Test that the running mean of each light matches the mean of its frames"""
+        frames = list(np.random.default_rng(0).integers(0, 4096, (11, 4, 5)))
+        baseline = RunningBaseline((4, 5), 3)
+        baseline.add(frames[:4], 2)
+        baseline.add(frames[4:], 6)
+        for light, mean in enumerate(baseline.average()):
+            np.testing.assert_allclose(
+                np.mean(frames[(light - 2) % 3 :: 3], axis=0), mean
+            )
+        np.testing.assert_allclose(
+            average_baseline(frames[1:], 3, 0)[0], baseline.average()[0]
+        )
+
+    def test_running_variance(self):
+        """Test that the running variance of each light matches the sample variance"""
+        frames = np.random.default_rng(1).normal(100, 5, (20, 3, 3))
+        baseline = RunningBaseline((3, 3), 2)
+        baseline.add(frames)
+        for light, variance in enumerate(baseline.variance()):
+            np.testing.assert_allclose(
+                np.var(frames[light::2], axis=0, ddof=1), variance
+            )
+
+    def test_activation_maps(self):
+        """Test that the precomputed maps give the activation of a frame"""
+        mean, variance = np.full((2, 2), 100.0), np.full((2, 2), 4.0)
+        maps = ActivationMaps([mean], [variance])
+        frame = np.array([[100, 110], [90, 104]], dtype=np.uint16)
+        np.testing.assert_allclose(
+            (frame - mean) / mean, maps.compute(frame, 0, "Normal")
+        )
+        np.testing.assert_allclose(
+            np.log(frame / mean), maps.compute(frame, 0, "Logarithmic")
+        )
+        np.testing.assert_allclose([[0, 5], [-5, 2]], maps.compute(frame, 0, "Z-Score"))
+
+    def test_downsampled_activation_maps(self):
+        """Test that maps of a downsampled frame match the downsampled full maps"""
+        generator = np.random.default_rng(2)
+        mean, variance = generator.random((8, 8)) + 1, generator.random((8, 8)) + 1
+        maps = ActivationMaps([mean], [variance])
+        frame = generator.integers(0, 4096, (8, 8))
+        expected = np.array(maps.compute(frame, 0, "Z-Score"))[::2, ::2]
+        np.testing.assert_allclose(
+            expected, maps.compute(frame[::2, ::2], 0, "Z-Score", 2)
+        )
+
+    def test_camera_baseline_windows(self):
+        """Test that the camera averages the frames of each window as they are stored"""
+        config = dict(controls.config)
+        controls.config.update({"Simulated": True, "Binning": 256})
+        try:
+            camera = Camera("port0/line4", "camera")
+        finally:
+            controls.config.clear()
+            controls.config.update(config)
+        frames = np.arange(40, dtype=np.uint16)[:, None, None] * np.ones(
+            (4, 4), dtype=np.uint16
+        )
+        camera.store(list(frames[:7]))
+        camera.track_baselines([[5, 12], [20, 30]], 2)
+        camera.store(list(frames[7:15]))
+        self.assertTrue(camera.baseline_completed)
+        np.testing.assert_array_equal(
+            [8, 8], [mean[0, 0] for mean in camera.average_baseline]
+        )
+        camera.store(list(frames[15:40]))
+        np.testing.assert_array_equal(
+            [24, 25], [mean[0, 0] for mean in camera.average_baseline]
+        )
+        self.assertEqual([], camera.baseline_windows)
+
+
+if __name__ == "__main__":
+    unittest.main()
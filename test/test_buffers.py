@@ -0,0 +1,91 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import CHUNK_SIZE, FrameBuffer, FrameLog, buffer_capacity
+import tempfile
+import numpy as np
+
+
+def make_frames(start, stop):
+    """Create frames whose pixels are equal to their absolute index"""
+    return [np.full((2, 3), index, dtype=np.uint16) for index in range(start, stop)]
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def test_read_and_advance(self):
+        """Test that a cursor reads frames in order and wraps around the buffer"""
+        buffer = FrameBuffer((2, 3), capacity=4)
+        buffer.add_cursor("saver")
+        buffer.write(make_frames(0, 3))
+        np.testing.assert_array_equal([0, 1], buffer.read("saver", 2)[:, 0, 0])
+        buffer.advance("saver", 2)
+        buffer.write(make_frames(3, 6))
+        self.assertEqual(4, buffer.available("saver"))
+        np.testing.assert_array_equal([2, 3, 4, 5], buffer.read("saver", 4)[:, 0, 0])
+        self.assertEqual(0, buffer.dropped)
+
+    def test_full_buffer_drops_frames(self):
+        """Test that frames not read by lossless cursors are kept and new frames dropped"""
+        buffer = FrameBuffer((2, 3), capacity=4)
+        buffer.add_cursor("saver")
+        buffer.add_cursor("preview", lossless=False)
+        self.assertEqual(4, buffer.write(make_frames(0, 6), timeout=0.01))
+        self.assertEqual(2, buffer.dropped)
+        self.assertEqual(4, buffer.available("saver"))
+        np.testing.assert_array_equal([0, 1], buffer.view(0, 2)[:, 0, 0])
+        buffer.advance("saver", 1)
+        self.assertEqual(1, buffer.write(make_frames(6, 8)))
+        np.testing.assert_array_equal([1, 2, 3, 6], buffer.read("saver", 4)[:, 0, 0])
+        self.assertEqual(3, buffer.dropped)
+
+    def test_capacity_fits_memory(self):
+        """Test that the default capacity is bounded by the memory budget and by chunks"""
+        self.assertEqual(2 * CHUNK_SIZE, FrameBuffer((4, 4)).capacity)
+        capacity = buffer_capacity((1024, 1024), memory=3 * 1024**3)
+        self.assertEqual(1536, capacity)
+        self.assertEqual(
+            CHUNK_SIZE + CHUNK_SIZE // 4, buffer_capacity((1024, 1024), memory=0)
+        )
+
+    def test_latest(self):
+        """Test that the newest frame of a light channel is returned only once"""
+        buffer = FrameBuffer((2, 3), capacity=4)
+        buffer.add_cursor("preview", lossless=False)
+        buffer.write(make_frames(0, 5))
+        index, frame = buffer.latest("preview", light_index=1, light_count=2)
+        self.assertEqual(3, index)
+        self.assertEqual(3, frame[0, 0])
+        self.assertIsNone(buffer.latest("preview", light_index=1, light_count=2))
+
+
+class TestFrameLog(unittest.TestCase):
+    def test_dropped_frames(self):
+        """Test that gaps in the buffer indices are counted and keep the light channels in phase"""
+        log = FrameLog(capacity=2)
+        self.assertEqual(0, log.append([10, 11, 12], 1.0))
+        self.assertEqual(2, log.append([15, 16], 2.0))
+        self.assertEqual(1, log.append([18], 3.0))
+        self.assertEqual(3, log.dropped)
+        self.assertEqual([(3, 2), (5, 1)], log.gaps)
+        np.testing.assert_array_equal([0, 1, 0, 1, 0, 0], log.channels(2))
+        self.assertEqual(8, log.acquired_index(5))
+        np.testing.assert_array_equal([19, 20], log.following(2))
+        with tempfile.TemporaryDirectory() as directory:
+            log.save(directory)
+            saved = np.load(os.path.join(directory, "frame_log.npy"))
+        np.testing.assert_array_equal([10, 11, 12, 15, 16, 18], saved["buffer_index"])
+        np.testing.assert_array_equal([1, 1, 1, 2, 2, 3], saved["timestamp"])
+        log.drop([19, 20])
+        self.assertEqual(1, log.append([22], 4.0))
+        self.assertEqual(6, log.dropped)
+        self.assertEqual((6, 2), log.gaps[-2])
+        np.testing.assert_array_equal([0], log.channels(2, 6))
+        log.reset()
+        self.assertEqual(0, log.dropped)
+        self.assertEqual(0, len(log.channels(2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,29 @@ class TestData(unittest.TestCase):
             calc.frames_acquired_from_camera_signal(y_values),
         )
 
+    def test_compact_frames_acquired(self):
+        """Test that the compact form returns the indices at which the frame count increases"""
+        camera_signal = np.array([1, 1, 0, 0, 1, 0, 1, 1, 0, 0], dtype=bool)
+        frames_acquired = calc.frames_acquired_from_camera_signal(camera_signal)
+        edges = calc.frames_acquired_from_camera_signal(camera_signal, compact=True)
+        np.testing.assert_array_equal([3, 5], edges)
+        np.testing.assert_array_equal([0, 0, 0, 1, 1, 2, 2, 2, 2, 2], frames_acquired)
+        self.assertEqual(
+            calc.get_baseline_frame_indices([[0, 3], [4, 9]], frames_acquired),
+            calc.get_baseline_frame_indices([[0, 3], [4, 9]], edges, compact=True),
+        )
+
+    def test_extend_light_signal(self):
+        """Test that the lights are set high around each of their transitions"""
+        lights = np.zeros((2, 20), dtype=bool)
+        lights[0, 5:8] = True
+        lights[1, 12:13] = True
+        camera = np.zeros(20, dtype=bool)
+        camera[4:9] = True
+        extended = calc.extend_light_signal(lights, camera)
+        np.testing.assert_array_equal(np.flatnonzero(extended[0]), np.arange(2, 9))
+        np.testing.assert_array_equal(np.flatnonzero(extended[1]), np.arange(9, 14))
+
     def test_average_baseline(self):
         """Test that the baselines are correctly averaged"""
         frames = [np.array([[1, 2, 3], [4, 5, 6]]), np.array([[7, 8, 9], [10, 11, 12]])]
@@ -35,6 +58,17 @@ class TestData(unittest.TestCase):
         )
         pass
 
+    def test_separate_images_with_channels(self):
+        """Test that frames are separated by their recorded light channel"""
+        frames = np.arange(6)[:, None, None]
+        channels = np.array([0, 1, 0, 0, 1, 0])
+        red, ir = calc.separate_images(["red", "ir"], frames, channels)
+        np.testing.assert_array_equal([0, 2, 3, 5], red[:, 0, 0])
+        np.testing.assert_array_equal([1, 4], ir[:, 0, 0])
+        self.assertEqual(0, calc.light_frame_index(np.array([1, 4]), 0))
+        self.assertEqual(0, calc.light_frame_index(np.array([1, 4]), 3))
+        self.assertEqual(1, calc.light_frame_index(np.array([1, 4]), 5))
+
     def test_map_activation(self):
         """Test that the activation is correctly mapped to the baseline"""
         frames = [np.array([[1, 2, 3], [4, 5, 6]]), np.array([[7, 8, 9], [10, 11, 12]])]
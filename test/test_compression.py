@@ -0,0 +1,108 @@
+import unittest
+import tempfile
+import sys
+import os
+import zlib
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import CHUNK_SIZE, FrameBuffer
+from src.compression import (
+    LEGACY_FRAME_HEADER,
+    CompressedChunk,
+    bitshuffle,
+    decode_frame,
+    encode_frame,
+    encoder_throughput,
+    write_chunk,
+)
+from src.integral import build_integral_index
+from src.recording import FrameStack, open_frames
+from src.writers import ChunkWriter
+import numpy as np
+
+
+class TestCompression(unittest.TestCase):
+    def test_frames_round_trip(self):
+        """Test that keyframes and differences of 12 and 16-bit frames are lossless"""
+        random_generator = np.random.default_rng(0)
+        for maximum in (4096, 65536):
+            first, second = random_generator.integers(0, maximum, (2, 9, 7), np.uint16)
+            np.testing.assert_array_equal(
+                first, decode_frame(encode_frame(first), (9, 7), np.uint16)
+            )
+            np.testing.assert_array_equal(
+                second,
+                decode_frame(encode_frame(second, first), (9, 7), np.uint16, first),
+            )
+        constant = np.zeros((9, 7), np.uint16)
+        np.testing.assert_array_equal(
+            constant, decode_frame(encode_frame(constant), (9, 7), np.uint16)
+        )
+
+    def test_legacy_frame(self):
+        """Test that frames with every plane compressed by zlib are still decoded"""
+        frame = np.random.default_rng(2).integers(0, 4096, (9, 7), np.uint16)
+        planes = bitshuffle(frame.ravel(), 12)
+        data = LEGACY_FRAME_HEADER.pack(12, 0) + zlib.compress(
+            b"".join(packed for packed, ones in planes)
+        )
+        np.testing.assert_array_equal(
+            frame, decode_frame(data, (9, 7), np.uint16, legacy=True)
+        )
+
+    def test_compressed_chunk(self):
+        """Test that frames, windows and frame selections are decoded from a chunk"""
+        random_generator = np.random.default_rng(1)
+        background = random_generator.integers(500, 3500, (1, 16, 12))
+        frames = (
+            (background + random_generator.normal(0, 20, (21, 16, 12)))
+            .clip(0, 4095)
+            .astype(np.uint16)
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "0.wfz")
+            self.assertLess(write_chunk(path, frames), frames.nbytes)
+            chunk = CompressedChunk(path, (16, 12), np.uint16)
+            self.assertEqual((21, 16, 12), chunk.shape)
+            np.testing.assert_array_equal(frames, np.asarray(chunk))
+            np.testing.assert_array_equal(frames[13], chunk[13])
+            window = chunk[:, 2:9, 5:]
+            self.assertEqual((21, 7, 7), window.shape)
+            np.testing.assert_array_equal(
+                frames[[20, 3, 9], 2:9, 5:], window[np.array([20, 3, 9])]
+            )
+            np.testing.assert_array_equal(
+                frames[5:17:3, 1:4], FrameStack([chunk])[5:17:3, 1:4]
+            )
+
+    def test_encoder_throughput(self):
+        """Test that the throughput of the encoder pool is measured"""
+        self.assertGreater(encoder_throughput((64, 64), workers=2), 0)
+
+    def test_compressed_writer(self):
+        """Test that the chunk writer compresses chunks that open_frames decodes"""
+        buffer = FrameBuffer((8, 8), capacity=2 * CHUNK_SIZE)
+        frames = np.random.default_rng(2).integers(
+            0, 4096, (CHUNK_SIZE + 10, 8, 8), np.uint16
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            writer = ChunkWriter(buffer, directory, lights=["red", "ir"], compress=True)
+            writer.start()
+            for index in range(0, len(frames), 50):
+                buffer.write(frames[index : index + 50], timeout=1)
+                writer.poll()
+            writer.close()
+            self.assertFalse(os.path.isfile(os.path.join(directory, "frames.npy")))
+            recorded = open_frames(directory)
+            self.assertEqual(frames.shape, recorded.shape)
+            np.testing.assert_array_equal(frames[CHUNK_SIZE - 3 :], recorded[-13:])
+            np.testing.assert_array_equal(
+                frames[1::2, 3], np.asarray(recorded)[1::2, 3]
+            )
+            index = build_integral_index(directory)
+            self.assertEqual(len(frames), len(index))
+            del index
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+import tempfile
+import threading
+import json
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import CHUNK_SIZE, FrameBuffer
+from src.calculations import separate_images
+from src.container import Dataset, create_dataset, light_path, save_experiment
+from src.recording import open_frames
+from src.writers import ChunkWriter
+import numpy as np
+
+
+class TestContainer(unittest.TestCase):
+    def test_dataset_reads_needed_chunks(self):
+        """Test that appended frames are read back touching only the chunks they need"""
+        frames = np.random.default_rng(0).integers(0, 4096, (23, 10, 9), np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            dataset = create_dataset(directory, (0, 10, 9), (4, 4, 4), np.uint16)
+            for start in range(0, len(frames), 5):
+                dataset.append(frames[start : start + 5])
+            dataset.flush()
+            dataset = Dataset(directory)
+            self.assertEqual(frames.shape, dataset.shape)
+            np.testing.assert_array_equal(frames, np.asarray(dataset))
+            os.remove(dataset.chunk_path((0, 0, 0)))
+            os.remove(dataset.chunk_path((5, 2, 2)))
+            roi = dataset[:, 5:8, 4:8]
+            self.assertEqual((23, 3, 4), roi.shape)
+            np.testing.assert_array_equal(frames[:, 5:8, 4:8], np.asarray(roi))
+            np.testing.assert_array_equal(frames[9, 4:8, 4:8], dataset[9][4:8, 4:8])
+            np.testing.assert_array_equal(frames[21, 1], dataset[21, 1])
+            np.testing.assert_array_equal(
+                frames[[22, 17], 4:, :4], dataset[4:][np.array([-1, 13]), 4:, :4]
+            )
+
+    def test_light_datasets(self):
+        """Test that each light is written to its own dataset and read in acquisition order"""
+        buffer = FrameBuffer((8, 8), capacity=2 * CHUNK_SIZE)
+        frames = np.random.default_rng(1).integers(
+            0, 4096, (CHUNK_SIZE + 10, 8, 8), np.uint16
+        )
+        channels = np.arange(len(frames)) % 2
+        channels[101:] = 1 - channels[101:]
+        with tempfile.TemporaryDirectory() as directory:
+            writer = ChunkWriter(
+                buffer,
+                directory,
+                extents=(1, 7, 0, 5),
+                lights=["red", "ir"],
+                workers=2,
+                light_datasets=True,
+                channels=lambda start, stop: channels[start:stop],
+            )
+            writer.start()
+            for index in range(0, len(frames), 50):
+                buffer.write(frames[index : index + 50], timeout=1)
+                writer.poll()
+            writer.close()
+            ir = Dataset(light_path(directory, "ir"))
+            self.assertEqual((np.sum(channels == 1), 5, 6), ir.shape)
+            np.testing.assert_array_equal(frames[channels == 1, :5, 1:7], ir)
+            recorded = open_frames(directory)
+            np.testing.assert_array_equal(frames[:, :5, 1:7], recorded)
+            red, ir = separate_images(
+                ["red", "ir"],
+                recorded,
+                np.load(os.path.join(directory, "channels.npy")),
+            )
+            np.testing.assert_array_equal(frames[channels == 0, 2:4, 1:7], red[:, 2:4])
+
+    def test_failed_chunk_is_skipped(self):
+        """Test that a chunk failing to be written does not block the other writer threads"""
+        buffer = FrameBuffer((4, 4), capacity=2 * CHUNK_SIZE)
+        frames = np.arange(3 * CHUNK_SIZE, dtype=np.uint16)[:, None, None] * np.ones(
+            (4, 4), dtype=np.uint16
+        )
+
+        def channels(start, stop):
+            if start == CHUNK_SIZE:
+                raise ValueError("Unknown channels")
+            return np.arange(start, stop) % 2
+
+        with tempfile.TemporaryDirectory() as directory:
+            writer = ChunkWriter(
+                buffer,
+                directory,
+                lights=["red", "ir"],
+                workers=2,
+                light_datasets=True,
+                channels=channels,
+            )
+            writer.start()
+            for index in range(0, len(frames), 100):
+                buffer.write(frames[index : index + 100], timeout=1)
+                writer.poll()
+            closing = threading.Thread(target=writer.close, daemon=True)
+            closing.start()
+            closing.join(10)
+            self.assertFalse(closing.is_alive())
+            kept = np.r_[0:CHUNK_SIZE, 2 * CHUNK_SIZE : 3 * CHUNK_SIZE]
+            np.testing.assert_array_equal(frames[kept], open_frames(directory))
+
+    def test_save_experiment(self):
+        """Test that the metadata and signals of an experiment are saved in the recording"""
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "metadata.json"), "w") as file:
+                json.dump({"Framerate": 57}, file)
+            stim_signal = np.random.default_rng(2).random((2, 1000))
+            light_signal = np.random.default_rng(3).random((3, 40)) > 0.5
+            np.save(os.path.join(directory, "stim_signal.npy"), stim_signal)
+            np.save(os.path.join(directory, "light_signal.npy"), light_signal)
+            data = os.path.join(directory, "data")
+            os.mkdir(data)
+            save_experiment(data, directory)
+            with open(os.path.join(data, "attributes.json")) as file:
+                self.assertEqual({"Framerate": 57}, json.load(file))
+            np.testing.assert_array_equal(
+                stim_signal, Dataset(os.path.join(data, "signals", "stim_signal"))
+            )
+            np.testing.assert_array_equal(
+                light_signal, Dataset(os.path.join(data, "signals", "light_signal"))
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.integral import build_integral_index, open_integral_index, snap_extents
+from src.timecourse import TimeCourseEngine
+from src.recording import Recording
+from src.calculations import get_timecourse, shrink_array
+import numpy as np
+
+
+class TestIntegralIndex(unittest.TestCase):
+    def test_snap_extents(self):
+        """Test that ROI extents are snapped to blocks inside the frame"""
+        self.assertEqual((4, 12, 0, 4), snap_extents((5.2, 13.9, 2.4, 0.3), (16, 16)))
+        self.assertEqual((12, 16, 8, 12), snap_extents((15, 30, 9.1, 9.6), (16, 16)))
+
+    def test_time_course_from_index(self):
+        """Test that block aligned ROI means from the index match the pixel means"""
+        frames = np.random.default_rng(0).integers(0, 4096, (30, 16, 12), np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(open_integral_index(directory))
+            recording = Recording(directory, (16, 12), ["red", "ir"])
+            recording.write(0, frames)
+            recording.close()
+            build_integral_index(directory, chunk_size=7)
+            index = open_integral_index(directory)
+            extents = index.snap((3, 9.7, 5, 14))
+            self.assertEqual((4, 8, 4, 16), extents)
+            np.testing.assert_allclose(
+                get_timecourse(shrink_array(frames, extents), 0, 29),
+                index.time_course(extents),
+            )
+            np.testing.assert_allclose(
+                get_timecourse(frames, 0, 29), index.time_course()
+            )
+            engine = TimeCourseEngine()
+            engine.use_index(index, [np.arange(0, 30, 2), np.arange(1, 30, 2)])
+            np.testing.assert_allclose(
+                get_timecourse(shrink_array(frames[1::2], extents), 0, 14),
+                engine.compute(frames[1::2], 1, (3, 9.7, 5, 14)),
+            )
+            engine.close()
+            del index
+
+
+if __name__ == "__main__":
+    unittest.main()
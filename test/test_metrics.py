@@ -0,0 +1,65 @@
+import unittest
+import tempfile
+import json
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.metrics import LatencyHistogram, MetricsRegistry, health_summary
+import numpy as np
+
+
+class TestMetrics(unittest.TestCase):
+    def test_latency_histogram(self):
+        """Test that quantiles are estimated by the upper bound of their bucket"""
+        histogram = LatencyHistogram(bounds=(0.01, 0.1, 1))
+        for duration in [0.005] * 98 + [0.05, 3]:
+            histogram.observe(duration)
+        np.testing.assert_array_equal([98, 1, 0, 1], histogram.counts)
+        self.assertEqual(0.01, histogram.quantile(0.5))
+        self.assertEqual(0.1, histogram.quantile(0.99))
+        self.assertEqual(3, histogram.quantile(1))
+        self.assertEqual(100, histogram.summary()["count"])
+
+    def test_samples_and_save(self):
+        """Test that samples hold counters, rates, gauges and latencies and are saved"""
+        registry = MetricsRegistry(window_size=2)
+        queue = [3]
+        registry.register("writer.queue", lambda: queue[0])
+        registry.increment("camera.frames", 10)
+        registry.set("camera.behind", 2)
+        with registry.timer("camera.read"):
+            pass
+        sample = registry.sample()
+        self.assertEqual(10, sample["counters"]["camera.frames"])
+        self.assertLess(0, sample["rates"]["camera.frames"])
+        self.assertEqual(3, sample["gauges"]["writer.queue"])
+        self.assertEqual(1, sample["latencies"]["camera.read"]["count"])
+        queue[0] = 1
+        registry.sample()
+        registry.sample()
+        self.assertEqual(2, len(registry.samples))
+        self.assertEqual(0, registry.latest()["rates"]["camera.frames"])
+        self.assertIn("Dropped: 0, behind: 2", health_summary(registry.latest()))
+        with tempfile.TemporaryDirectory() as directory:
+            registry.save(os.path.join(directory, "metrics.json"))
+            with open(os.path.join(directory, "metrics.json")) as file:
+                saved = json.load(file)
+        self.assertEqual(10, saved["Counters"]["camera.frames"])
+        self.assertEqual(1, saved["Gauges"]["writer.queue"])
+        self.assertEqual(2, len(saved["Samples"]))
+        registry.reset()
+        self.assertIsNone(registry.latest())
+
+    def test_sampling_thread(self):
+        """Test that the sampling thread records samples until it is stopped"""
+        registry = MetricsRegistry(interval=0.01)
+        registry.start()
+        registry.increment("preview.frames")
+        registry.stop()
+        self.assertLess(0, len(registry.samples))
+        self.assertEqual(1, registry.latest()["counters"]["preview.frames"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import tempfile
+import time
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.pyramid import (
+    PreviewScheduler,
+    build_preview_pyramid,
+    downsample,
+    open_preview_pyramid,
+    scrub_level,
+)
+from src.recording import Recording
+import numpy as np
+
+
+class TestPreviewPyramid(unittest.TestCase):
+    def test_pyramid_levels(self):
+        """Test that each level averages blocks of pixels of the recording"""
+        frames = np.random.default_rng(0).integers(0, 4096, (9, 32, 32), np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual([], open_preview_pyramid(directory))
+            recording = Recording(directory, (32, 32), ["red"])
+            recording.write(0, frames)
+            recording.close()
+            levels = build_preview_pyramid(directory, chunk_size=4)
+            self.assertEqual([(9, 8, 8), (9, 2, 2)], [level.shape for level in levels])
+            np.testing.assert_array_equal(downsample(frames, 4), levels[0])
+            np.testing.assert_allclose(
+                frames.reshape(9, 2, 16, 2, 16).mean(axis=(2, 4)), levels[1], atol=1
+            )
+            self.assertIs(levels[1], scrub_level(levels, 4))
+            self.assertIs(levels[0], scrub_level(levels))
+            del levels
+
+    def test_scheduler_renders_latest_request(self):
+        """Test that requests made while rendering are coalesced and refined when idle"""
+        rendered = []
+
+        def render(index, full):
+            time.sleep(0.02)
+            rendered.append((index, full))
+
+        scheduler = PreviewScheduler(render, refine_delay=0.05)
+        for index in range(20):
+            scheduler.request(index)
+            time.sleep(0.002)
+        time.sleep(0.3)
+        scheduler.close()
+        self.assertLess(len(rendered), 20)
+        self.assertEqual([(19, False), (19, True)], rendered[-2:])
+        self.assertEqual(1, sum(full for _, full in rendered))
+
+
+if __name__ == "__main__":
+    unittest.main()
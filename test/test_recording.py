@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.recording import FrameStack, Recording, open_frames
+from src.calculations import separate_images, shrink_array
+import numpy as np
+
+
+class TestRecording(unittest.TestCase):
+    def test_recording_is_trimmed(self):
+        """Test that a recording grown by chunks is trimmed to the written frames"""
+        with tempfile.TemporaryDirectory() as directory:
+            recording = Recording(directory, (3, 2), ["ir"])
+            frames = np.arange(30, dtype=np.uint16).reshape(5, 3, 2)
+            recording.write(0, frames[:2])
+            recording.write(2, frames[2:])
+            recording.close()
+            loaded = np.load(os.path.join(directory, "frames.npy"))
+            np.testing.assert_array_equal(frames, loaded)
+
+    def test_legacy_chunks_are_ordered(self):
+        """Test that numbered chunk files are opened in acquisition order"""
+        with tempfile.TemporaryDirectory() as directory:
+            for index in range(11):
+                np.save(
+                    os.path.join(directory, f"{index}.npy"),
+                    np.full((1, 2, 2), index, dtype=np.uint16),
+                )
+            np.testing.assert_array_equal(
+                np.arange(11), open_frames(directory)[:, 0, 0]
+            )
+
+    def test_legacy_chunks_are_lazy(self):
+        """Test that legacy chunks are presented as one stack read only when indexed"""
+        frames = np.random.default_rng(0).integers(0, 4096, (23, 6, 5), np.uint16)
+        with tempfile.TemporaryDirectory() as directory:
+            for index, start in enumerate(range(0, 23, 7)):
+                np.save(
+                    os.path.join(directory, f"{index}.npy"), frames[start : start + 7]
+                )
+            stack = open_frames(directory)
+            self.assertIsInstance(stack, FrameStack)
+            self.assertEqual(frames.shape, stack.shape)
+            for lazy, loaded in zip(
+                separate_images(["red", "ir"], stack),
+                separate_images(["red", "ir"], frames),
+            ):
+                np.testing.assert_array_equal(loaded[5], lazy[5])
+                cropped = shrink_array(lazy, (1, 4, 2, 5))
+                self.assertIsInstance(cropped, FrameStack)
+                np.testing.assert_array_equal(
+                    shrink_array(loaded, (1, 4, 2, 5))[::-1], np.asarray(cropped[::-1])
+                )
+            del stack, lazy, cropped
+
+
+if __name__ == "__main__":
+    unittest.main()
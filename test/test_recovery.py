@@ -0,0 +1,103 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import CHUNK_SIZE, FrameBuffer
+from src.journal import (
+    JOURNAL_FILE,
+    decode_channels,
+    encode_channels,
+    read_journal,
+    recording_open,
+)
+from src.recording import open_frames
+from src.recovery import main, recover
+from src.writers import ChunkWriter
+import numpy as np
+
+
+def crash(writer):
+    """Stop the writer threads without closing the recording, as a crash would"""
+    for _ in writer.threads:
+        writer.queue.put(None)
+    for thread in writer.threads:
+        thread.join()
+    writer.journal.close()
+
+
+class TestRecovery(unittest.TestCase):
+    def setUp(self):
+        self.frames = np.arange(2 * CHUNK_SIZE + 10, dtype=np.uint16)[
+            :, None, None
+        ] * np.ones((4, 4), dtype=np.uint16)
+        self.channels = np.arange(len(self.frames)) % 2
+        self.channels[500:] = (self.channels[500:] + 1) % 2
+
+    def record(self, directory, **options):
+        """Record the frames and crash before the last partial chunk is written"""
+        buffer = FrameBuffer((4, 4), capacity=2 * CHUNK_SIZE)
+        writer = ChunkWriter(
+            buffer,
+            directory,
+            lights=["red", "ir"],
+            workers=2,
+            channels=lambda start, stop: self.channels[start:stop],
+            **options,
+        )
+        writer.start()
+        for index in range(0, len(self.frames), 7):
+            buffer.write(self.frames[index : index + 7], timeout=1)
+            writer.poll()
+        crash(writer)
+
+    def test_layouts_are_recovered(self):
+        """Test that every committed chunk is recovered with the channels of its frames"""
+        for options in ({}, {"compress": True}, {"light_datasets": True}):
+            with tempfile.TemporaryDirectory() as directory:
+                self.record(directory, **options)
+                with open(os.path.join(directory, JOURNAL_FILE), "a") as file:
+                    file.write('{"Event": "Chunk", "Sta')
+                self.assertEqual(2 * CHUNK_SIZE, recover(directory))
+                recorded = open_frames(directory)
+                np.testing.assert_array_equal(
+                    self.frames[: 2 * CHUNK_SIZE], np.asarray(recorded)
+                )
+                np.testing.assert_array_equal(
+                    self.channels[: 2 * CHUNK_SIZE],
+                    np.load(os.path.join(directory, "channels.npy")),
+                )
+                self.assertEqual("Recovered", read_journal(directory)[-1]["Event"])
+                del recorded
+
+    def test_missing_chunk_cuts_recording(self):
+        """Test that a compressed chunk lost on disk cuts the recording before it"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.record(directory, compress=True)
+            os.remove(os.path.join(directory, f"{CHUNK_SIZE}.wfz"))
+            self.assertEqual(0, main([directory]))
+            np.testing.assert_array_equal(
+                self.frames[:CHUNK_SIZE], np.asarray(open_frames(directory))
+            )
+
+    def test_open_recording(self):
+        """Test that a recording is open until it is recovered"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertFalse(recording_open(directory))
+            self.record(directory)
+            self.assertTrue(recording_open(directory))
+            recover(directory)
+            self.assertFalse(recording_open(directory))
+
+    def test_channels_are_encoded_by_phase(self):
+        """Test that the light channels are encoded as a few runs of their phase"""
+        runs = encode_channels(self.channels[100:900], 100, 2)
+        self.assertEqual([[100, 0], [500, 1]], runs)
+        np.testing.assert_array_equal(
+            self.channels[100:900], decode_channels(runs, 100, 800, 2)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
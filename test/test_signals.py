@@ -0,0 +1,101 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src import controls
+from src.controls import Camera, DAQ, Instrument
+from src.signals import (
+    decode_runs,
+    encode_runs,
+    line_changes,
+    load_signals,
+    pack_lines,
+    save_signals,
+    unpack_lines,
+)
+from src.waveforms import make_segment
+from src.calculations import find_camera_edges
+import numpy as np
+
+
+class TestSignals(unittest.TestCase):
+    def test_packed_lines(self):
+        """Test that digital lines are packed in one byte per sample for up to 8 lines"""
+        lines = np.random.default_rng(0).random((6, 100)) > 0.5
+        packed = pack_lines(list(lines))
+        self.assertEqual((1, 100), packed.shape)
+        np.testing.assert_array_equal(lines, unpack_lines(packed, 6))
+        np.testing.assert_array_equal(lines[0] + 2 * lines[1], packed[0] & 3)
+        lines = np.random.default_rng(1).random((10, 50)) > 0.5
+        np.testing.assert_array_equal(lines, unpack_lines(pack_lines(lines), 10))
+        for line in (0, 9):
+            np.testing.assert_array_equal(
+                np.flatnonzero(np.diff(lines[line])),
+                line_changes(pack_lines(lines), line),
+            )
+
+    def test_streamed_runs(self):
+        """Test that runs encoded block by block match the runs of the whole signal"""
+        signal = np.repeat([0, 5, 5, 0, 2.5, 0], [7, 3, 4, 10, 1, 5])
+        starts, values = encode_runs(signal)
+        np.testing.assert_array_equal([0, 7, 14, 24, 25], starts)
+        np.testing.assert_array_equal(signal, decode_runs(starts, values, len(signal)))
+        blocks = [encode_runs(signal[:10]), encode_runs(signal[10:], 10, signal[9])]
+        np.testing.assert_array_equal(starts, np.concatenate([b[0] for b in blocks]))
+        np.testing.assert_array_equal(values, np.concatenate([b[1] for b in blocks]))
+
+    def test_saved_signals(self):
+        """Test that encoded and raw signals are loaded the same way"""
+        signals = np.zeros((2, 3000))
+        signals[0, 100:400] = 5
+        with tempfile.TemporaryDirectory() as directory:
+            save_signals(os.path.join(directory, "raw"), signals, encode=False)
+            save_signals(os.path.join(directory, "encoded"), signals)
+            for name in ("raw", "encoded"):
+                np.testing.assert_array_equal(
+                    signals, load_signals(os.path.join(directory, name))
+                )
+
+    def test_daq_saves_encoded_signals(self):
+        """Test that the DAQ saves the same signals encoded, raw and streamed"""
+        config = dict(controls.config)
+        controls.config.update({"Simulated": True, "Binning": 256})
+        try:
+            lights = [Instrument("port0/line0", "red"), Instrument("port0/line3", "ir")]
+            daq = DAQ("dev1", lights, [], Camera("port0/line4", "camera"), 40, 0.01)
+            time_values = np.linspace(0, 1, 3000)
+            stimulation = np.where(time_values > 0.5, 5.0, 0.0)
+            stim_values = (stimulation, np.zeros(3000), time_values > 0.2)
+            daq.launch("test", time_values, stim_values)
+            self.assertEqual((1, 3000), daq.digital_lines.shape)
+            np.testing.assert_array_equal(
+                stim_values[2][:-1], daq.digital_signals()[-1][:-1]
+            )
+            self.assertIsNone(daq.d_stim_signal)
+            np.testing.assert_array_equal(
+                find_camera_edges(daq.digital_signals()[-2]), daq.camera_edges()
+            )
+            with tempfile.TemporaryDirectory() as directory:
+                daq.save(directory)
+                raw = load_signals(os.path.join(directory, "stim_signal"))
+                lights_raw = np.load(os.path.join(directory, "light_signal.npy"))
+                controls.config["Encode Signals"] = True
+                daq.save(directory)
+                np.testing.assert_array_equal(
+                    raw, load_signals(os.path.join(directory, "stim_signal"))
+                )
+                daq.streaming = True
+                daq.launch("test", None, None, [make_segment(2.5)])
+                daq.save(directory)
+                streamed = load_signals(os.path.join(directory, "stim_signal"))
+                self.assertEqual((2, 7500), streamed.shape)
+            self.assertEqual(3, len(lights_raw))
+        finally:
+            controls.config.clear()
+            controls.config.update(config)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import unittest
+import threading
+import enum
+import time
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src import controls
+from src.controls import Camera, DAQ, Instrument
+from src.buffers import FrameBuffer
+from src.metrics import metrics
+from src.simulation import SimulatedCamera, SimulatedTask
+from src.waveforms import make_segment
+import numpy as np
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.config = dict(controls.config)
+        controls.config.update({"Simulated": True, "Binning": 8})
+
+    def tearDown(self):
+        controls.config.clear()
+        controls.config.update(self.config)
+
+    def make_daq(self):
+        """Create a DAQ whose first camera pulse starts at the first sample"""
+        camera = Camera("port0/line4", "camera")
+        lights = [Instrument("port0/line0", "red"), Instrument("port0/line3", "ir")]
+        return DAQ("dev1", lights, [], camera, 40, 0.01)
+
+    def test_frames_follow_camera_signal(self):
+        """Test that the simulated camera emits one 12-bit frame per camera pulse"""
+        daq = self.make_daq()
+        time_values = np.linspace(0, 0.5, 1500)
+        stim_values = (np.zeros(1500), np.zeros(1500), np.zeros(1500, dtype=bool))
+        daq.launch("test", time_values, stim_values)
+        daq.write_waveforms()
+        self.assertEqual(len(daq.camera_edges()) + 1, daq.camera.frames_read)
+        self.assertEqual(
+            daq.camera.frames_read, metrics.latest()["counters"]["camera.frames"]
+        )
+        self.assertEqual((128, 128), daq.camera.buffer.shape)
+        self.assertLess(daq.camera.buffer.view(0, 1).max(), 4096)
+
+    def test_streamed_frames_follow_camera_signal(self):
+        """Test that streamed protocols are generated and acquired until the end"""
+        daq = self.make_daq()
+        daq.streaming = True
+        daq.launch("test", None, None, [make_segment(1.5)])
+        daq.write_waveforms()
+        self.assertEqual(len(daq.camera_edges()) + 1, daq.camera.frames_read)
+
+    def test_nidaqmx_sample_modes(self):
+        """Test that continuous tasks configured with nidaqmx enums are not finite"""
+        modes = enum.Enum("AcquisitionType", "FINITE CONTINUOUS")
+        task = SimulatedTask("test")
+        task.timing.cfg_samp_clk_timing(
+            3000, sample_mode=modes.CONTINUOUS, samps_per_chan=30
+        )
+        task.write(np.zeros((1, 3000)))
+        task.start()
+        time.sleep(0.05)
+        self.assertLess(30, task.generated())
+        self.assertFalse(task.is_task_done())
+        task.stop()
+
+    def test_dropped_frames(self):
+        """Test that frames overwritten in the framegrabber are logged as dropped"""
+        daq = self.make_daq()
+        camera = daq.camera
+        camera.initialize(daq)
+        camera.cam = SimulatedCamera(camera.buffer.shape, framerate=200, buffer_size=3)
+        camera.cam.start_acquisition()
+        time.sleep(0.1)
+        camera.store(*camera.read_frames())
+        self.assertEqual(3, camera.frames_read)
+        camera.cam.wait_for_frame(timeout=1)
+        camera.store(*camera.read_frames())
+        time.sleep(0.1)
+        camera.store(*camera.read_frames())
+        log = camera.frame_log
+        self.assertEqual(camera.frames_read, log.count)
+        self.assertLess(0, log.dropped)
+        self.assertEqual(
+            log.indices[log.count - 1] - log.indices[0] + 1,
+            camera.frames_read + log.dropped,
+        )
+
+    def test_full_buffer_drops_frames(self):
+        """Test that frames the buffer cannot hold are logged as dropped, not overwritten"""
+        daq = self.make_daq()
+        camera = daq.camera
+        camera.buffer = FrameBuffer(camera.buffer.shape, capacity=4)
+        camera.initialize(daq)
+        camera.buffer.add_cursor("saver")
+        frames = np.arange(8, dtype=np.uint16)[:, None, None] * np.ones(
+            camera.buffer.shape, dtype=np.uint16
+        )
+        camera.store(list(frames[:6]), np.arange(6))
+        self.assertEqual(4, camera.frames_read)
+        self.assertEqual(2, camera.frame_log.dropped)
+        np.testing.assert_array_equal(
+            [0, 1, 2, 3], camera.buffer.read("saver", 4)[:, 0, 0]
+        )
+        camera.buffer.advance("saver", 2)
+        camera.store(list(frames[6:]), np.arange(6, 8))
+        self.assertEqual(6, camera.frames_read)
+        np.testing.assert_array_equal([0, 1, 0, 1, 0, 1], camera.frame_log.channels(2))
+        np.testing.assert_array_equal(
+            [2, 3, 6, 7], camera.buffer.read("saver", 4)[:, 0, 0]
+        )
+
+    def test_trigger_and_stop(self):
+        """Test that a triggered acquisition starts on the trigger and stops on request"""
+        daq = self.make_daq()
+        daq.set_trigger("port1/line0")
+        time_values = np.linspace(0, 0.5, 1500)
+        stim_values = (np.zeros(1500), np.zeros(1500), np.zeros(1500, dtype=bool))
+        daq.launch("test", time_values, stim_values)
+        daq.write_waveforms()
+        self.assertEqual(len(daq.camera_edges()) + 1, daq.camera.frames_read)
+        daq.launch("test", time_values, stim_values)
+        thread = threading.Thread(target=daq.write_waveforms)
+        thread.start()
+        time.sleep(0.1)
+        daq.stop_signal = True
+        thread.join(timeout=1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(0, daq.camera.frames_read)
+
+    def test_trigger_ports(self):
+        """Test that port0 triggers are detected by change detection and others polled"""
+        daq = self.make_daq()
+        for port in ("port0/line7", "port1/line0"):
+            daq.set_trigger(port)
+            start = time.perf_counter()
+            daq.wait_for_trigger()
+            self.assertLessEqual(controls.TRIGGER_DELAY, daq.trigger_time - start)
+        daq.set_trigger("port1/line0")
+        thread = threading.Thread(target=daq.wait_for_trigger)
+        thread.start()
+        daq.stop_signal = True
+        thread.join(timeout=1)
+        self.assertFalse(thread.is_alive())
+
+    def test_hardware_trigger(self):
+        """Test that armed tasks start on the trigger and record their trigger offset"""
+        daq = self.make_daq()
+        daq.set_trigger("port1/line0")
+        time_values = np.linspace(0, 0.5, 1500)
+        stim_values = (np.zeros(1500), np.zeros(1500), np.zeros(1500, dtype=bool))
+        daq.launch("test", time_values, stim_values)
+        daq.write_waveforms()
+        self.assertEqual("Software", daq.trigger_mode)
+        self.assertLess(0, daq.trigger_offset)
+        self.assertTrue(daq.trigger_offset_measured)
+        daq.hardware_trigger = True
+        daq.launch("test", time_values, stim_values)
+        daq.write_waveforms()
+        self.assertEqual("Software", daq.trigger_mode)
+        daq.set_trigger("port1/line0", "PFI0")
+        daq.launch("test", time_values, stim_values)
+        daq.write_waveforms()
+        self.assertEqual("Hardware", daq.trigger_mode)
+        self.assertAlmostEqual(1 / 3000, daq.trigger_offset)
+        self.assertFalse(daq.trigger_offset_measured)
+        self.assertEqual(len(daq.camera_edges()) + 1, daq.camera.frames_read)
+        for task in daq.tasks:
+            self.assertIsNone(task.triggers.start_trigger.source)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.timecourse import TimeCourseEngine
+from src.recording import open_frames
+from src.calculations import get_timecourse, shrink_array
+import numpy as np
+
+
+class TestTimeCourseEngine(unittest.TestCase):
+    def test_chunked_time_course(self):
+        """Test that the chunked time course of a lazy stack matches the direct one"""
+        frames = np.random.default_rng(0).integers(0, 4096, (50, 8, 8), np.uint16)
+        engine = TimeCourseEngine(workers=3, chunk_size=7)
+        with tempfile.TemporaryDirectory() as directory:
+            for index, start in enumerate(range(0, 50, 20)):
+                np.save(
+                    os.path.join(directory, f"{index}.npy"), frames[start : start + 20]
+                )
+            stack = open_frames(directory)[1::2]
+            partials = []
+            values = engine.compute(stack, 1, (1, 5, 2, 7), partials.append)
+            del stack
+        engine.close()
+        np.testing.assert_allclose(
+            get_timecourse(shrink_array(frames[1::2], (1, 5, 2, 7)), 0, 24), values
+        )
+        for partial in partials:
+            self.assertEqual(len(values), len(partial))
+
+    def test_cached_time_course(self):
+        """Test that a time course is computed once for each light and ROI"""
+        frames = np.random.default_rng(1).random((10, 4, 4))
+        engine = TimeCourseEngine(chunk_size=4)
+        values = engine.compute(frames, 0, (0.2, 3.1, 1, 4))
+        self.assertIs(values, engine.compute(frames, 0, (0, 3, 1, 4)))
+        self.assertIsNot(values, engine.compute(frames, 1, (0, 3, 1, 4)))
+        engine.clear()
+        self.assertIsNot(values, engine.compute(frames, 0, (0, 3, 1, 4)))
+        engine.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import src.waveforms as waves
+from src.calculations import find_camera_edges, find_rising_indices
+import numpy as np
+
+
+class TestWaveforms(unittest.TestCase):
+    def test_render_segments(self):
+        """Test that rendered segments match the concatenated signals of each segment"""
+        square = ("square", 0, 0, 0, 2, 0.5, 3)
+        digital = ("square", 0, 0, 0, 5, 0.2, 5)
+        segments = [
+            waves.make_segment(1, (square, None, digital)),
+            waves.make_segment(0.5, baseline=True),
+            waves.make_segment(1, (square, None, None)),
+        ]
+        x_values, stim1, stim2, stim3, baselines = waves.render_segments(segments)
+        time = np.linspace(0, 1, 3000)
+        np.testing.assert_allclose(
+            np.concatenate((time, np.linspace(1, 1.5, 1500), time + 1.5)), x_values
+        )
+        signal = waves.square_signal(time, 2, 0.5, 3)
+        np.testing.assert_array_equal(
+            np.concatenate((signal, np.zeros(1500), signal)), stim1
+        )
+        self.assertFalse(stim2.any())
+        np.testing.assert_array_equal(waves.digital_square(time, 5, 0.2), stim3[:3000])
+        self.assertEqual([[3000, 4500]], baselines)
+
+    def test_segment_events(self):
+        """Test that the transitions of a protocol render to the rendered protocol"""
+        segments = [
+            waves.make_segment(1, (("square", 0, 0, 0, 2, 0.5, 3), None, None)),
+            waves.make_segment(0.5, baseline=True),
+            waves.make_segment(
+                2,
+                (
+                    ("random-square", 20, 0.1, 0.05, 0, 0, 0),
+                    ("square", 0, 0, 0, 33.3, 0.3, 2.5),
+                    ("square", 0, 0, 0, 57, 0.2, 5),
+                ),
+            ),
+        ]
+        np.random.seed(0)
+        rendered = waves.render_segments(segments)
+        np.random.seed(0)
+        events, baselines = waves.segment_events(segments)
+        self.assertEqual(rendered[4], baselines)
+        self.assertTrue(np.all(np.diff(events["sample"]) >= 0))
+        signals = np.hstack(list(waves.stream_events(events, 10500, 700)))
+        np.testing.assert_array_equal(
+            signals[:, 2000:3000], waves.render_events(events, 2000, 3000)
+        )
+        for index in range(3):
+            np.testing.assert_array_equal(rendered[index + 1], signals[index])
+
+    def test_events_of_different_heights(self):
+        """Test that touching intervals of different heights change the value at their boundary"""
+        segments = [
+            waves.make_segment(1, (("square", 0, 0, 0, 1, 1, 3), None, None)),
+            waves.make_segment(1, (("square", 0, 0, 0, 1, 1, 1), None, None)),
+            waves.make_segment(
+                1,
+                (("square", 0, 0, 0, 2, 0.5, 2), ("square", 0, 0, 0, 3, 0.5, 4), None),
+            ),
+            waves.make_segment(
+                1,
+                (("square", 0, 0, 0, 3, 0.5, 5), ("square", 0, 0, 0, 2, 0.5, 4), None),
+            ),
+        ]
+        rendered = waves.render_segments(segments)
+        events, _ = waves.segment_events(segments)
+        self.assertEqual((3000, 0, 1.0), tuple(events[1]))
+        signals = waves.render_events(events, 0, 12000)
+        for index in range(3):
+            np.testing.assert_array_equal(rendered[index + 1], signals[index])
+
+    def test_seeded_segments(self):
+        """Test that seeded random segments render the same wherever they are rendered"""
+        segments = [
+            waves.make_segment(
+                1, (("random-square", 5, 0.1, 0.05, 0, 0, 0), None, None), seed=3
+            ),
+            waves.make_segment(
+                2, (None, ("random-square", 4, 0.1, 0.2, 0, 0, 0), None), seed=4
+            ),
+        ]
+        np.random.seed(0)
+        rendered = waves.render_segments(segments)
+        events, _ = waves.segment_events(segments, np.random.RandomState(1))
+        signals = np.hstack(list(waves.stream_events(events, 9000, 1000)))
+        for index in range(3):
+            np.testing.assert_array_equal(rendered[index + 1], signals[index])
+        time, *sampled = waves.sample_events(events, 9000)
+        self.assertLess(len(time), 9000)
+        indices = np.rint(time * 3000).astype(int)
+        for index in range(3):
+            np.testing.assert_array_equal(signals[index][indices], sampled[index])
+
+    def test_light_events(self):
+        """Test that the light transitions give the camera edges of the dense signals"""
+        samples = np.arange(9000)
+        lights = np.stack(
+            [
+                waves.digital_square((samples - delay) / 3000, 20, 0.2)
+                & (samples >= delay)
+                for delay in (0, 75)
+            ]
+        )
+        lights[:, -1] = False
+        camera = np.max(lights, axis=0)
+        events = waves.light_events(9000, 40, 0.01, 2)
+        np.testing.assert_array_equal(
+            np.vstack((lights, camera)), waves.render_events(events, 0, 9000)
+        )
+        np.testing.assert_array_equal(
+            find_camera_edges(camera), find_camera_edges(events)
+        )
+        np.testing.assert_array_equal(
+            find_rising_indices(camera), find_rising_indices(events)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
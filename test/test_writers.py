@@ -0,0 +1,41 @@
+import unittest
+import tempfile
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from src.buffers import CHUNK_SIZE, FrameBuffer
+from src.writers import ChunkWriter
+from src.recording import open_frames
+import numpy as np
+
+
+class TestChunkWriter(unittest.TestCase):
+    def test_chunks_are_written(self):
+        """Test that full chunks and the last partial chunk are cropped and recorded"""
+        buffer = FrameBuffer((4, 4), capacity=2 * CHUNK_SIZE)
+        frames = np.arange(CHUNK_SIZE + 10, dtype=np.uint16)[:, None, None] * np.ones(
+            (4, 4), dtype=np.uint16
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            writer = ChunkWriter(
+                buffer, directory, extents=(1, 3, 0, 2), lights=["red", "ir"], workers=2
+            )
+            writer.start()
+            for index in range(0, len(frames), 7):
+                buffer.write(frames[index : index + 7], timeout=1)
+                writer.poll()
+            writer.close()
+            recorded = open_frames(directory)
+            self.assertIsInstance(recorded, np.memmap)
+            np.testing.assert_array_equal(frames[:, :2, 1:3], recorded)
+            np.testing.assert_array_equal(
+                [0, 1, 0], np.load(os.path.join(directory, "channels.npy"))[:3]
+            )
+            self.assertEqual(0, buffer.dropped)
+            self.assertGreater(writer.bandwidth, 0)
+            del recorded
+
+
+if __name__ == "__main__":
+    unittest.main()